@@ -1,17 +1,50 @@
 import os
-from flask import Flask, render_template
+import hashlib
+import json
+import threading
+import time
+from flask import Flask, render_template, request, make_response
 from flask_sqlalchemy import SQLAlchemy
-from datetime import date
+from datetime import date, datetime, timezone
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-TODAY = date.today()
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app)
 
+# model.py touches this file after publishing a new batch of predictions,
+# which invalidates the cached pages of every worker without a db query
+PREDICTIONS_STAMP = os.environ.get('PREDICTIONS_STAMP',
+                                   os.path.join(app.root_path,
+                                                'predictions.stamp')
+                                   )
+# seconds a cached page is served when there is no stamp file to check
+PAGE_CACHE_MAX_AGE = int(os.environ.get('PAGE_CACHE_MAX_AGE', 300))
+
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+SCOREBOARD_DIMENSIONS = ('season', 'team', 'bucket')
+
+# rendered index pages keyed by date
+_page_cache = {}
+_page_cache_lock = threading.Lock()
+
 
 class Prediction(db.Model):
     __tablename__ = 'predictions'
+    # kept in sync with the indexes and prediction_keys migrations of
+    # pipeline/migrations.py, which create them
+    __table_args__ = (
+        db.Index('ix_predictions_date_game_id', 'date', 'game_id',
+                 unique=True),
+        db.Index('ix_predictions_home_team_date', 'home_team', 'date'),
+        db.Index('ix_predictions_away_team_date', 'away_team', 'date'),
+    )
     game_id = db.Column(db.String, primary_key=True)
     date = db.Column(db.Date)
     venue = db.Column(db.String)
@@ -22,15 +55,212 @@ class Prediction(db.Model):
     away_prob = db.Column(db.Float)
     home_prob = db.Column(db.Float)
 
+    def to_dict(self):
+        return {'game_id': self.game_id,
+                'date': self.date,
+                'venue': self.venue,
+                'home_team': self.home_team,
+                'away_team': self.away_team,
+                'start_time': self.start_time,
+                'home_win': self.home_win,
+                'away_prob': self.away_prob,
+                'home_prob': self.home_prob
+                }
 
-@app.route('/')
-def index():
-    games = Prediction.query.filter_by(date=TODAY).all()
+
+class Scoreboard(db.Model):
+    """Running prediction accuracy aggregates, maintained by
+    pipeline/build_scoreboard.py"""
+    __tablename__ = 'scoreboard'
+    season = db.Column(db.String(8), primary_key=True)
+    dimension = db.Column(db.String, primary_key=True)
+    dim_key = db.Column(db.String, primary_key=True)
+    games = db.Column(db.Integer)
+    hits = db.Column(db.Integer)
+    home_wins = db.Column(db.Integer)
+    prob_sum = db.Column(db.Float)
+    log_loss_sum = db.Column(db.Float)
+    brier_sum = db.Column(db.Float)
+    updated_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        games = self.games or 0
+
+        def per_game(total):
+            return total / games if games else None
+
+        return {'season': self.season,
+                'dimension': self.dimension,
+                'key': self.dim_key,
+                'games': games,
+                'accuracy': per_game(self.hits),
+                'log_loss': per_game(self.log_loss_sum),
+                'brier': per_game(self.brier_sum),
+                'mean_home_prob': per_game(self.prob_sum),
+                'home_win_rate': per_game(self.home_wins),
+                'updated_at': self.updated_at
+                }
+
+
+def season_of(day):
+    # 8 char season string, seasons start in august
+    first_year = day.year if day.month > 7 else day.year - 1
+
+    return f'{first_year}{first_year + 1}'
+
+
+def get_predictions_stamp():
+    try:
+        return os.stat(PREDICTIONS_STAMP).st_mtime
+    except OSError:
+        return None
+
+
+def render_index(today):
+    games = Prediction.query.filter_by(date=today).all()
     if len(games) > 0:
         return render_template('index.html', games_today=True, games=games)
     else:
         return render_template('index.html', games_today=False, games=games)
 
 
+def get_cached_index(today):
+    """Returns the cached index page for today, rendering it when it is
+    missing, older than the last published predictions or, without a stamp
+    file, older than PAGE_CACHE_MAX_AGE"""
+    stamp = get_predictions_stamp()
+    now = time.time()
+
+    page = _page_cache.get(today)
+    if page is not None:
+        if stamp is not None and page['stamp'] == stamp:
+            return page
+        if stamp is None and now - page['rendered_at'] < PAGE_CACHE_MAX_AGE:
+            return page
+
+    html = render_index(today)
+    page = {'html': html,
+            'etag': hashlib.sha1(html.encode()).hexdigest(),
+            'last_modified': datetime.fromtimestamp(stamp or now,
+                                                    tz=timezone.utc),
+            'stamp': stamp,
+            'rendered_at': now
+            }
+    with _page_cache_lock:
+        # drop pages of previous days
+        _page_cache.clear()
+        _page_cache[today] = page
+
+    return page
+
+
+@app.route('/')
+def index():
+    page = get_cached_index(date.today())
+
+    response = make_response(page['html'])
+    response.set_etag(page['etag'])
+    response.last_modified = page['last_modified']
+    response.cache_control.no_cache = True
+
+    return response.make_conditional(request)
+
+
+def json_response(payload, status=200):
+    if orjson is not None:
+        body = orjson.dumps(payload)
+    else:
+        body = json.dumps(payload, default=lambda x: x.isoformat())
+
+    response = make_response(body, status)
+    response.mimetype = 'application/json'
+
+    return response
+
+
+def parse_date_arg(name, default):
+    value = request.args.get(name)
+    if value is None:
+        return default
+
+    return date.fromisoformat(value)
+
+
+@app.route('/api/predictions')
+def api_predictions():
+    """Predictions as JSON, ordered by date and game_id
+
+    Query parameters
+    ----------------
+    start - first date to include, YYYY-MM-DD, default today
+    end - last date to include, YYYY-MM-DD, default start
+    team - only games with this team home or away, ex. TOR
+    limit - page size, default API_PAGE_SIZE, at most API_MAX_PAGE_SIZE
+    after - cursor from the previous page's next field
+    """
+    try:
+        start = parse_date_arg('start', date.today())
+        end = parse_date_arg('end', start)
+        limit = min(max(int(request.args.get('limit', API_PAGE_SIZE)), 1),
+                    API_MAX_PAGE_SIZE)
+        after = request.args.get('after')
+        if after is not None:
+            after_date, after_game_id = after.split('_', 1)
+            after_date = date.fromisoformat(after_date)
+    except ValueError:
+        return json_response({'error': 'invalid query parameters'}, 400)
+
+    query = Prediction.query.filter(Prediction.date >= start,
+                                    Prediction.date <= end)
+
+    team = request.args.get('team')
+    if team is not None:
+        query = query.filter(db.or_(Prediction.home_team == team,
+                                    Prediction.away_team == team))
+
+    # keyset pagination, continue after the last (date, game_id) returned
+    if after is not None:
+        query = query.filter(db.tuple_(Prediction.date, Prediction.game_id)
+                             > db.tuple_(after_date, after_game_id))
+
+    games = (query.order_by(Prediction.date, Prediction.game_id)
+             .limit(limit + 1)
+             .all())
+
+    next_cursor = None
+    if len(games) > limit:
+        games = games[:limit]
+        next_cursor = f'{games[-1].date.isoformat()}_{games[-1].game_id}'
+
+    return json_response({'predictions': [g.to_dict() for g in games],
+                          'next': next_cursor})
+
+
+@app.route('/api/scoreboard')
+def api_scoreboard():
+    """Prediction accuracy of finished games as JSON, read from the running
+    aggregates so the cost does not grow with the number of predictions
+
+    Query parameters
+    ----------------
+    season - 8 char season string, ex. 20222023, default the current season
+    dimension - one of season, team or bucket (calibration by home win
+                probability), default season
+    """
+    season = request.args.get('season', season_of(date.today()))
+    dimension = request.args.get('dimension', 'season')
+    if dimension not in SCOREBOARD_DIMENSIONS:
+        return json_response({'error': 'invalid query parameters'}, 400)
+
+    rows = (Scoreboard.query
+            .filter_by(season=season, dimension=dimension)
+            .order_by(Scoreboard.dim_key)
+            .all())
+
+    return json_response({'season': season,
+                          'dimension': dimension,
+                          'scoreboard': [r.to_dict() for r in rows]})
+
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,266 @@
+"""Walk-forward backtest
+
+Replays the daily model over past seasons point in time: for every game date
+the model is trained on the games played strictly before that date and
+scores that date's games. Like the daily model, the scored games use each
+team's stats from its previous game, the features table's stats include the
+game itself. Dates are fanned out across a process pool. The
+feature matrix is written once to .npy files and memory mapped by every
+worker, so it is shared through the page cache rather than copied into each
+process.
+
+Reports accuracy, log loss, Brier score and a calibration table per season.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from sklearn.metrics import accuracy_score, brier_score_loss, log_loss
+from database_functions import get_db_uri, read_query
+from model import ALL_FEATURES, MODEL_PARAMS, build_pipeline
+from scraping_functions import get_season_string
+
+SQLALCHEMY_DATABASE_URI = get_db_uri()
+
+# dates with fewer earlier games than this are not scored
+MIN_TRAINING_ROWS = 200
+# chunks of dates handed to the pool per worker, for load balancing
+CHUNKS_PER_WORKER = 4
+CALIBRATION_BINS = 10
+
+# features column of each team_stats column, prefixed with home_ or away_
+TEAM_STATS_FEATURES = {'ff%_5v5_last_half': 'ff_last_half',
+                       'gf%_5v5_last_half': 'gf_last_half',
+                       'xgf%_5v5_last_half': 'xgf_last_half',
+                       'sh%_5v5_last_half': 'sh_last_half',
+                       'gf_per_min_pp_last_half': 'gf_min_pp',
+                       'xgf_per_min_pp_last_half': 'xgf_min_pp',
+                       'ga_per_min_pk_last_half': 'ga_min_pk',
+                       'xga_per_min_pk_last_half': 'xga_min_pk',
+                       'b2b': 'b2b'
+                       }
+
+# memory mapped arrays of the worker process, set by _init_worker
+_shared = {}
+
+
+def build_design_matrix(features):
+    """Sorts the features table by date and splits it into arrays
+
+    Returns
+    -------
+    dict of X (float feature matrix in ALL_FEATURES order), y (home team
+    won), dates (datetime64[D]) and game_ids"""
+    features = features.sort_values(['date', 'game_id'], kind='mergesort')
+
+    return {'X': features.loc[:, ALL_FEATURES].to_numpy(dtype=np.float64),
+            'y': features['home_team_won'].to_numpy(dtype=np.int8),
+            'dates': pd.to_datetime(features['date']).to_numpy()
+                       .astype('datetime64[D]'),
+            'game_ids': features['game_id'].to_numpy(dtype=str)
+            }
+
+
+def point_in_time_features(features, team_stats):
+    """Replaces the team stats of features with each team's stats from its
+    last game before the game date, as the daily model sees them when it
+    predicts the game
+
+    Parameters
+    ----------
+    features - DataFrame of the features table
+    team_stats - DataFrame of the team_stats table
+
+    Returns
+    -------
+    features sorted by date and game_id, stats are NaN for a team's first
+    game"""
+    df = features.sort_values(['date', 'game_id'], kind='mergesort')
+    df = df.reset_index(drop=True)
+    stats = team_stats.loc[:, ['team_id', 'date'] + list(TEAM_STATS_FEATURES)]
+    stats = stats.sort_values('date', kind='mergesort')
+
+    for side in ['home', 'away']:
+        columns = {column: f'{side}_{feature}'
+                   for column, feature in TEAM_STATS_FEATURES.items()}
+        side_stats = stats.rename(columns=dict(columns,
+                                               team_id=f'{side}_team_id'))
+        df = pd.merge_asof(df.drop(columns=list(columns.values())),
+                           side_stats,
+                           on='date',
+                           by=f'{side}_team_id',
+                           allow_exact_matches=False)
+
+    return df
+
+
+def save_shared(arrays, directory):
+    """Writes arrays to .npy files in directory for memory mapping"""
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, name + '.npy'), array)
+
+
+def load_shared(directory, names=('X', 'y', 'dates', 'game_ids',
+                                  'X_scored')):
+    """Memory maps the arrays written by save_shared"""
+    return {name: np.load(os.path.join(directory, name + '.npy'),
+                          mmap_mode='r')
+            for name in names}
+
+
+def _init_worker(directory):
+    global _shared
+    _shared = load_shared(directory)
+
+
+def backtest_dates(dates, params=MODEL_PARAMS):
+    """Trains on the games before each date and scores that date's games,
+    using the arrays shared with the worker
+
+    Parameters
+    ----------
+    dates - list of numpy datetime64[D] game dates
+    params - model hyper-parameters, see model.MODEL_PARAMS
+
+    Returns
+    -------
+    DataFrame with one row per scored game"""
+    X, y, game_dates = _shared['X'], _shared['y'], _shared['dates']
+    X_scored = _shared['X_scored']
+
+    results = []
+    for game_date in dates:
+        # rows are sorted by date, so the training set is a prefix
+        start = np.searchsorted(game_dates, game_date, side='left')
+        end = np.searchsorted(game_dates, game_date, side='right')
+        if start < MIN_TRAINING_ROWS or len(np.unique(y[:start])) < 2:
+            continue
+
+        # games of teams without an earlier game can not be predicted
+        scored = np.arange(start, end)[
+            ~np.isnan(X_scored[start:end]).any(axis=1)]
+        if len(scored) == 0:
+            continue
+
+        pipeline = build_pipeline(params)
+        pipeline.fit(pd.DataFrame(X[:start], columns=ALL_FEATURES),
+                     y[:start])
+        prob = pipeline.predict_proba(
+            pd.DataFrame(X_scored[scored], columns=ALL_FEATURES))[:, 1]
+
+        results.append(pd.DataFrame({
+            'game_id': _shared['game_ids'][scored],
+            'date': game_dates[scored],
+            'home_team_won': y[scored],
+            'home_prob': prob,
+            'training_rows': start
+        }))
+
+    if not results:
+        return pd.DataFrame(columns=['game_id', 'date', 'home_team_won',
+                                     'home_prob', 'training_rows'])
+
+    return pd.concat(results, ignore_index=True)
+
+
+def run_backtest(features, team_stats, params=MODEL_PARAMS,
+                 max_workers=None):
+    """Runs the walk-forward backtest over every game date in features
+
+    Parameters
+    ----------
+    features - DataFrame of the features table
+    team_stats - DataFrame of the team_stats table, see
+                 point_in_time_features
+    params - model hyper-parameters, see model.MODEL_PARAMS
+    max_workers - size of the process pool, defaults to the cpu count
+
+    Returns
+    -------
+    DataFrame of per game predictions, see backtest_dates"""
+    max_workers = max_workers or os.cpu_count()
+    features = features.dropna(subset=ALL_FEATURES + ['date'])
+
+    with tempfile.TemporaryDirectory() as directory:
+        # the model trains on the features table like the daily model,
+        # rows are in the same order in both matrices
+        arrays = build_design_matrix(features)
+        arrays['X_scored'] = build_design_matrix(
+            point_in_time_features(features, team_stats))['X']
+        save_shared(arrays, directory)
+
+        # later dates train on more games, so deal dates out round robin to
+        # give each chunk a similar mix of cheap and expensive fits
+        dates = np.unique(arrays['dates'])
+        n_chunks = max_workers * CHUNKS_PER_WORKER
+        chunks = [list(dates[i::n_chunks]) for i in range(n_chunks)]
+        chunks = [chunk for chunk in chunks if chunk]
+
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 initializer=_init_worker,
+                                 initargs=(directory,)) as pool:
+            results = list(pool.map(backtest_dates, chunks,
+                                    [params] * len(chunks)))
+
+    results = pd.concat(results, ignore_index=True)
+    results = results.sort_values(['date', 'game_id'], ignore_index=True)
+    results['season'] = [get_season_string(d)
+                         for d in pd.to_datetime(results['date'])]
+
+    return results
+
+
+def summarize(results):
+    """Accuracy, log loss and Brier score per season
+
+    Parameters
+    ----------
+    results - DataFrame returned by run_backtest
+    """
+    rows = []
+    for season, df in results.groupby('season'):
+        y = df['home_team_won'].to_numpy()
+        prob = df['home_prob'].to_numpy()
+        rows.append({'season': season,
+                     'games': len(df),
+                     'accuracy': accuracy_score(y, prob > 0.5),
+                     'log_loss': log_loss(y, prob, labels=[0, 1]),
+                     'brier': brier_score_loss(y, prob)
+                     })
+
+    return pd.DataFrame(rows)
+
+
+def calibration(results, bins=CALIBRATION_BINS):
+    """Predicted vs observed home win rate per season and probability bin
+
+    Parameters
+    ----------
+    results - DataFrame returned by run_backtest
+    bins - number of equal width probability bins
+    """
+    df = results.assign(bin=np.minimum((results['home_prob'] * bins)
+                                       .astype(int), bins - 1))
+
+    return (df.groupby(['season', 'bin'])
+            .agg(games=('home_team_won', 'size'),
+                 mean_prob=('home_prob', 'mean'),
+                 home_win_rate=('home_team_won', 'mean'))
+            .reset_index())
+
+
+if __name__ == '__main__':
+    features = read_query(uri=SQLALCHEMY_DATABASE_URI,
+                          query='SELECT * FROM features',
+                          date_fields={'date': '%Y-%m-%d'}
+                          )
+    team_stats = read_query(uri=SQLALCHEMY_DATABASE_URI,
+                            query='SELECT * FROM team_stats',
+                            date_fields={'date': '%Y-%m-%d'}
+                            )
+
+    results = run_backtest(features, team_stats)
+    print(summarize(results).to_string(index=False))
+    print(calibration(results).to_string(index=False))
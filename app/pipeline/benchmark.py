@@ -0,0 +1,380 @@
+"""Pipeline benchmarks
+
+Times each stage of the pipeline on fixed inputs so a slower morning run can
+be caught before it reaches production:
+
+- nst_parse_games and nst_pipeline on NaturalStatTrick games pages
+- nhl_pipeline on an NHL schedule
+- elo_pipeline on a fivethirtyeight ELO csv
+- build_prediction_df, and the model fit and predict from model.py
+- the flask index route, with a cold and a warm page cache
+
+Inputs are the recorded fixtures in benchmark_fixtures/ (rewritten with
+--record) and synthetic fixtures generated for each of SIZES number of
+games. The timings are pytest-benchmark tests in benchmarks/, parametrized by
+fixture size. They can be saved as the benchmark_baseline.json baseline and
+later runs compared against it, failing on a regression.
+
+Usage
+-----
+python benchmark.py                   # python -m pytest benchmarks
+python benchmark.py --save-baseline
+python benchmark.py --compare
+python benchmark.py --record
+"""
+
+import argparse
+from datetime import date, datetime, timedelta
+import os
+import sys
+import tempfile
+from unittest import mock
+import numpy as np
+import pandas as pd
+import pytest
+
+# model.py and app.py read the database uri at import, the benchmarks
+# themselves never touch the configured database
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+import scraping_functions  # noqa: E402
+from scraping_functions import (NST_COLUMN_MAPPER, NST_SITS,  # noqa: E402
+                                NST_TEAMNAME_CONVERSION)
+import model  # noqa: E402
+from team_stats_engine import (compute_team_stats,  # noqa: E402
+                               latest_team_stats)
+
+PIPELINE_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(PIPELINE_DIR, 'benchmark_fixtures')
+BASELINE_PATH = os.path.join(PIPELINE_DIR, 'benchmark_baseline.json')
+
+# number of games of the synthetic fixtures, 'recorded' is the recorded
+# fixtures
+SIZES = [328, 1312, 5248, 'recorded']
+STAGES = ['nst_parse_games',
+          'nst_pipeline',
+          'nst_pipeline_compact',
+          'nhl_pipeline',
+          'elo_pipeline',
+          'build_prediction_df',
+          'model_fit',
+          'model_predict',
+          'flask_index_cold',
+          'flask_index_warm'
+          ]
+# relative slowdown of a stage's median time flagged as a regression
+DEFAULT_THRESHOLD = 0.2
+
+# raw nst columns of the 5v5 page, in page order after the leading
+# row number, game, links and team columns
+NST_STAT_COLUMNS = [k for k in NST_COLUMN_MAPPER
+                    if k not in ('Game', 'Team')
+                    and not k.endswith(('_pp', '_pk'))]
+
+
+def synthetic_nst_html(n_games, sit='5v5', seed=0):
+    """Builds a nst games page with n_games games (two rows each)"""
+    rng = np.random.default_rng(seed)
+    teams = list(NST_TEAMNAME_CONVERSION)
+    start = date(2021, 10, 12)
+    toi = {'5v5': 48.0, 'pp': 5.0, 'pk': 5.0}[sit]
+
+    header = ''.join(f'<th>{c}</th>'
+                     for c in ['', 'Game', '', 'Team'] + NST_STAT_COLUMNS)
+    rows = []
+    for game in range(n_games):
+        game_date = start + timedelta(days=game * 180 // max(n_games, 1))
+        home, away = rng.choice(len(teams), size=2, replace=False)
+        name = f'{game_date} - {teams[away]} at {teams[home]}'
+        for team in (home, away):
+            values = []
+            for column in NST_STAT_COLUMNS:
+                if column == 'TOI':
+                    values.append(f'{toi + rng.random() * 4:.2f}')
+                elif column == 'Attendance':
+                    values.append(str(rng.integers(10000, 20000)))
+                elif column.endswith('%'):
+                    values.append(f'{rng.random() * 100:.2f}'
+                                  if rng.random() > 0.02 else '-')
+                elif column.startswith('x'):
+                    values.append(f'{rng.random() * 3:.2f}')
+                else:
+                    values.append(str(rng.integers(0, 60)))
+            cells = [str(len(rows) + 1), name, '<a href="#">link</a>',
+                     teams[team]] + values
+            rows.append('<tr>' + ''.join(f'<td>{c}</td>' for c in cells)
+                        + '</tr>')
+
+    return ('<html><body><table><thead><tr>' + header + '</tr></thead>'
+            '<tbody>' + ''.join(rows) + '</tbody></table></body></html>')
+
+
+def synthetic_schedule(n_games, seed=0):
+    """Builds a schedule DataFrame as returned by hockey_scraper"""
+    rng = np.random.default_rng(seed)
+    teams = list(NST_TEAMNAME_CONVERSION.values())
+    start = date(2021, 10, 12)
+    rows = []
+    for game in range(n_games):
+        game_date = start + timedelta(days=game * 180 // max(n_games, 1))
+        home, away = rng.choice(len(teams), size=2, replace=False)
+        rows.append({'game_id': 2021020001 + game,
+                     'date': str(game_date),
+                     'venue': 'Arena',
+                     'home_team': teams[home],
+                     'away_team': teams[away],
+                     'start_time': datetime(game_date.year, game_date.month,
+                                            game_date.day, 23),
+                     'home_score': int(rng.integers(0, 7)),
+                     'away_score': int(rng.integers(0, 7)),
+                     'status': 'Final'
+                     })
+
+    return pd.DataFrame(rows)
+
+
+def synthetic_elo_csv(n_games, seed=0):
+    """Builds a fivethirtyeight ELO csv with n_games games"""
+    schedule = synthetic_schedule(n_games, seed)
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'season': 2022,
+        'date': schedule['date'],
+        'playoff': 0,
+        'neutral': 0,
+        'ot': '',
+        'home_team': schedule['home_team'],
+        'away_team': schedule['away_team'],
+        'home_team_abbr': schedule['home_team'],
+        'away_team_abbr': schedule['away_team'],
+        'home_team_pregame_rating': 1500 + rng.normal(0, 50, n_games),
+        'away_team_pregame_rating': 1500 + rng.normal(0, 50, n_games),
+        'home_team_winprob': rng.random(n_games),
+        'away_team_winprob': rng.random(n_games),
+        'overtime_prob': rng.random(n_games) / 4,
+        'home_team_expected_points': rng.random(n_games) * 2,
+        'away_team_expected_points': rng.random(n_games) * 2,
+        'home_team_score': schedule['home_score'],
+        'away_team_score': schedule['away_score'],
+        'home_team_postgame_rating': 1500 + rng.normal(0, 50, n_games),
+        'away_team_postgame_rating': 1500 + rng.normal(0, 50, n_games),
+        'game_quality_rating': rng.integers(0, 100, n_games),
+        'game_importance_rating': rng.integers(0, 100, n_games),
+        'game_overall_rating': rng.integers(0, 100, n_games)
+    })
+
+    return df.to_csv(index=False)
+
+
+def synthetic_features(n_rows, seed=0):
+    """Builds a features table DataFrame with n_rows games"""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(rng.normal(50, 10, (n_rows,
+                                          len(model.NUMERIC_FEATURES))),
+                      columns=model.NUMERIC_FEATURES)
+    for column in model.CATEGORICAL_FEATURES:
+        df[column] = rng.random(n_rows) < 0.2
+    df['home_team_won'] = rng.random(n_rows) < 0.55
+
+    return df
+
+
+def synthetic_fixtures(n_games):
+    return {'nst': {sit: synthetic_nst_html(n_games, sit, seed=i)
+                    for i, sit in enumerate(NST_SITS)},
+            'schedule': synthetic_schedule(n_games),
+            'elo': synthetic_elo_csv(n_games),
+            'features': synthetic_features(n_games)
+            }
+
+
+def load_fixtures(size):
+    """Returns the fixtures of a SIZES entry"""
+    if size == 'recorded':
+        return recorded_fixtures()
+
+    return synthetic_fixtures(size)
+
+
+def recorded_fixtures():
+    """Loads the fixtures written by record_fixtures, or None"""
+    paths = {sit: os.path.join(FIXTURE_DIR, f'nst_{sit}.html')
+             for sit in NST_SITS}
+    paths['schedule'] = os.path.join(FIXTURE_DIR, 'schedule.csv')
+    paths['elo'] = os.path.join(FIXTURE_DIR, 'elo.csv')
+    if not all(os.path.exists(p) for p in paths.values()):
+        return None
+
+    nst = {}
+    for sit in NST_SITS:
+        with open(paths[sit], encoding='utf-8') as f:
+            nst[sit] = f.read()
+    with open(paths['elo'], encoding='utf-8') as f:
+        elo = f.read()
+    schedule = pd.read_csv(paths['schedule'], parse_dates=['start_time'])
+
+    return {'nst': nst,
+            'schedule': schedule,
+            'elo': elo,
+            'features': synthetic_features(len(schedule))
+            }
+
+
+def record_fixtures(season=None, days=30):
+    """Downloads real nst pages, an NHL schedule and the ELO csv into
+    FIXTURE_DIR"""
+    import hockey_scraper
+
+    today = date.today()
+    season = season or scraping_functions.get_season_string(today)
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+
+    for sit in NST_SITS:
+        url = scraping_functions.nst_games_url(season, season, sit)
+        page = scraping_functions.nst_fetch(url)
+        with open(os.path.join(FIXTURE_DIR, f'nst_{sit}.html'), 'w',
+                  encoding='utf-8') as f:
+            f.write(page.text)
+
+    schedule = hockey_scraper.scrape_schedule(
+        str(today - timedelta(days=days)), str(today - timedelta(days=1)),
+        data_format='Pandas')
+    schedule.to_csv(os.path.join(FIXTURE_DIR, 'schedule.csv'), index=False)
+
+    elo = pd.read_csv(
+        'https://projects.fivethirtyeight.com/nhl-api/nhl_elo_latest.csv')
+    elo.to_csv(os.path.join(FIXTURE_DIR, 'elo.csv'), index=False)
+
+
+def make_stages(fixtures):
+    """Returns a dict of stage name to zero argument callable"""
+    nst_html = fixtures['nst']
+
+    def nst_parse():
+        return [scraping_functions.nst_parse_games(nst_html[sit])
+                for sit in NST_SITS]
+
+    def fake_scrape_pages(season_ranges, columns=None, compact=False,
+                          **kwargs):
+        return {(from_season, to_season, sit):
+                scraping_functions.nst_parse_games(
+                    nst_html[sit],
+                    scraping_functions.NST_SIT_COLUMNS.get(sit, columns),
+                    compact)
+                for from_season, to_season in season_ranges
+                for sit in NST_SITS}
+
+    def nst_pipeline(columns=None, compact=False):
+        with mock.patch.object(scraping_functions, 'nst_scrape_pages',
+                               fake_scrape_pages):
+            return scraping_functions.nst_pipeline('fixture', 'fixture',
+                                                   columns=columns,
+                                                   compact=compact)
+
+    def nst_pipeline_compact():
+        return nst_pipeline(scraping_functions.NST_TEAM_STATS_COLUMNS,
+                            compact=True)
+
+    def nhl_pipeline():
+        with mock.patch.object(scraping_functions, 'nhl_scrape_games',
+                               lambda *args: fixtures['schedule'].copy()):
+            return scraping_functions.nhl_pipeline('1900-01-01',
+                                                   '2100-01-01')
+
+    def elo_pipeline():
+        with mock.patch.object(scraping_functions, 'elo_scrape',
+                               lambda: scraping_functions.elo_parse_csv(
+                                   fixtures['elo'])):
+            return scraping_functions.elo_pipeline('1900-01-01',
+                                                   '2100-01-01')
+
+    todays_games = nhl_pipeline().head(16).reset_index(drop=True)
+    nst = nst_pipeline()
+    recent_stats = latest_team_stats(compute_team_stats(nst))
+
+    def build_prediction_df():
+        return model.build_prediction_df(todays_games, recent_stats)
+
+    features = fixtures['features']
+    fitted = model.build_pipeline().fit(
+        features.loc[:, model.ALL_FEATURES], features['home_team_won'])
+    X_pred = features.loc[:, model.ALL_FEATURES].head(16)
+
+    def model_fit():
+        return model.build_pipeline().fit(
+            features.loc[:, model.ALL_FEATURES], features['home_team_won'])
+
+    def model_predict():
+        return fitted.predict_proba(X_pred)
+
+    stages = {'nst_parse_games': nst_parse,
+              'nst_pipeline': nst_pipeline,
+              'nst_pipeline_compact': nst_pipeline_compact,
+              'nhl_pipeline': nhl_pipeline,
+              'elo_pipeline': elo_pipeline,
+              'build_prediction_df': build_prediction_df,
+              'model_fit': model_fit,
+              'model_predict': model_predict
+              }
+    stages.update(make_flask_stages(todays_games))
+
+    return stages
+
+
+def make_flask_stages(todays_games):
+    """Stages requesting the index page from a sqlite copy of today's
+    predictions"""
+    sys.path.insert(0, os.path.dirname(PIPELINE_DIR))
+    import app as flask_app
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+    flask_app.app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    flask_app.PREDICTIONS_STAMP = db_path + '.stamp'
+    with flask_app.app.app_context():
+        flask_app.db.create_all()
+        for game in todays_games.itertuples():
+            flask_app.db.session.add(flask_app.Prediction(
+                game_id=game.game_id,
+                date=date.today(),
+                venue=game.venue,
+                home_team=game.home_team,
+                away_team=game.away_team,
+                home_win=True,
+                away_prob=0.45,
+                home_prob=0.55))
+        flask_app.db.session.commit()
+    client = flask_app.app.test_client()
+
+    def flask_index_cold():
+        flask_app._page_cache.clear()
+        return client.get('/')
+
+    def flask_index_warm():
+        return client.get('/')
+
+    return {'flask_index_cold': flask_index_cold,
+            'flask_index_warm': flask_index_warm}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline')
+    parser.add_argument('--record', action='store_true',
+                        help='download real fixtures and exit')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--compare', action='store_true')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    args, pytest_args = parser.parse_known_args()
+
+    if args.record:
+        record_fixtures()
+        sys.exit(0)
+
+    pytest_args = [os.path.join(PIPELINE_DIR, 'benchmarks')] + pytest_args
+    if args.save_baseline:
+        pytest_args.append(f'--benchmark-json={args.baseline}')
+    if args.compare:
+        pytest_args += [f'--benchmark-compare={args.baseline}',
+                        '--benchmark-compare-fail='
+                        f'median:{args.threshold * 100:.0f}%']
+    sys.exit(pytest.main(pytest_args))
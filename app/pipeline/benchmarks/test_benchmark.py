@@ -0,0 +1,17 @@
+import pytest
+from benchmark import SIZES, STAGES, load_fixtures, make_stages
+
+
+@pytest.fixture(scope='module', params=SIZES, ids=str)
+def stages(request):
+    fixtures = load_fixtures(request.param)
+    if fixtures is None:
+        pytest.skip('no recorded fixtures, see benchmark.py --record')
+
+    return make_stages(fixtures)
+
+
+@pytest.mark.parametrize('stage', STAGES)
+def test_stage(benchmark, stages, stage):
+    benchmark.group = stage
+    benchmark(stages[stage])
@@ -1,98 +1,115 @@
+# Incremental feature build. Only games that are not yet in features and were
+# played on or after the last build's high-water date are joined against
+# team_stats and elo, so a daily run only touches yesterday's games and can be
+# safely re-run. Each run records its high-water mark in feature_builds, and
+# the rows it added carry its build_id. The tables are created by
+# migrations.py.
 query = """
-CREATE TABLE IF NOT EXISTS features(
-	game_id varchar,
-	home_team_won boolean,
-	home_team varchar,
-	home_team_key varchar,
-	home_ff_last_half double precision,
-	home_gf_last_half double precision, 
-	home_xgf_last_half double precision,
-	home_sh_last_half double precision,
-	home_gf_min_pp double precision,
-	home_xgf_min_pp double precision,
-	home_ga_min_pk double precision,
-	home_xga_min_pk double precision,
-	home_b2b boolean,
-	away_team varchar,
-	away_team_key varchar,
-	away_ff_last_half double precision,
-	away_gf_last_half double precision, 
-	away_xgf_last_half double precision,
-	away_sh_last_half double precision,
-	away_gf_min_pp double precision,
-	away_xgf_min_pp double precision,
-	away_ga_min_pk double precision,
-	away_xga_min_pk double precision,
-	away_b2b boolean,
-	home_elo double precision,
-	away_elo double precision,
-	evaluated date,
-	PRIMARY KEY (game_id)
-);
+WITH build AS (
+	SELECT nextval(pg_get_serial_sequence('feature_builds', 'build_id'))
+		AS build_id
+),
 
-INSERT INTO 
-	features(
-		game_id, 
+watermark AS (
+	SELECT COALESCE(MAX(high_water_date), '-infinity'::date) AS last_date
+	FROM feature_builds
+),
+
+inserted AS (
+	INSERT INTO
+		features(
+			game_id,
+			home_team_won,
+			home_team,
+			home_team_id,
+			home_ff_last_half,
+			home_gf_last_half,
+			home_xgf_last_half,
+			home_sh_last_half,
+			home_gf_min_pp,
+			home_xgf_min_pp,
+			home_ga_min_pk,
+			home_xga_min_pk,
+			home_b2b,
+			away_team,
+			away_team_id,
+			away_ff_last_half,
+			away_gf_last_half,
+			away_xgf_last_half,
+			away_sh_last_half,
+			away_gf_min_pp,
+			away_xgf_min_pp,
+			away_ga_min_pk,
+			away_xga_min_pk,
+			away_b2b,
+			home_elo,
+			away_elo,
+			"date",
+			evaluated,
+			build_id
+		)
+	SELECT
+		DISTINCT ON (nhl.game_id) nhl.game_id,
 		home_team_won,
-		home_team,
-		home_team_key,
-		home_ff_last_half,
-		home_gf_last_half,
-		home_xgf_last_half,
-		home_sh_last_half,
-		home_gf_min_pp,
-		home_xgf_min_pp,
-		home_ga_min_pk,
-		home_xga_min_pk,
-		home_b2b,
-		away_team,
-		away_team_key,
-		away_ff_last_half,
-		away_gf_last_half,
-		away_xgf_last_half,
-		away_sh_last_half,
-		away_gf_min_pp,
-		away_xgf_min_pp,
-		away_ga_min_pk,
-		away_xga_min_pk,
-		away_b2b,
-		home_elo,
-		away_elo,
-		evaluated
+		nhl.home_team,
+		nhl.home_team_id,
+		hts."ff%_5v5_last_half" as "home_ff_last_half",
+		hts."gf%_5v5_last_half" as "home_gf_last_half",
+		hts."xgf%_5v5_last_half" as "home_xgf_last_half",
+		hts."sh%_5v5_last_half" as "home_sh_last_half",
+		hts.gf_per_min_pp_last_half as "home_gf_min_pp",
+		hts.xgf_per_min_pp_last_half as "home_xgf_min_pp",
+		hts.ga_per_min_pk_last_half as "home_ga_min_pk",
+		hts.xga_per_min_pk_last_half as "home_xga_min_pk",
+		hts.b2b as home_b2b,
+		nhl.away_team,
+		nhl.away_team_id,
+		ats."ff%_5v5_last_half" as "away_ff_last_half",
+		ats."gf%_5v5_last_half" as "away_gf_last_half",
+		ats."xgf%_5v5_last_half" as "away_xgf_last_half",
+		ats."sh%_5v5_last_half" as "away_sh_last_half",
+		ats."gf_per_min_pp_last_half" as "away_gf_min_pp",
+		ats."xgf_per_min_pp_last_half" as "away_xgf_min_pp",
+		ats."ga_per_min_pk_last_half" as "away_ga_min_pk",
+		ats."xga_per_min_pk_last_half" as "away_xga_min_pk",
+		ats."b2b" as away_b2b,
+		elo.home_team_pregame_rating as home_elo,
+		elo.away_team_pregame_rating as away_elo,
+		nhl.date,
+		CURRENT_DATE AS "evaluated",
+		build.build_id
+	FROM nhl
+		CROSS JOIN watermark
+		CROSS JOIN build
+		LEFT JOIN team_stats AS hts
+			ON hts.team_id = nhl.home_team_id AND hts.date = nhl.date
+		LEFT JOIN team_stats AS ats
+			ON ats.team_id = nhl.away_team_id AND ats.date = nhl.date
+		INNER JOIN elo
+			ON elo.home_team_id = nhl.home_team_id AND elo.date = nhl.date
+	WHERE nhl.date >= watermark.last_date
+	AND nhl.date > now() - '3 years'::interval
+	AND NOT EXISTS (SELECT 1 FROM features WHERE features.game_id = nhl.game_id)
+	ORDER BY
+		nhl.game_id
+	ON CONFLICT (game_id) DO NOTHING
+	RETURNING game_id, "date"
+)
+
+INSERT INTO
+	feature_builds(
+		build_id,
+		built_at,
+		high_water_date,
+		high_water_game_id,
+		rows_added
 	)
 SELECT
-	DISTINCT(game_id),
-	home_team_won, 
-	nhl.home_team,
-	nhl.home_team_key, 
-	hts."ff%_5v5_last_half" as "home_ff_last_half",
-	hts."gf%_5v5_last_half" as "home_gf_last_half",
-	hts."xgf%_5v5_last_half" as "home_xgf_last_half",
-	hts."sh%_5v5_last_half" as "home_sh_last_half",
-	hts.gf_per_min_pp_last_half as "home_gf_min_pp",
-	hts.xgf_per_min_pp_last_half as "home_xgf_min_pp",
-	hts.ga_per_min_pk_last_half as "home_ga_min_pk",
-	hts.xga_per_min_pk_last_half as "home_xga_min_pk",
-	hts.b2b as home_b2b,
-	nhl.away_team,
-	nhl.away_team_key,
-	ats."ff%_5v5_last_half" as "away_ff_last_half",
-	ats."gf%_5v5_last_half" as "away_gf_last_half",
-	ats."xgf%_5v5_last_half" as "away_xgf_last_half",
-	ats."sh%_5v5_last_half" as "away_sh_last_half",
-	ats."gf_per_min_pp_last_half" as "away_gf_min_pp",
-	ats."xgf_per_min_pp_last_half" as "away_xgf_min_pp",
-	ats."ga_per_min_pk_last_half" as "away_ga_min_pk",
-	ats."xga_per_min_pk_last_half" as "away_xga_min_pk",
-	ats."b2b" as away_b2b,
-	elo.home_team_pregame_rating as home_elo,
-	elo.away_team_pregame_rating as away_elo,
-	CURRENT_DATE AS "evaluated"
-FROM nhl
-	LEFT JOIN team_stats AS hts ON nhl.home_team_key = hts.team_key
-	LEFT JOIN team_stats AS ats ON nhl.away_team_key = ats.team_key
-	INNER JOIN elo ON nhl.home_team_key = elo.home_team_key
-WHERE nhl.date > now() - '3 years'::interval
-ORDER BY
-	game_id
+	(SELECT build_id FROM build),
+	now(),
+	NULLIF(GREATEST(MAX(inserted.date), (SELECT last_date FROM watermark)),
+		   '-infinity'::date),
+	MAX(inserted.game_id),
+	COUNT(*)
+FROM inserted
 """
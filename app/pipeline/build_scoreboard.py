@@ -0,0 +1,130 @@
+# Folds the predictions of newly finished games into the running scoreboard
+# aggregates, per season overall, per team and per home win probability
+# bucket. Each game is scored once, with its most recently published
+# prediction for the date it was played, and recorded in scoreboard_games so
+# re-runs add nothing. Games finished up to two weeks after the last scored
+# date, ex. postponed ones, are still picked up. The tables are created by
+# migrations.py.
+query = """
+WITH last_scored AS (
+	SELECT COALESCE(MAX("date"), '-infinity'::date) - 14 AS last_date
+	FROM scoreboard_games
+),
+
+new_games AS (
+	SELECT
+		DISTINCT ON (p.game_id) p.game_id,
+		p.date,
+		p.home_team,
+		p.away_team,
+		LEAST(GREATEST(p.home_prob, 1e-15), 1 - 1e-15) AS home_prob,
+		p.home_win,
+		nhl.home_team_won
+	FROM predictions p
+		CROSS JOIN last_scored
+		INNER JOIN nhl
+			ON nhl.date = p.date AND nhl.game_id = p.game_id
+	WHERE p.date > last_scored.last_date
+	AND nhl.status LIKE 'Final%'
+	AND NOT EXISTS (SELECT 1 FROM scoreboard_games
+					WHERE scoreboard_games.game_id = p.game_id)
+	ORDER BY
+		p.game_id,
+		p.published_at DESC,
+		p.date DESC
+),
+
+scored AS (
+	INSERT INTO scoreboard_games(game_id, "date", scored_at)
+	SELECT game_id, "date", now()
+	FROM new_games
+),
+
+game_scores AS (
+	SELECT
+		CASE WHEN extract(month FROM "date") > 7
+			THEN extract(year FROM "date")::int || ''
+				 || extract(year FROM "date")::int + 1
+			ELSE extract(year FROM "date")::int - 1 || ''
+				 || extract(year FROM "date")::int
+		END AS season,
+		home_team,
+		away_team,
+		home_prob,
+		home_team_won::int AS home_won,
+		(home_win = home_team_won)::int AS hit,
+		CASE WHEN home_team_won THEN -ln(home_prob)
+			ELSE -ln(1 - home_prob)
+		END AS log_loss,
+		power(home_prob - home_team_won::int, 2) AS brier,
+		LEAST(floor(home_prob * 10), 9)::int AS bucket
+	FROM new_games
+),
+
+team_scores AS (
+	SELECT home_team AS team, * FROM game_scores
+	UNION ALL
+	SELECT away_team AS team, * FROM game_scores
+),
+
+increments AS (
+	SELECT season, 'season' AS dimension, 'all' AS dim_key,
+		COUNT(*) AS games, SUM(hit) AS hits, SUM(home_won) AS home_wins,
+		SUM(home_prob) AS prob_sum, SUM(log_loss) AS log_loss_sum,
+		SUM(brier) AS brier_sum
+	FROM game_scores
+	GROUP BY season
+
+	UNION ALL
+
+	SELECT season, 'team', team,
+		COUNT(*), SUM(hit), SUM(home_won),
+		SUM(home_prob), SUM(log_loss),
+		SUM(brier)
+	FROM team_scores
+	GROUP BY season, team
+
+	UNION ALL
+
+	SELECT season, 'bucket', bucket::text,
+		COUNT(*), SUM(hit), SUM(home_won),
+		SUM(home_prob), SUM(log_loss),
+		SUM(brier)
+	FROM game_scores
+	GROUP BY season, bucket
+)
+
+INSERT INTO
+	scoreboard(
+		season,
+		dimension,
+		dim_key,
+		games,
+		hits,
+		home_wins,
+		prob_sum,
+		log_loss_sum,
+		brier_sum,
+		updated_at
+	)
+SELECT
+	season,
+	dimension,
+	dim_key,
+	games,
+	hits,
+	home_wins,
+	prob_sum,
+	log_loss_sum,
+	brier_sum,
+	now()
+FROM increments
+ON CONFLICT (season, dimension, dim_key) DO UPDATE SET
+	games = scoreboard.games + EXCLUDED.games,
+	hits = scoreboard.hits + EXCLUDED.hits,
+	home_wins = scoreboard.home_wins + EXCLUDED.home_wins,
+	prob_sum = scoreboard.prob_sum + EXCLUDED.prob_sum,
+	log_loss_sum = scoreboard.log_loss_sum + EXCLUDED.log_loss_sum,
+	brier_sum = scoreboard.brier_sum + EXCLUDED.brier_sum,
+	updated_at = EXCLUDED.updated_at
+"""
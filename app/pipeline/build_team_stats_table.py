@@ -1,51 +1,95 @@
-query = """
-CREATE TABLE IF NOT EXISTS team_stats(
-	team_key varchar(15), 
-	team char(3), 
-	"ff%_5v5_last_half" double precision,
-	"gf%_5v5_last_half" double precision,
-	"xgf%_5v5_last_half" double precision,
-	"sh%_5v5_last_half" double precision,
-	gf_per_min_pp_last_half double precision,
-	xgf_per_min_pp_last_half double precision,
-	ga_per_min_pk_last_half double precision,
-	xga_per_min_pk_last_half double precision,
-	"date" date,
-	b2b boolean,
-	PRIMARY KEY (team_key) 
-);
+# team_stats and team_stats_latest are created by migrations.py. The latest
+# row of each team is read by model.py at prediction time. The refresh is one
+# primary key lookup per team, so it costs the same whatever the size of
+# team_stats.
+refresh_latest = """
+INSERT INTO
+	team_stats_latest(
+			   team_id,
+			   team,
+			   "ff%_5v5_last_half",
+			   "gf%_5v5_last_half",
+			   "xgf%_5v5_last_half",
+			   "sh%_5v5_last_half",
+			   gf_per_min_pp_last_half,
+			   xgf_per_min_pp_last_half,
+			   ga_per_min_pk_last_half,
+			   xga_per_min_pk_last_half,
+			   "date",
+			   b2b
+)
+
+SELECT
+	latest.team_id,
+	latest.team,
+	latest."ff%_5v5_last_half",
+	latest."gf%_5v5_last_half",
+	latest."xgf%_5v5_last_half",
+	latest."sh%_5v5_last_half",
+	latest.gf_per_min_pp_last_half,
+	latest.xgf_per_min_pp_last_half,
+	latest.ga_per_min_pk_last_half,
+	latest.xga_per_min_pk_last_half,
+	latest."date",
+	latest.b2b
 
-WITH support_calcs AS (
+FROM teams
+CROSS JOIN LATERAL (
+	SELECT *
+	FROM team_stats
+	WHERE team_stats.team_id = teams.team_id
+	ORDER BY team_stats.date DESC
+	LIMIT 1
+) latest
+ON CONFLICT (team_id) DO UPDATE SET
+	team = EXCLUDED.team,
+	"ff%_5v5_last_half" = EXCLUDED."ff%_5v5_last_half",
+	"gf%_5v5_last_half" = EXCLUDED."gf%_5v5_last_half",
+	"xgf%_5v5_last_half" = EXCLUDED."xgf%_5v5_last_half",
+	"sh%_5v5_last_half" = EXCLUDED."sh%_5v5_last_half",
+	gf_per_min_pp_last_half = EXCLUDED.gf_per_min_pp_last_half,
+	xgf_per_min_pp_last_half = EXCLUDED.xgf_per_min_pp_last_half,
+	ga_per_min_pk_last_half = EXCLUDED.ga_per_min_pk_last_half,
+	xga_per_min_pk_last_half = EXCLUDED.xga_per_min_pk_last_half,
+	"date" = EXCLUDED."date",
+	b2b = EXCLUDED.b2b;
+"""
+
+# rolling 41 game (half season) sums over the rows of {source}
+support_calcs = """
+support_calcs AS (
 	SELECT *,
 		--TOI 5v5
-		SUM(toi_5v5) OVER (PARTITION BY team ORDER BY date ROWS BETWEEN 40 PRECEDING AND CURRENT ROW) as toi_5v5_last_half,
+		SUM(toi_5v5) OVER (PARTITION BY team_id ORDER BY date ROWS BETWEEN 40 PRECEDING AND CURRENT ROW) as toi_5v5_last_half,
 		--Fenwick 5v5
-		SUM(ff_5v5) OVER (PARTITION BY team ORDER BY date ROWS BETWEEN 40 PRECEDING AND CURRENT ROW) as ff_5v5_last_half,
-		SUM(fa_5v5) OVER (PARTITION BY team ORDER BY date ROWS BETWEEN 40 PRECEDING AND CURRENT ROW) as fa_5v5_last_half,
+		SUM(ff_5v5) OVER (PARTITION BY team_id ORDER BY date ROWS BETWEEN 40 PRECEDING AND CURRENT ROW) as ff_5v5_last_half,
+		SUM(fa_5v5) OVER (PARTITION BY team_id ORDER BY date ROWS BETWEEN 40 PRECEDING AND CURRENT ROW) as fa_5v5_last_half,
 		--Goals 5v5
-		SUM(gf_5v5) OVER (PARTITION BY team ORDER BY date ROWS BETWEEN 40 PRECEDING AND CURRENT ROW) as gf_5v5_last_half,
-		SUM(ga_5v5) OVER (PARTITION BY team ORDER BY date ROWS BETWEEN 40 PRECEDING AND CURRENT ROW) as ga_5v5_last_half,
+		SUM(gf_5v5) OVER (PARTITION BY team_id ORDER BY date ROWS BETWEEN 40 PRECEDING AND CURRENT ROW) as gf_5v5_last_half,
+		SUM(ga_5v5) OVER (PARTITION BY team_id ORDER BY date ROWS BETWEEN 40 PRECEDING AND CURRENT ROW) as ga_5v5_last_half,
 		--Expected Goals 5v5
-		SUM(xgf_5v5) OVER (PARTITION BY team ORDER BY date ROWS BETWEEN 40 PRECEDING AND CURRENT ROW) as xgf_5v5_last_half,
-		SUM(xga_5v5) OVER (PARTITION BY team ORDER BY date ROWS BETWEEN 40 PRECEDING AND CURRENT ROW) as xga_5v5_last_half,
+		SUM(xgf_5v5) OVER (PARTITION BY team_id ORDER BY date ROWS BETWEEN 40 PRECEDING AND CURRENT ROW) as xgf_5v5_last_half,
+		SUM(xga_5v5) OVER (PARTITION BY team_id ORDER BY date ROWS BETWEEN 40 PRECEDING AND CURRENT ROW) as xga_5v5_last_half,
 		--Shots 5v5
-		SUM(sf_5v5) OVER (PARTITION BY team ORDER BY date ROWS BETWEEN 40 PRECEDING AND CURRENT ROW) as sf_5v5_last_half,
+		SUM(sf_5v5) OVER (PARTITION BY team_id ORDER BY date ROWS BETWEEN 40 PRECEDING AND CURRENT ROW) as sf_5v5_last_half,
 		--PP
-		SUM(toi_pp) OVER (PARTITION BY team ORDER BY date ROWS BETWEEN 40 PRECEDING AND CURRENT ROW) as toi_pp_last_half,
-		SUM(xgf_pp) OVER (PARTITION BY team ORDER BY date ROWS BETWEEN 40 PRECEDING AND CURRENT ROW) as xgf_pp_last_half,
-		SUM(gf_pp) OVER (PARTITION BY team ORDER BY date ROWS BETWEEN 40 PRECEDING AND CURRENT ROW) as gf_pp_last_half,
+		SUM(toi_pp) OVER (PARTITION BY team_id ORDER BY date ROWS BETWEEN 40 PRECEDING AND CURRENT ROW) as toi_pp_last_half,
+		SUM(xgf_pp) OVER (PARTITION BY team_id ORDER BY date ROWS BETWEEN 40 PRECEDING AND CURRENT ROW) as xgf_pp_last_half,
+		SUM(gf_pp) OVER (PARTITION BY team_id ORDER BY date ROWS BETWEEN 40 PRECEDING AND CURRENT ROW) as gf_pp_last_half,
 		--PK
-		SUM(toi_pk) OVER (PARTITION BY team ORDER BY date ROWS BETWEEN 40 PRECEDING AND CURRENT ROW) as toi_pk_last_half,
-		SUM(xga_pk) OVER (PARTITION BY team ORDER BY date ROWS BETWEEN 40 PRECEDING AND CURRENT ROW) as xga_pk_last_half,
-		SUM(ga_pk) OVER (PARTITION BY team ORDER BY date ROWS BETWEEN 40 PRECEDING AND CURRENT ROW) as ga_pk_last_half
-	
-	FROM nst
+		SUM(toi_pk) OVER (PARTITION BY team_id ORDER BY date ROWS BETWEEN 40 PRECEDING AND CURRENT ROW) as toi_pk_last_half,
+		SUM(xga_pk) OVER (PARTITION BY team_id ORDER BY date ROWS BETWEEN 40 PRECEDING AND CURRENT ROW) as xga_pk_last_half,
+		SUM(ga_pk) OVER (PARTITION BY team_id ORDER BY date ROWS BETWEEN 40 PRECEDING AND CURRENT ROW) as ga_pk_last_half
+
+	FROM {source}
 )
+"""
 
-INSERT INTO 
+upsert = """
+INSERT INTO
 	team_stats(
-			   team_key, 
-			   team, 
+			   team_id,
+			   team,
 			   "ff%_5v5_last_half",
 			   "gf%_5v5_last_half",
 			   "xgf%_5v5_last_half",
@@ -58,9 +102,9 @@ INSERT INTO
 			   b2b
 )
 
-SELECT 
-	team_key, 
-	team, 
+SELECT
+	team_id,
+	team,
 	(ff_5v5_last_half*100)/(ff_5v5_last_half+fa_5v5_last_half) as "ff%_5v5_last_half",
 	(gf_5v5_last_half*100)/(gf_5v5_last_half+ga_5v5_last_half) as "gf%_5v5_last_half",
 	(xgf_5v5_last_half*100)/(xgf_5v5_last_half+xga_5v5_last_half) as "xgf%_5v5_last_half",
@@ -69,9 +113,69 @@ SELECT
 	xgf_pp_last_half/toi_pp_last_half as xgf_per_min_pp_last_half,
 	ga_pk_last_half/toi_pk_last_half as ga_per_min_pk_last_half,
 	xga_pk_last_half/toi_pk_last_half as xga_per_min_pk_last_half,
-	date, 
+	date,
 	b2b
 
 FROM support_calcs
---WHERE date > (SELECT "date" FROM team_stats ORDER BY "date" DESC LIMIT 1)
+{where}
+ON CONFLICT (team_id, "date") DO UPDATE SET
+	team = EXCLUDED.team,
+	"ff%_5v5_last_half" = EXCLUDED."ff%_5v5_last_half",
+	"gf%_5v5_last_half" = EXCLUDED."gf%_5v5_last_half",
+	"xgf%_5v5_last_half" = EXCLUDED."xgf%_5v5_last_half",
+	"sh%_5v5_last_half" = EXCLUDED."sh%_5v5_last_half",
+	gf_per_min_pp_last_half = EXCLUDED.gf_per_min_pp_last_half,
+	xgf_per_min_pp_last_half = EXCLUDED.xgf_per_min_pp_last_half,
+	ga_per_min_pk_last_half = EXCLUDED.ga_per_min_pk_last_half,
+	xga_per_min_pk_last_half = EXCLUDED.xga_per_min_pk_last_half,
+	b2b = EXCLUDED.b2b
 """
+
+# full rebuild, recomputes the rolling windows over the whole nst table
+query = ('WITH' + support_calcs.format(source='nst')
+         + upsert.format(where='') + ';\n'
+         + refresh_latest
+         )
+
+# incremental refresh, only computes rows for games played after the last
+# materialized date. Each team's window is seeded with its previous 40 games
+# so the sums match a full rebuild.
+incremental_source = """
+last_built AS (
+	SELECT COALESCE(MAX("date"), '-infinity'::date) AS last_date
+	FROM team_stats
+),
+
+new_games AS (
+	SELECT nst.*
+	FROM nst, last_built
+	WHERE nst.date > last_built.last_date
+),
+
+window_seed AS (
+	SELECT seed.*
+	FROM (SELECT DISTINCT team_id FROM new_games) new_teams
+	CROSS JOIN last_built
+	CROSS JOIN LATERAL (
+		SELECT *
+		FROM nst
+		WHERE nst.team_id = new_teams.team_id
+		AND nst.date <= last_built.last_date
+		ORDER BY nst.date DESC
+		LIMIT 40
+	) seed
+),
+
+window_rows AS (
+	SELECT * FROM new_games
+	UNION ALL
+	SELECT * FROM window_seed
+),
+"""
+
+incremental_query = ('WITH' + incremental_source
+                     + support_calcs.format(source='window_rows')
+                     + upsert.format(
+                        where='WHERE date > (SELECT last_date FROM last_built)')
+                     + ';\n' + refresh_latest
+                     )
@@ -1,15 +1,31 @@
 """Daily Pull - Scrape NHL data
 
 This script is intended to run daily to retrieve new game data from the prior
-day's games, as well as today's upcoming games to be fed to the prediction
-model
+day's games, as well as today's upcoming games, and then refit the model and
+publish today's predictions.
+
+The steps run as a DAG with task_runner: the source scrapes run concurrently,
+the load and table builds start once every scrape has finished and modelling
+starts once the tables are built. Finished steps are checkpointed per day, so
+rerunning after a failure resumes from the failed step.
+
+Each source is fetched from the day after its watermark to yesterday in one
+ranged request, see watermarks.py, so the dates of missed runs and results
+that were posted late are loaded by the next run. The watermarks advance in
+the load's transaction.
+
+schedule_poller.py keeps the day's predictions current after this run,
+re-predicting games that are added or changed during the day.
 """
 
 from datetime import date, timedelta
+from functools import partial
 import ssl
+from sqlalchemy.exc import OperationalError
 from scraping_functions import (get_season_string,
-                                nst_pipeline,
-                                nst_filter_date,
+                                nst_get_merge_sits,
+                                nst_transform,
+                                nst_filter_dates,
                                 nhl_pipeline,
                                 elo_pipeline,
                                 )
@@ -18,10 +34,19 @@ from database_functions import (get_db_uri,
                                 get_nhl_dtype,
                                 get_elo_dtype,
                                 save_to_database,
-                                execute_query
+                                execute_query,
+                                transaction
                                 )
 import build_team_stats_table
 import build_features
+import build_scoreboard
+import migrations
+import raw_store
+import watermarks
+from instrumentation import PipelineRun
+from model_registry import ModelRegistry
+import model
+from task_runner import Task, TaskRunner, prune_checkpoints
 
 ssl._create_default_https_context = ssl._create_unverified_context
 
@@ -30,49 +55,182 @@ SQLALCHEMY_DATABASE_URI = get_db_uri()
 NST_DTYPE = get_nst_dtype()
 NHL_DTYPE = get_nhl_dtype()
 ELO_DTYPE = get_elo_dtype()
+# failures worth retrying, network errors are OSErrors
+SCRAPE_RETRY_ON = (OSError,)
+DATABASE_RETRY_ON = (OSError, OperationalError)
+
+
+DTYPES = {'nst': NST_DTYPE, 'nhl': NHL_DTYPE, 'elo': ELO_DTYPE}
+
+
+def scrape_nst(day, source_watermarks):
+    start, end = watermarks.fetch_range(source_watermarks['nst'], day)
+    if start > end:
+        return start, end, None
+    df = nst_get_merge_sits(from_season=get_season_string(start),
+                            to_season=get_season_string(end))
+    df = nst_transform(df)
+    df = nst_filter_dates(df, start, end)
+    raw_store.write_days('nst', df)
+
+    return start, end, df
+
+
+def scrape_nhl(day, source_watermarks):
+    start, end = watermarks.fetch_range(source_watermarks['nhl'], day)
+    if start > end:
+        return start, end, None
+    df = nhl_pipeline(start_date=start.isoformat(), end_date=end.isoformat())
+    raw_store.write_days('nhl', df)
+
+    return start, end, df
+
+
+def scrape_todays_games(day):
+    target_date = day.strftime('%Y-%m-%d')
+
+    return nhl_pipeline(start_date=target_date, end_date=target_date)
+
+
+def scrape_elo(day, source_watermarks):
+    start, end = watermarks.fetch_range(source_watermarks['elo'], day)
+    if start > end:
+        return start, end, None
+    df = elo_pipeline(start_date=start.isoformat(), end_date=end.isoformat())
+    raw_store.write_days('elo', df)
+
+    return start, end, df
+
+
+def complete_through(source, start, end, df):
+    """Returns the last date of a fetched range the source is complete
+    through, see watermarks.py. nst and elo are checked against the finished
+    games of the nhl table, so nhl must be loaded first."""
+    if source == 'nhl':
+        return watermarks.nhl_complete_through(df, start, end)
+    games = watermarks.finished_games_by_date(SQLALCHEMY_DATABASE_URI,
+                                              start, end)
+
+    return watermarks.complete_through(df['date'], games, start, end,
+                                       watermarks.ROWS_PER_GAME[source])
+
+
+def load_day(run, day, nst_data, nhl_data, elo_data, todays_games):
+    fetched = {source: data
+               for source, data in [('nhl', nhl_data),
+                                    ('nst', nst_data),
+                                    ('elo', elo_data)]
+               if data[2] is not None}
+    first_date = min([start for start, _, _ in fetched.values()],
+                     default=day - timedelta(days=1))
+
+    # write the fetched data, advance the watermarks and rebuild the derived
+    # tables in one transaction so a failure never leaves a partially loaded
+    # range behind
+    with transaction(SQLALCHEMY_DATABASE_URI):
+        with run.stage('ensure_partitions'):
+            migrations.ensure_partitions(SQLALCHEMY_DATABASE_URI,
+                                         first_date=first_date,
+                                         last_date=day)
+
+        for source, (start, end, df) in fetched.items():
+            # a refetched date replaces the rows loaded for it before, an
+            # empty fetch leaves them, see complete_through
+            if df.empty:
+                print(f'No {source} rows from {start} to {end}')
+                continue
+            with run.stage(f'load_{source}', rows_in=len(df)):
+                watermarks.replace_range(SQLALCHEMY_DATABASE_URI, source,
+                                         start, end)
+                save_to_database(uri=SQLALCHEMY_DATABASE_URI,
+                                 df=df,
+                                 table_name=source,
+                                 if_exists='append',
+                                 dtype=DTYPES[source])
+
+        with run.stage('load_todays_games', rows_in=len(todays_games)):
+            save_to_database(uri=SQLALCHEMY_DATABASE_URI,
+                             df=todays_games,
+                             table_name='todays_games',
+                             if_exists='replace',
+                             dtype=NHL_DTYPE)
+
+        with run.stage('advance_watermarks'):
+            for source, (start, end, df) in fetched.items():
+                last_date = complete_through(source, start, end, df)
+                watermarks.save_watermark(SQLALCHEMY_DATABASE_URI, source,
+                                          last_date)
+                print(f'{source} complete through {last_date}')
+
+        if fetched:
+            with run.stage('rewind'):
+                watermarks.rewind(SQLALCHEMY_DATABASE_URI, first_date)
+
+        with run.stage('build_team_stats'):
+            execute_query(uri=SQLALCHEMY_DATABASE_URI,
+                          query=build_team_stats_table.incremental_query
+                          )
+
+        with run.stage('build_features'):
+            execute_query(uri=SQLALCHEMY_DATABASE_URI,
+                          query=build_features.query
+                          )
+
+        with run.stage('build_scoreboard'):
+            execute_query(uri=SQLALCHEMY_DATABASE_URI,
+                          query=build_scoreboard.query
+                          )
+
+
+def daily_tasks(run, day=TODAY):
+    """Returns the Tasks of the daily run for day
+
+    Parameters
+    ----------
+    run - instrumentation.PipelineRun recording the load stages
+    day - date of today's games, results are loaded through the prior day
+    """
+    return [
+        Task('migrate',
+             lambda: migrations.migrate(SQLALCHEMY_DATABASE_URI),
+             retry_on=DATABASE_RETRY_ON),
+        Task('source_watermarks',
+             lambda migrate: watermarks.read_watermarks(
+                 SQLALCHEMY_DATABASE_URI),
+             deps=['migrate'], retry_on=DATABASE_RETRY_ON),
+        Task('nst_data', partial(scrape_nst, day),
+             deps=['source_watermarks'], retry_on=SCRAPE_RETRY_ON),
+        Task('nhl_data', partial(scrape_nhl, day),
+             deps=['source_watermarks'], retry_on=SCRAPE_RETRY_ON),
+        Task('elo_data', partial(scrape_elo, day),
+             deps=['source_watermarks'], retry_on=SCRAPE_RETRY_ON),
+        Task('todays_games', partial(scrape_todays_games, day),
+             retry_on=SCRAPE_RETRY_ON),
+        Task('load_day', partial(load_day, run, day),
+             deps=['nst_data', 'nhl_data', 'elo_data', 'todays_games'],
+             retry_on=DATABASE_RETRY_ON),
+        Task('model_pipeline',
+             lambda load_day: model.get_model(SQLALCHEMY_DATABASE_URI,
+                                              ModelRegistry()),
+             deps=['load_day'], retry_on=DATABASE_RETRY_ON),
+        Task('prediction_df',
+             lambda model_pipeline: model.predict_todays_games(
+                 SQLALCHEMY_DATABASE_URI, model_pipeline),
+             deps=['model_pipeline'], retry_on=DATABASE_RETRY_ON),
+        Task('publish',
+             lambda prediction_df: model.save_predictions(
+                 SQLALCHEMY_DATABASE_URI, prediction_df),
+             deps=['prediction_df'], retry_on=DATABASE_RETRY_ON)
+    ]
 
 
 if __name__ == '__main__':
-    this_season = get_season_string(TODAY)
-    yesterday = TODAY - timedelta(days=1)
-
-    nst_data = nst_pipeline(from_season=this_season, to_season=this_season)
-    nst_data = nst_filter_date(nst_data, yesterday)
-    save_to_database(uri=SQLALCHEMY_DATABASE_URI,
-                     df=nst_data,
-                     table_name='nst',
-                     if_exists='append',
-                     dtype=NST_DTYPE)
-
-    target_date = yesterday.strftime('%Y-%m-%d')
-    nhl_data = nhl_pipeline(start_date=target_date, end_date=target_date)
-    save_to_database(uri=SQLALCHEMY_DATABASE_URI,
-                     df=nhl_data,
-                     table_name='nhl',
-                     if_exists='append',
-                     dtype=NHL_DTYPE)
-
-    elo_data = elo_pipeline(start_date=target_date, end_date=target_date)
-    save_to_database(uri=SQLALCHEMY_DATABASE_URI,
-                     df=elo_data,
-                     table_name='elo',
-                     if_exists='append',
-                     dtype=ELO_DTYPE)
-
-    todays_games = nhl_pipeline(start_date=TODAY.strftime('%Y-%m-%d'),
-                                end_date=TODAY.strftime('%Y-%m-%d')
-                                )
-    save_to_database(uri=SQLALCHEMY_DATABASE_URI,
-                     df=todays_games,
-                     table_name='todays_games',
-                     if_exists='replace',
-                     dtype=NHL_DTYPE
-                     )
-
-    execute_query(uri=SQLALCHEMY_DATABASE_URI,
-                  query=build_team_stats_table.query
-                  )
-
-    execute_query(uri=SQLALCHEMY_DATABASE_URI,
-                  query=build_features.query
-                  )
+    run = PipelineRun('daily_pull')
+
+    try:
+        TaskRunner(daily_tasks(run), run_key=TODAY.isoformat(),
+                   pipeline_run=run).run()
+    finally:
+        run.finish(SQLALCHEMY_DATABASE_URI)
+
+    prune_checkpoints()
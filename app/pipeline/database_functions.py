@@ -1,17 +1,107 @@
+import atexit
+from contextlib import contextmanager
+import csv
+import io
 import numpy as np
 import os
 import pandas as pd
+import threading
+import time
 from sqlalchemy import create_engine, text
-from sqlalchemy.types import (String, Integer, BigInteger, Float, Date,
-                              DateTime, Boolean
+from sqlalchemy.types import (String, Integer, SmallInteger, BigInteger, Float,
+                              Date, DateTime, Boolean
                               )
 
 
+COPY_CHUNKSIZE = 50000
+# connection pool settings shared by every engine in the process
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 5))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+
+_engines = {}
+_engines_lock = threading.Lock()
+# connections of the transactions opened with transaction(), per thread
+_local = threading.local()
+
+
 def get_db_uri():
     uri = os.environ['DATABASE_URL']
     return uri
 
 
+def get_engine(uri):
+    """Returns the process wide pooled engine for uri, creating it on first
+    use. Connections are checked with a pre-ping before being handed out so
+    that ones dropped by the server are replaced transparently."""
+    with _engines_lock:
+        engine = _engines.get(uri)
+        if engine is None:
+            engine = create_engine(uri,
+                                   pool_size=DB_POOL_SIZE,
+                                   max_overflow=DB_MAX_OVERFLOW,
+                                   pool_recycle=DB_POOL_RECYCLE,
+                                   pool_pre_ping=True
+                                   )
+            _engines[uri] = engine
+
+    return engine
+
+
+@atexit.register
+def dispose_engines():
+    """Closes the pooled connections of every registered engine"""
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+
+
+@contextmanager
+def transaction(uri):
+    """Groups every save_to_database, execute_query and read_query call for
+    uri made by this thread inside the block into a single transaction,
+    committed when the block exits and rolled back on an error
+
+    Usage
+    -----
+    with transaction(uri):
+        save_to_database(uri, ...)
+        execute_query(uri, ...)
+    """
+    connections = _active_connections()
+    if uri in connections:
+        # already inside a transaction, join it
+        yield connections[uri]
+        return
+
+    with get_engine(uri).begin() as connection:
+        connections[uri] = connection
+        try:
+            yield connection
+        finally:
+            del connections[uri]
+
+
+def _active_connections():
+    if not hasattr(_local, 'connections'):
+        _local.connections = {}
+
+    return _local.connections
+
+
+@contextmanager
+def _connect(uri):
+    # reuse the connection of an open transaction, otherwise run in a
+    # transaction of its own on a pooled connection
+    connection = _active_connections().get(uri)
+    if connection is not None:
+        yield connection
+    else:
+        with get_engine(uri).begin() as connection:
+            yield connection
+
+
 def get_nst_dtype():
     nst_dtype = {'game': String(),
                  'team': String(),
@@ -73,7 +163,7 @@ def get_nst_dtype():
                  'attendance': BigInteger(),
                  'date': Date(),
                  'season': String(),
-                 'team_key': String(),
+                 'team_id': SmallInteger(),
                  'toi_pp': Float(),
                  'xgf_pp': Float(),
                  'gf_pp': Integer(),
@@ -98,8 +188,8 @@ def get_nhl_dtype():
                  'away_score': Integer(),
                  'status': String(),
                  'home_team_won': Boolean(),
-                 'home_team_key': String(),
-                 'away_team_key': String()
+                 'home_team_id': SmallInteger(),
+                 'away_team_id': SmallInteger()
                  }
 
     return nhl_dtype
@@ -129,8 +219,8 @@ def get_elo_dtype():
                  'game_quality_rating': Float(),
                  'game_importance_rating': Float(),
                  'game_overall_rating': Float(),
-                 'home_team_key': String(),
-                 'away_team_key': String()
+                 'home_team_id': SmallInteger(),
+                 'away_team_id': SmallInteger()
                  }
 
     return elo_dtype
@@ -151,31 +241,178 @@ def get_prediction_dtype():
     return prediction_dtype
 
 
-def save_to_database(uri, df, table_name, if_exists, dtype):
-    con = create_engine(uri)
+def get_pipeline_runs_dtype():
+    pipeline_runs_dtype = {'run_id': String(),
+                           'pipeline': String(),
+                           'stage': String(),
+                           'status': String(),
+                           'started_at': DateTime(),
+                           'wall_seconds': Float(),
+                           'cpu_seconds': Float(),
+                           'peak_rss_mb': Float(),
+                           'rows_in': BigInteger(),
+                           'rows_out': BigInteger(),
+                           'bytes_downloaded': BigInteger()
+                           }
+
+    return pipeline_runs_dtype
+
+
+def get_model_selection_dtype():
+    model_selection_dtype = {'run_id': String(),
+                             'run_at': DateTime(),
+                             'learner': String(),
+                             'params': String(),
+                             'folds': Integer(),
+                             'n_rows': Integer(),
+                             'log_loss': Float(),
+                             'log_loss_std': Float(),
+                             'brier': Float(),
+                             'accuracy': Float(),
+                             'fit_seconds': Float(),
+                             'score_seconds': Float(),
+                             'rank': Integer()
+                             }
+
+    return model_selection_dtype
+
+
+def psql_insert_copy(table, conn, keys, data_iter):
+    """pandas to_sql insertion method that streams each chunk of rows into
+    postgres with COPY ... FROM STDIN through an in-memory csv buffer
+
+    Parameters
+    ----------
+    table - pandas.io.sql.SQLTable
+    conn - sqlalchemy Connection
+    keys - list of column names
+    data_iter - iterable of row tuples for the chunk
+    """
+    # integer columns may arrive as floats when the frame had NaNs, which
+    # COPY will not cast the way an INSERT does
+    int_columns = [i for i, k in enumerate(keys)
+                   if isinstance(table.table.columns[k].type, Integer)]
+    # ex. counts with NaNs downcast to float32, already saved as integers
+    float32_columns = [i for i in _float32_columns(table, keys)
+                       if i not in int_columns]
+
+    num_rows = 0
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in data_iter:
+        if int_columns or float32_columns:
+            row = list(row)
+            for i in int_columns:
+                if isinstance(row[i], float):
+                    row[i] = int(row[i])
+            for i in float32_columns:
+                if row[i] is not None:
+                    row[i] = str(np.float32(row[i]))
+        writer.writerow(row)
+        num_rows += 1
+    buffer.seek(0)
+
+    columns = ', '.join(f'"{k}"' for k in keys)
+    if table.schema:
+        table_name = f'"{table.schema}"."{table.name}"'
+    else:
+        table_name = f'"{table.name}"'
+
+    dbapi_conn = conn.connection
+    with dbapi_conn.cursor() as cur:
+        cur.copy_expert(sql=f'COPY {table_name} ({columns}) FROM STDIN '
+                            'WITH (FORMAT csv)',
+                        file=buffer
+                        )
+
+    return num_rows
+
+
+def _float32_columns(table, keys):
+    """Positions in keys of the float32 columns, ex. from nst_downcast, of
+    the frame being saved. They are saved through their shortest decimal
+    repr, so 52.13 is saved as 52.13 rather than the 52.130001068115234 a
+    plain cast gives."""
+    return [i for i, k in enumerate(keys)
+            if k in table.frame.columns
+            and table.frame[k].dtype == np.float32]
+
+
+def insert_rows(table, conn, keys, data_iter):
+    """pandas to_sql insertion method running a batched INSERT per chunk
+    like the default one, widening float32 values chunk by chunk rather
+    than copying the frame
+
+    Parameters
+    ----------
+    see psql_insert_copy
+    """
+    float32_columns = _float32_columns(table, keys)
+
+    rows = []
+    for row in data_iter:
+        if float32_columns:
+            row = list(row)
+            for i in float32_columns:
+                if row[i] is not None:
+                    row[i] = float(str(np.float32(row[i])))
+        rows.append(dict(zip(keys, row)))
+    result = conn.execute(table.table.insert(), rows)
+
+    return result.rowcount
+
+
+def save_to_database(uri, df, table_name, if_exists, dtype, bulk=False):
+    """Saves a DataFrame to a table, creating the table from dtype if needed
+
+    Parameters
+    ----------
+    uri - database uri
+    df - pandas DataFrame to save
+    table_name - name of the target table
+    if_exists - one of [fail, replace, append], passed to to_sql
+    dtype - dict of column name to sqlalchemy type, ex. get_nst_dtype()
+    bulk - load with postgres COPY in chunks of COPY_CHUNKSIZE rows rather
+           than batched INSERTs, for large loads
+    """
     print(f'Saving to {table_name} table...')
-    num_rows = df.to_sql(table_name, con, if_exists=if_exists, index=False,
-                         chunksize=500, dtype=dtype
-                         )
-    con.dispose()
+    start = time.perf_counter()
+    with _connect(uri) as con:
+        if bulk:
+            num_rows = df.to_sql(table_name, con, if_exists=if_exists,
+                                 index=False, chunksize=COPY_CHUNKSIZE,
+                                 dtype=dtype, method=psql_insert_copy
+                                 )
+        else:
+            num_rows = df.to_sql(table_name, con, if_exists=if_exists,
+                                 index=False, chunksize=500, dtype=dtype,
+                                 method=insert_rows
+                                 )
+    elapsed = time.perf_counter() - start
 
-    return print(f'Saving to {table_name} complete, {num_rows} added.')
+    rate = len(df) / elapsed if elapsed > 0 else float('inf')
+    return print(f'Saving to {table_name} complete, {num_rows} added '
+                 f'in {elapsed:.2f}s ({rate:,.0f} rows/sec).')
 
 
-def execute_query(uri, query):
-    engine = create_engine(uri)
-    with engine.connect() as connection:
-        connection.execute(text(query))
+def execute_query(uri, query, params=None):
+    # params binds :name style parameters
+    with _connect(uri) as connection:
+        connection.execute(text(query), params or {})
 
     return print('Query Run')
 
 
-def read_query(uri, query, date_fields):
-    con = create_engine(uri)
-    df = pd.read_sql(sql=query,
-                     con=con,
-                     parse_dates=date_fields
-                     )
-    con.dispose()
+def read_query(uri, query, date_fields, params=None):
+    if params is not None:
+        # bind :name style parameters
+        query = text(query)
+
+    with _connect(uri) as con:
+        df = pd.read_sql(sql=query,
+                         con=con,
+                         parse_dates=date_fields,
+                         params=params
+                         )
 
     return df
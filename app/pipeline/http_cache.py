@@ -0,0 +1,234 @@
+"""HTTP response cache
+
+Persistent on-disk cache for scraped pages. Responses are stored content
+addressed by the sha256 of their body, with a small metadata entry per url
+holding the body hash, validators (ETag/Last-Modified) and fetch time. Fresh
+entries are served without touching the network, stale entries are
+revalidated with a conditional request, and the least recently used files are
+evicted once the cache grows past max_bytes. Parsed DataFrames are cached next
+to the bodies, keyed by the body hash, so unchanged pages are never re-parsed.
+
+Settings can be overridden with the environment variables
+NHL_BETS_CACHE_DIR, NHL_BETS_CACHE_TTL (seconds) and NHL_BETS_CACHE_MAX_BYTES.
+"""
+
+from collections import namedtuple
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
+from instrumentation import count_download
+
+CACHE_DIR = os.environ.get('NHL_BETS_CACHE_DIR',
+                           os.path.join(os.path.dirname(
+                               os.path.abspath(__file__)), '.cache')
+                           )
+CACHE_TTL = int(os.environ.get('NHL_BETS_CACHE_TTL', 6 * 60 * 60))
+CACHE_MAX_BYTES = int(os.environ.get('NHL_BETS_CACHE_MAX_BYTES',
+                                     512 * 1024 * 1024))
+
+Page = namedtuple('Page', ['text', 'digest', 'from_cache'])
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _atomic_write(path, data):
+    # write to a temp file and rename so concurrent readers never see a
+    # partially written file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class ResponseCache:
+    """On-disk, content addressed cache of http responses and parsed pages
+
+    Parameters
+    ----------
+    cache_dir - directory holding the cache
+    ttl - seconds a response is served without revalidation
+    max_bytes - size of stored bodies and parsed pages before eviction
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, ttl=CACHE_TTL,
+                 max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        for sub_dir in ['entries', 'bodies', 'parsed']:
+            os.makedirs(os.path.join(cache_dir, sub_dir), exist_ok=True)
+
+    def _entry_path(self, url):
+        return os.path.join(self.cache_dir, 'entries',
+                            _sha256(url.encode()) + '.json')
+
+    def _body_path(self, digest):
+        return os.path.join(self.cache_dir, 'bodies', digest)
+
+    def _parsed_path(self, digest, key):
+        return os.path.join(self.cache_dir, 'parsed',
+                            f'{digest}-{_sha256(key.encode())[:16]}.pkl')
+
+    def _load_entry(self, url):
+        try:
+            with open(self._entry_path(url)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if not os.path.exists(self._body_path(entry['digest'])):
+            return None
+
+        return entry
+
+    def _save_entry(self, url, entry):
+        _atomic_write(self._entry_path(url), json.dumps(entry).encode())
+
+    def _read_body(self, entry):
+        path = self._body_path(entry['digest'])
+        with open(path, 'rb') as f:
+            body = f.read()
+        # mark as recently used for eviction
+        os.utime(path)
+
+        return body.decode(entry.get('encoding') or 'utf-8', errors='replace')
+
+    def get(self, url, fetch):
+        """Returns the page at url, from the cache when fresh
+
+        Parameters
+        ----------
+        url - page url
+        fetch - callable taking a dict of request headers and returning a
+                requests Response, only called on a miss or revalidation
+
+        Returns
+        -------
+        Page namedtuple of (text, digest, from_cache)"""
+        entry = self._load_entry(url)
+        now = time.time()
+
+        if entry is not None and now - entry['fetched_at'] < self.ttl:
+            return Page(self._read_body(entry), entry['digest'], True)
+
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        response = fetch(headers)
+
+        if entry is not None and response.status_code == 304:
+            entry['fetched_at'] = now
+            self._save_entry(url, entry)
+            return Page(self._read_body(entry), entry['digest'], True)
+
+        response.raise_for_status()
+        body = response.content
+        count_download(len(body))
+        digest = _sha256(body)
+        body_path = self._body_path(digest)
+        if not os.path.exists(body_path):
+            _atomic_write(body_path, body)
+
+        self._save_entry(url, {'url': url,
+                               'digest': digest,
+                               'encoding': response.encoding,
+                               'etag': response.headers.get('ETag'),
+                               'last_modified':
+                                   response.headers.get('Last-Modified'),
+                               'fetched_at': now,
+                               'size': len(body)
+                               })
+        self.evict()
+
+        return Page(response.text, digest, False)
+
+    def get_parsed(self, digest, key):
+        """Returns the cached parse of a body, or None on a miss
+
+        Parameters
+        ----------
+        digest - body digest from a Page
+        key - str identifying the parser and its options
+        """
+        path = self._parsed_path(digest, key)
+        try:
+            with open(path, 'rb') as f:
+                parsed = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        os.utime(path)
+
+        return parsed
+
+    def set_parsed(self, digest, key, parsed):
+        _atomic_write(self._parsed_path(digest, key),
+                      pickle.dumps(parsed, protocol=pickle.HIGHEST_PROTOCOL))
+        self.evict()
+
+    def parsed(self, page, parser, key=None):
+        """Parses a page with parser, reusing the cached result for an
+        unchanged body
+
+        Parameters
+        ----------
+        page - Page returned by get
+        parser - callable taking the page text
+        key - str identifying the parser and its options, defaults to the
+              parser's qualified name
+        """
+        if key is None:
+            key = f'{parser.__module__}.{parser.__qualname__}'
+
+        parsed = self.get_parsed(page.digest, key)
+        if parsed is None:
+            parsed = parser(page.text)
+            self.set_parsed(page.digest, key, parsed)
+
+        return parsed
+
+    def evict(self):
+        """Removes least recently used bodies and parsed pages until the
+        cache is under max_bytes"""
+        with self._lock:
+            files = []
+            for sub_dir in ['bodies', 'parsed']:
+                with os.scandir(os.path.join(self.cache_dir, sub_dir)) as it:
+                    for f in it:
+                        if f.is_file():
+                            stat = f.stat()
+                            files.append((stat.st_mtime, stat.st_size,
+                                          f.path))
+
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+
+
+_default_cache = None
+
+
+def default_cache():
+    """Returns the process wide ResponseCache using the default settings"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResponseCache()
+
+    return _default_cache
@@ -0,0 +1,222 @@
+"""Pipeline instrumentation
+
+Records wall time, CPU time, peak memory, rows in/out and bytes downloaded
+for each stage of a pipeline run, saves them to the pipeline_runs table and
+optionally writes them as a Prometheus text format file for the node
+exporter's textfile collector.
+
+The metrics file is only written when NHL_BETS_METRICS_FILE is set.
+
+CPU time and bytes downloaded are process wide counters, which include the
+worker threads a stage starts, ex. the nst page fetches. Stages that run at
+the same time in different threads, ex. the scrapes started together by
+task_runner, would count each other's work, so their cpu_seconds and
+bytes_downloaded are left empty.
+
+Usage
+-----
+run = PipelineRun('daily_pull')
+with run.stage('scrape_nst') as stage:
+    df = nst_get_merge_sits(...)
+    stage.rows_out = len(df)
+run.finish(uri)
+"""
+
+from contextlib import contextmanager
+from datetime import datetime
+import os
+import tempfile
+import threading
+import time
+import uuid
+import pandas as pd
+from database_functions import get_pipeline_runs_dtype, save_to_database
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+METRICS_FILE = os.environ.get('NHL_BETS_METRICS_FILE')
+METRIC_PREFIX = 'nhl_bets_pipeline'
+
+_bytes_downloaded = 0
+_bytes_lock = threading.Lock()
+
+
+def count_download(num_bytes):
+    """Adds to the process wide count of bytes downloaded, called for every
+    response body fetched from the network"""
+    global _bytes_downloaded
+    with _bytes_lock:
+        _bytes_downloaded += num_bytes
+
+
+def bytes_downloaded():
+    return _bytes_downloaded
+
+
+def peak_rss_mb():
+    """Peak resident memory of the process so far in MB, None if unknown"""
+    if resource is None:
+        return None
+
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Stage:
+    """Metrics of a single stage, rows_in and rows_out are set by the caller
+    inside the stage block"""
+
+    def __init__(self, name):
+        self.name = name
+        self.rows_in = None
+        self.rows_out = None
+        self.started_at = None
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.peak_rss_mb = None
+        self.bytes_downloaded = None
+        self.status = None
+        # another stage ran while this one was open
+        self.overlapped = False
+
+
+class PipelineRun:
+    """Collects the stage metrics of one run of a pipeline script
+
+    Parameters
+    ----------
+    pipeline - name of the pipeline, ex. daily_pull
+    """
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.run_id = uuid.uuid4().hex
+        self.stages = []
+        self._open_stages = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """Times the block as stage name, marking it failed if the block
+        raises"""
+        stage = Stage(name)
+        stage.rows_in = rows_in
+        stage.started_at = datetime.now()
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        start_bytes = bytes_downloaded()
+        # stages nested in this thread are part of this stage's work, only
+        # the ones open in other threads overlap it
+        thread = threading.get_ident()
+        with self._lock:
+            for open_thread, open_stage in self._open_stages:
+                if open_thread != thread:
+                    open_stage.overlapped = True
+                    stage.overlapped = True
+            self._open_stages.append((thread, stage))
+        try:
+            yield stage
+            stage.status = 'ok'
+        except BaseException:
+            stage.status = 'error'
+            raise
+        finally:
+            stage.wall_seconds = time.perf_counter() - start_wall
+            cpu_seconds = time.process_time() - start_cpu
+            stage_bytes = bytes_downloaded() - start_bytes
+            with self._lock:
+                self._open_stages.remove((thread, stage))
+                if not stage.overlapped:
+                    stage.cpu_seconds = cpu_seconds
+                    stage.bytes_downloaded = stage_bytes
+                self.stages.append(stage)
+            stage.peak_rss_mb = peak_rss_mb()
+            print(f'{self.pipeline}.{name} {stage.status} in '
+                  f'{stage.wall_seconds:.2f}s')
+
+    def to_frame(self):
+        """Returns the stage metrics as rows of the pipeline_runs table"""
+        return pd.DataFrame([{'run_id': self.run_id,
+                              'pipeline': self.pipeline,
+                              'stage': s.name,
+                              'status': s.status,
+                              'started_at': s.started_at,
+                              'wall_seconds': s.wall_seconds,
+                              'cpu_seconds': s.cpu_seconds,
+                              'peak_rss_mb': s.peak_rss_mb,
+                              'rows_in': s.rows_in,
+                              'rows_out': s.rows_out,
+                              'bytes_downloaded': s.bytes_downloaded
+                              } for s in self.stages]
+                            ).astype({'rows_in': 'Int64', 'rows_out': 'Int64',
+                                      'bytes_downloaded': 'Int64'})
+
+    def to_prometheus(self):
+        """Returns the stage metrics in the Prometheus text format"""
+        metrics = [('wall_seconds', 'Stage wall clock time in seconds'),
+                   ('cpu_seconds', 'Stage CPU time in seconds'),
+                   ('peak_rss_mb', 'Process peak resident memory in MB at '
+                                   'the end of the stage'),
+                   ('rows_in', 'Rows into the stage'),
+                   ('rows_out', 'Rows out of the stage'),
+                   ('bytes_downloaded', 'Bytes downloaded by the stage')]
+
+        lines = []
+        for metric, description in metrics:
+            name = f'{METRIC_PREFIX}_stage_{metric}'
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} gauge')
+            for s in self.stages:
+                value = getattr(s, metric)
+                if value is None:
+                    continue
+                lines.append(f'{name}{{pipeline="{self.pipeline}",'
+                             f'stage="{s.name}"}} {float(value)}')
+
+        name = f'{METRIC_PREFIX}_stage_success'
+        lines.append(f'# HELP {name} 1 if the stage succeeded on the last run')
+        lines.append(f'# TYPE {name} gauge')
+        for s in self.stages:
+            lines.append(f'{name}{{pipeline="{self.pipeline}",'
+                         f'stage="{s.name}"}} {int(s.status == "ok")}')
+
+        name = f'{METRIC_PREFIX}_last_run_timestamp_seconds'
+        lines.append(f'# TYPE {name} gauge')
+        lines.append(f'{name}{{pipeline="{self.pipeline}"}} {time.time()}')
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """Atomically writes the Prometheus text file so the collector never
+        reads a partial file"""
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(
+            os.path.abspath(path)))
+        with os.fdopen(fd, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def finish(self, uri, metrics_file=METRICS_FILE):
+        """Saves the run to the pipeline_runs table, and to metrics_file if
+        set. Meant to be called from a finally block, so failures to record
+        are reported rather than raised."""
+        if not self.stages:
+            return
+
+        try:
+            save_to_database(uri=uri,
+                             df=self.to_frame(),
+                             table_name='pipeline_runs',
+                             if_exists='append',
+                             dtype=get_pipeline_runs_dtype()
+                             )
+        except Exception as e:
+            print(f'Could not save pipeline run {self.run_id}: {e}')
+
+        if metrics_file:
+            try:
+                self.write_prometheus(metrics_file)
+            except OSError as e:
+                print(f'Could not write {metrics_file}: {e}')
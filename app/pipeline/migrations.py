@@ -0,0 +1,752 @@
+"""Schema migrations
+
+The database schema as an ordered list of migrations. migrate() applies the
+ones a database has not had yet and records them in the schema_migrations
+table, so it is safe to run before every load. Pending migrations are applied
+in one transaction under an advisory lock, a failure leaves the schema as it
+was and concurrent runs wait for each other.
+
+nst, nhl and elo are range partitioned on date by season, August 1 to July 31
+like get_season_string, so the date filters of the incremental builds only
+scan the current season. The season partitions are created by
+ensure_partitions before each load, rows outside them land in the table's
+default partition. Tables loaded before partitioning are converted in place.
+
+Each migration's SQL is frozen below as the literal text that was released.
+A released migration is never edited, even when the module its tables
+belong to changes, so new and existing databases end up with the same
+schema. A schema change is a new migration appended to MIGRATIONS.
+
+Usage
+-----
+python migrations.py
+"""
+
+from database_functions import (get_db_uri,
+                                execute_query,
+                                read_query,
+                                transaction
+                                )
+
+# tables partitioned by season, see ensure_partitions
+PARTITIONED_TABLES = ['nst', 'nhl', 'elo']
+
+create_migrations_table = """
+CREATE TABLE IF NOT EXISTS schema_migrations(
+	version integer,
+	name varchar,
+	applied_at timestamp DEFAULT now(),
+	PRIMARY KEY (version)
+);
+"""
+
+# serializes concurrent migrate() calls until the transaction ends
+lock = """
+SELECT pg_advisory_xact_lock(hashtext('schema_migrations'));
+"""
+
+# team dimension with the ids of teams.py at the time, teams added later get
+# their own migration
+teams_table = """
+CREATE TABLE IF NOT EXISTS teams(
+	team_id smallint,
+	abbr char(3) UNIQUE,
+	name varchar,
+	PRIMARY KEY (team_id)
+);
+
+INSERT INTO teams(team_id, abbr, name)
+VALUES
+	(1, 'ANA', 'Anaheim Ducks'),
+	(2, 'ARI', 'Arizona Coyotes'),
+	(3, 'BOS', 'Boston Bruins'),
+	(4, 'BUF', 'Buffalo Sabres'),
+	(5, 'CGY', 'Calgary Flames'),
+	(6, 'CAR', 'Carolina Hurricanes'),
+	(7, 'CHI', 'Chicago Blackhawks'),
+	(8, 'COL', 'Colorado Avalanche'),
+	(9, 'CBJ', 'Columbus Blue Jackets'),
+	(10, 'DAL', 'Dallas Stars'),
+	(11, 'DET', 'Detroit Red Wings'),
+	(12, 'EDM', 'Edmonton Oilers'),
+	(13, 'FLA', 'Florida Panthers'),
+	(14, 'L.A', 'Los Angeles Kings'),
+	(15, 'MIN', 'Minnesota Wild'),
+	(16, 'MTL', 'Montreal Canadiens'),
+	(17, 'NSH', 'Nashville Predators'),
+	(18, 'N.J', 'New Jersey Devils'),
+	(19, 'NYI', 'New York Islanders'),
+	(20, 'NYR', 'New York Rangers'),
+	(21, 'OTT', 'Ottawa Senators'),
+	(22, 'PHI', 'Philadelphia Flyers'),
+	(23, 'PIT', 'Pittsburgh Penguins'),
+	(24, 'S.J', 'San Jose Sharks'),
+	(25, 'SEA', 'Seattle Kraken'),
+	(26, 'STL', 'St. Louis Blues'),
+	(27, 'T.B', 'Tampa Bay Lightning'),
+	(28, 'TOR', 'Toronto Maple Leafs'),
+	(29, 'VAN', 'Vancouver Canucks'),
+	(30, 'VGK', 'Vegas Golden Knights'),
+	(31, 'WSH', 'Washington Capitals'),
+	(32, 'WPG', 'Winnipeg Jets')
+ON CONFLICT (team_id) DO UPDATE SET
+	abbr = EXCLUDED.abbr,
+	name = EXCLUDED.name;
+"""
+
+# converts tables written with the string keys, ex. 'TOR_2022-04-20', to
+# (team_id, date) keys, a no-op once converted or on a new database.
+# team_stats is dropped rather than converted, the next incremental build
+# rebuilds it in full.
+team_ids = """
+DO $$
+BEGIN
+	IF EXISTS (SELECT 1 FROM information_schema.columns
+			   WHERE table_name = 'nst' AND column_name = 'team_key') THEN
+		ALTER TABLE nst ADD COLUMN IF NOT EXISTS team_id smallint;
+		UPDATE nst SET team_id = teams.team_id
+		FROM teams WHERE nst.team = teams.abbr;
+		ALTER TABLE nst DROP COLUMN team_key;
+	END IF;
+
+	IF EXISTS (SELECT 1 FROM information_schema.columns
+			   WHERE table_name = 'nhl' AND column_name = 'home_team_key') THEN
+		ALTER TABLE nhl ADD COLUMN IF NOT EXISTS home_team_id smallint;
+		ALTER TABLE nhl ADD COLUMN IF NOT EXISTS away_team_id smallint;
+		UPDATE nhl SET home_team_id = home.team_id, away_team_id = away.team_id
+		FROM teams home, teams away
+		WHERE nhl.home_team = home.abbr AND nhl.away_team = away.abbr;
+		ALTER TABLE nhl DROP COLUMN home_team_key;
+		ALTER TABLE nhl DROP COLUMN away_team_key;
+	END IF;
+
+	IF EXISTS (SELECT 1 FROM information_schema.columns
+			   WHERE table_name = 'elo' AND column_name = 'home_team_key') THEN
+		ALTER TABLE elo ADD COLUMN IF NOT EXISTS home_team_id smallint;
+		ALTER TABLE elo ADD COLUMN IF NOT EXISTS away_team_id smallint;
+		UPDATE elo SET home_team_id = home.team_id, away_team_id = away.team_id
+		FROM teams home, teams away
+		WHERE elo.home_team_abbr = home.abbr
+		AND elo.away_team_abbr = away.abbr;
+		ALTER TABLE elo DROP COLUMN home_team_key;
+		ALTER TABLE elo DROP COLUMN away_team_key;
+	END IF;
+
+	IF EXISTS (SELECT 1 FROM information_schema.columns
+			   WHERE table_name = 'features'
+			   AND column_name = 'home_team_key') THEN
+		ALTER TABLE features ADD COLUMN IF NOT EXISTS home_team_id smallint;
+		ALTER TABLE features ADD COLUMN IF NOT EXISTS away_team_id smallint;
+		UPDATE features
+		SET home_team_id = home.team_id, away_team_id = away.team_id
+		FROM teams home, teams away
+		WHERE features.home_team = home.abbr
+		AND features.away_team = away.abbr;
+		ALTER TABLE features DROP COLUMN home_team_key;
+		ALTER TABLE features DROP COLUMN away_team_key;
+	END IF;
+
+	IF EXISTS (SELECT 1 FROM information_schema.columns
+			   WHERE table_name = 'team_stats'
+			   AND column_name = 'team_key') THEN
+		DROP TABLE team_stats;
+	END IF;
+END
+$$;
+"""
+
+# nst, nhl and elo partitioned by season, tables loaded before partitioning
+# are converted in place. create_season_partitions creates the missing
+# season partitions of parent between two dates, named after the season,
+# ex. nst_20212022. The keyed views would block dropping the unpartitioned
+# tables, version 6 recreates them.
+season_partitions = """
+DROP VIEW IF EXISTS nst_keyed;
+DROP VIEW IF EXISTS nhl_keyed;
+DROP VIEW IF EXISTS elo_keyed;
+DROP VIEW IF EXISTS team_stats_keyed;
+DROP VIEW IF EXISTS features_keyed;
+
+CREATE OR REPLACE FUNCTION create_season_partitions(
+	parent text, first_date date, last_date date) RETURNS void AS $$
+DECLARE
+	season_start date;
+BEGIN
+	season_start := make_date(
+		extract(year FROM first_date - interval '7 months')::int, 8, 1);
+	WHILE season_start <= last_date LOOP
+		EXECUTE format(
+			'CREATE TABLE IF NOT EXISTS %I PARTITION OF %I '
+			'FOR VALUES FROM (%L) TO (%L)',
+			parent || '_' || extract(year FROM season_start)::int
+				|| extract(year FROM season_start)::int + 1,
+			parent, season_start, season_start + interval '1 year');
+		season_start := (season_start + interval '1 year')::date;
+	END LOOP;
+END
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+	IF EXISTS (SELECT 1 FROM pg_class
+			   WHERE oid = to_regclass('nst') AND relkind = 'r') THEN
+		ALTER TABLE nst RENAME TO nst_unpartitioned;
+	END IF;
+END
+$$;
+
+CREATE TABLE IF NOT EXISTS nst(
+	"game" VARCHAR,
+	"team" VARCHAR,
+	"toi_5v5" FLOAT,
+	"cf_5v5" INTEGER,
+	"ca_5v5" INTEGER,
+	"cf%_5v5" FLOAT,
+	"ff_5v5" INTEGER,
+	"fa_5v5" INTEGER,
+	"ff%_5v5" FLOAT,
+	"sf_5v5" INTEGER,
+	"sa_5v5" INTEGER,
+	"sf%_5v5" FLOAT,
+	"gf_5v5" INTEGER,
+	"ga_5v5" INTEGER,
+	"gf%_5v5" FLOAT,
+	"xgf_5v5" FLOAT,
+	"xga_5v5" FLOAT,
+	"xgf%_5v5" FLOAT,
+	"scf_5v5" INTEGER,
+	"sca_5v5" INTEGER,
+	"scf%_5v5" FLOAT,
+	"hdcf_5v5" INTEGER,
+	"hdca_5v5" INTEGER,
+	"hdcf%_5v5" FLOAT,
+	"hdsf_5v5" INTEGER,
+	"hdsa_5v5" INTEGER,
+	"hdsf%_5v5" FLOAT,
+	"hdgf_5v5" INTEGER,
+	"hdga_5v5" INTEGER,
+	"hdgf%_5v5" FLOAT,
+	"hdsh%_5v5" FLOAT,
+	"hdsv%_5v5" FLOAT,
+	"mdcf_5v5" INTEGER,
+	"mdca_5v5" INTEGER,
+	"mdcf%_5v5" FLOAT,
+	"mdsf_5v5" INTEGER,
+	"mdsa_5v5" INTEGER,
+	"mdsf%_5v5" FLOAT,
+	"mdgf_5v5" INTEGER,
+	"mdga_5v5" INTEGER,
+	"mdgf%_5v5" FLOAT,
+	"mdsh%_5v5" FLOAT,
+	"mdsv%_5v5" FLOAT,
+	"ldcf_5v5" INTEGER,
+	"ldca_5v5" INTEGER,
+	"ldcf%_5v5" FLOAT,
+	"ldsf_5v5" INTEGER,
+	"ldsa_5v5" INTEGER,
+	"ldsf%_5v5" FLOAT,
+	"ldgf_5v5" INTEGER,
+	"ldga_5v5" INTEGER,
+	"ldgf%_5v5" FLOAT,
+	"ldsh%_5v5" FLOAT,
+	"ldsv%_5v5" FLOAT,
+	"sh%_5v5" FLOAT,
+	"sv%_5v5" FLOAT,
+	"pdo_5v5" FLOAT,
+	"attendance" BIGINT,
+	"date" DATE,
+	"season" VARCHAR,
+	"team_id" SMALLINT,
+	"toi_pp" FLOAT,
+	"xgf_pp" FLOAT,
+	"gf_pp" INTEGER,
+	"toi_pk" FLOAT,
+	"xga_pk" FLOAT,
+	"ga_pk" INTEGER,
+	"last_game_date" DATE,
+	"b2b" BOOLEAN
+) PARTITION BY RANGE ("date");
+
+CREATE TABLE IF NOT EXISTS nst_default PARTITION OF nst DEFAULT;
+
+DO $$
+BEGIN
+	IF to_regclass('nst_unpartitioned') IS NOT NULL THEN
+		PERFORM create_season_partitions('nst', MIN("date"), MAX("date"))
+		FROM nst_unpartitioned;
+		INSERT INTO nst("game", "team", "toi_5v5", "cf_5v5", "ca_5v5", "cf%_5v5", "ff_5v5", "fa_5v5", "ff%_5v5", "sf_5v5", "sa_5v5", "sf%_5v5", "gf_5v5", "ga_5v5", "gf%_5v5", "xgf_5v5", "xga_5v5", "xgf%_5v5", "scf_5v5", "sca_5v5", "scf%_5v5", "hdcf_5v5", "hdca_5v5", "hdcf%_5v5", "hdsf_5v5", "hdsa_5v5", "hdsf%_5v5", "hdgf_5v5", "hdga_5v5", "hdgf%_5v5", "hdsh%_5v5", "hdsv%_5v5", "mdcf_5v5", "mdca_5v5", "mdcf%_5v5", "mdsf_5v5", "mdsa_5v5", "mdsf%_5v5", "mdgf_5v5", "mdga_5v5", "mdgf%_5v5", "mdsh%_5v5", "mdsv%_5v5", "ldcf_5v5", "ldca_5v5", "ldcf%_5v5", "ldsf_5v5", "ldsa_5v5", "ldsf%_5v5", "ldgf_5v5", "ldga_5v5", "ldgf%_5v5", "ldsh%_5v5", "ldsv%_5v5", "sh%_5v5", "sv%_5v5", "pdo_5v5", "attendance", "date", "season", "team_id", "toi_pp", "xgf_pp", "gf_pp", "toi_pk", "xga_pk", "ga_pk", "last_game_date", "b2b")
+		SELECT "game", "team", "toi_5v5", "cf_5v5", "ca_5v5", "cf%_5v5", "ff_5v5", "fa_5v5", "ff%_5v5", "sf_5v5", "sa_5v5", "sf%_5v5", "gf_5v5", "ga_5v5", "gf%_5v5", "xgf_5v5", "xga_5v5", "xgf%_5v5", "scf_5v5", "sca_5v5", "scf%_5v5", "hdcf_5v5", "hdca_5v5", "hdcf%_5v5", "hdsf_5v5", "hdsa_5v5", "hdsf%_5v5", "hdgf_5v5", "hdga_5v5", "hdgf%_5v5", "hdsh%_5v5", "hdsv%_5v5", "mdcf_5v5", "mdca_5v5", "mdcf%_5v5", "mdsf_5v5", "mdsa_5v5", "mdsf%_5v5", "mdgf_5v5", "mdga_5v5", "mdgf%_5v5", "mdsh%_5v5", "mdsv%_5v5", "ldcf_5v5", "ldca_5v5", "ldcf%_5v5", "ldsf_5v5", "ldsa_5v5", "ldsf%_5v5", "ldgf_5v5", "ldga_5v5", "ldgf%_5v5", "ldsh%_5v5", "ldsv%_5v5", "sh%_5v5", "sv%_5v5", "pdo_5v5", "attendance", "date", "season", "team_id", "toi_pp", "xgf_pp", "gf_pp", "toi_pk", "xga_pk", "ga_pk", "last_game_date", "b2b" FROM nst_unpartitioned;
+		DROP TABLE nst_unpartitioned;
+	END IF;
+END
+$$;
+
+DO $$
+BEGIN
+	IF EXISTS (SELECT 1 FROM pg_class
+			   WHERE oid = to_regclass('nhl') AND relkind = 'r') THEN
+		ALTER TABLE nhl RENAME TO nhl_unpartitioned;
+	END IF;
+END
+$$;
+
+CREATE TABLE IF NOT EXISTS nhl(
+	"game_id" VARCHAR,
+	"date" DATE,
+	"venue" VARCHAR,
+	"home_team" VARCHAR,
+	"away_team" VARCHAR,
+	"start_time" TIMESTAMP WITHOUT TIME ZONE,
+	"home_score" INTEGER,
+	"away_score" INTEGER,
+	"status" VARCHAR,
+	"home_team_won" BOOLEAN,
+	"home_team_id" SMALLINT,
+	"away_team_id" SMALLINT
+) PARTITION BY RANGE ("date");
+
+CREATE TABLE IF NOT EXISTS nhl_default PARTITION OF nhl DEFAULT;
+
+DO $$
+BEGIN
+	IF to_regclass('nhl_unpartitioned') IS NOT NULL THEN
+		PERFORM create_season_partitions('nhl', MIN("date"), MAX("date"))
+		FROM nhl_unpartitioned;
+		INSERT INTO nhl("game_id", "date", "venue", "home_team", "away_team", "start_time", "home_score", "away_score", "status", "home_team_won", "home_team_id", "away_team_id")
+		SELECT "game_id", "date", "venue", "home_team", "away_team", "start_time", "home_score", "away_score", "status", "home_team_won", "home_team_id", "away_team_id" FROM nhl_unpartitioned;
+		DROP TABLE nhl_unpartitioned;
+	END IF;
+END
+$$;
+
+DO $$
+BEGIN
+	IF EXISTS (SELECT 1 FROM pg_class
+			   WHERE oid = to_regclass('elo') AND relkind = 'r') THEN
+		ALTER TABLE elo RENAME TO elo_unpartitioned;
+	END IF;
+END
+$$;
+
+CREATE TABLE IF NOT EXISTS elo(
+	"season" INTEGER,
+	"date" DATE,
+	"playoff" BOOLEAN,
+	"neutral" BOOLEAN,
+	"ot" VARCHAR,
+	"home_team" VARCHAR,
+	"away_team" VARCHAR,
+	"home_team_abbr" VARCHAR,
+	"away_team_abbr" VARCHAR,
+	"home_team_pregame_rating" FLOAT,
+	"away_team_pregame_rating" FLOAT,
+	"home_team_winprob" FLOAT,
+	"away_team_winprob" FLOAT,
+	"overtime_prob" FLOAT,
+	"home_team_expected_points" FLOAT,
+	"away_team_expected_points" FLOAT,
+	"home_team_score" INTEGER,
+	"away_team_score" INTEGER,
+	"home_team_postgame_rating" FLOAT,
+	"away_team_postgame_rating" FLOAT,
+	"game_quality_rating" FLOAT,
+	"game_importance_rating" FLOAT,
+	"game_overall_rating" FLOAT,
+	"home_team_id" SMALLINT,
+	"away_team_id" SMALLINT
+) PARTITION BY RANGE ("date");
+
+CREATE TABLE IF NOT EXISTS elo_default PARTITION OF elo DEFAULT;
+
+DO $$
+BEGIN
+	IF to_regclass('elo_unpartitioned') IS NOT NULL THEN
+		PERFORM create_season_partitions('elo', MIN("date"), MAX("date"))
+		FROM elo_unpartitioned;
+		INSERT INTO elo("season", "date", "playoff", "neutral", "ot", "home_team", "away_team", "home_team_abbr", "away_team_abbr", "home_team_pregame_rating", "away_team_pregame_rating", "home_team_winprob", "away_team_winprob", "overtime_prob", "home_team_expected_points", "away_team_expected_points", "home_team_score", "away_team_score", "home_team_postgame_rating", "away_team_postgame_rating", "game_quality_rating", "game_importance_rating", "game_overall_rating", "home_team_id", "away_team_id")
+		SELECT "season", "date", "playoff", "neutral", "ot", "home_team", "away_team", "home_team_abbr", "away_team_abbr", "home_team_pregame_rating", "away_team_pregame_rating", "home_team_winprob", "away_team_winprob", "overtime_prob", "home_team_expected_points", "away_team_expected_points", "home_team_score", "away_team_score", "home_team_postgame_rating", "away_team_postgame_rating", "game_quality_rating", "game_importance_rating", "game_overall_rating", "home_team_id", "away_team_id" FROM elo_unpartitioned;
+		DROP TABLE elo_unpartitioned;
+	END IF;
+END
+$$;
+"""
+
+# tables written by the builds, the model and instrumentation
+derived_tables = """
+CREATE TABLE IF NOT EXISTS team_stats(
+	team_id smallint,
+	team char(3),
+	"ff%_5v5_last_half" double precision,
+	"gf%_5v5_last_half" double precision,
+	"xgf%_5v5_last_half" double precision,
+	"sh%_5v5_last_half" double precision,
+	gf_per_min_pp_last_half double precision,
+	xgf_per_min_pp_last_half double precision,
+	ga_per_min_pk_last_half double precision,
+	xga_per_min_pk_last_half double precision,
+	"date" date,
+	b2b boolean,
+	PRIMARY KEY (team_id, "date")
+);
+
+CREATE TABLE IF NOT EXISTS features(
+	game_id varchar,
+	home_team_won boolean,
+	home_team varchar,
+	home_team_id smallint,
+	home_ff_last_half double precision,
+	home_gf_last_half double precision,
+	home_xgf_last_half double precision,
+	home_sh_last_half double precision,
+	home_gf_min_pp double precision,
+	home_xgf_min_pp double precision,
+	home_ga_min_pk double precision,
+	home_xga_min_pk double precision,
+	home_b2b boolean,
+	away_team varchar,
+	away_team_id smallint,
+	away_ff_last_half double precision,
+	away_gf_last_half double precision,
+	away_xgf_last_half double precision,
+	away_sh_last_half double precision,
+	away_gf_min_pp double precision,
+	away_xgf_min_pp double precision,
+	away_ga_min_pk double precision,
+	away_xga_min_pk double precision,
+	away_b2b boolean,
+	home_elo double precision,
+	away_elo double precision,
+	"date" date,
+	evaluated date,
+	PRIMARY KEY (game_id)
+);
+
+-- features built before the game date was tracked
+ALTER TABLE features ADD COLUMN IF NOT EXISTS "date" date;
+
+UPDATE features
+SET "date" = nhl.date
+FROM nhl
+WHERE features.date IS NULL
+AND features.game_id = nhl.game_id;
+
+CREATE TABLE IF NOT EXISTS feature_builds(
+	build_id serial,
+	built_at timestamp,
+	high_water_date date,
+	high_water_game_id varchar,
+	rows_added integer,
+	PRIMARY KEY (build_id)
+);
+CREATE TABLE IF NOT EXISTS predictions(
+	"game_id" VARCHAR,
+	"date" DATE,
+	"venue" VARCHAR,
+	"home_team" VARCHAR,
+	"away_team" VARCHAR,
+	"start_time" TIMESTAMP WITHOUT TIME ZONE,
+	"home_win" BOOLEAN,
+	"away_prob" FLOAT,
+	"home_prob" FLOAT
+);
+CREATE TABLE IF NOT EXISTS pipeline_runs(
+	"run_id" VARCHAR,
+	"pipeline" VARCHAR,
+	"stage" VARCHAR,
+	"status" VARCHAR,
+	"started_at" TIMESTAMP WITHOUT TIME ZONE,
+	"wall_seconds" FLOAT,
+	"cpu_seconds" FLOAT,
+	"peak_rss_mb" FLOAT,
+	"rows_in" BIGINT,
+	"rows_out" BIGINT,
+	"bytes_downloaded" BIGINT
+);
+"""
+
+# indexes of the hot queries, created on the partitioned parents so every
+# season partition gets its own. The predictions indexes are mirrored by the
+# Prediction model of app.py.
+indexes = """
+-- team_stats window partitions and the incremental build's window seed
+CREATE INDEX IF NOT EXISTS ix_nst_team_id_date ON nst (team_id, "date");
+
+-- feature joins and the new game lookup of build_features
+CREATE INDEX IF NOT EXISTS ix_nhl_date_game_id ON nhl ("date", game_id);
+CREATE INDEX IF NOT EXISTS ix_nhl_home_team_id_date ON nhl (home_team_id, "date");
+CREATE INDEX IF NOT EXISTS ix_nhl_away_team_id_date ON nhl (away_team_id, "date");
+CREATE INDEX IF NOT EXISTS ix_elo_home_team_id_date ON elo (home_team_id, "date");
+
+-- model training and backtest date ranges
+CREATE INDEX IF NOT EXISTS ix_features_date ON features ("date");
+
+CREATE INDEX IF NOT EXISTS ix_pipeline_runs_pipeline_started_at
+	ON pipeline_runs (pipeline, started_at);
+
+CREATE INDEX IF NOT EXISTS ix_predictions_date_game_id
+	ON predictions ("date", game_id);
+
+CREATE INDEX IF NOT EXISTS ix_predictions_home_team_date
+	ON predictions (home_team, "date");
+
+CREATE INDEX IF NOT EXISTS ix_predictions_away_team_date
+	ON predictions (away_team, "date");
+"""
+
+# views with the old string key columns, for anything still reading them
+keyed_views = """
+DROP VIEW IF EXISTS nst_keyed;
+CREATE VIEW nst_keyed AS SELECT *, team || '_' || "date" AS team_key FROM nst;
+DROP VIEW IF EXISTS nhl_keyed;
+CREATE VIEW nhl_keyed AS SELECT *, home_team || '_' || "date" AS home_team_key, away_team || '_' || "date" AS away_team_key FROM nhl;
+DROP VIEW IF EXISTS elo_keyed;
+CREATE VIEW elo_keyed AS SELECT *, home_team_abbr || '_' || "date" AS home_team_key, away_team_abbr || '_' || "date" AS away_team_key FROM elo;
+DROP VIEW IF EXISTS team_stats_keyed;
+CREATE VIEW team_stats_keyed AS SELECT *, team || '_' || "date" AS team_key FROM team_stats;
+DROP VIEW IF EXISTS features_keyed;
+CREATE VIEW features_keyed AS SELECT *, home_team || '_' || "date" AS home_team_key, away_team || '_' || "date" AS away_team_key FROM features;
+"""
+
+# latest team_stats row of each team, filled here and kept current by
+# build_team_stats_table.refresh_latest
+team_stats_latest = """
+CREATE TABLE IF NOT EXISTS team_stats_latest(
+	team_id smallint,
+	team char(3),
+	"ff%_5v5_last_half" double precision,
+	"gf%_5v5_last_half" double precision,
+	"xgf%_5v5_last_half" double precision,
+	"sh%_5v5_last_half" double precision,
+	gf_per_min_pp_last_half double precision,
+	xgf_per_min_pp_last_half double precision,
+	ga_per_min_pk_last_half double precision,
+	xga_per_min_pk_last_half double precision,
+	"date" date,
+	b2b boolean,
+	PRIMARY KEY (team_id)
+);
+
+INSERT INTO
+	team_stats_latest(
+			   team_id,
+			   team,
+			   "ff%_5v5_last_half",
+			   "gf%_5v5_last_half",
+			   "xgf%_5v5_last_half",
+			   "sh%_5v5_last_half",
+			   gf_per_min_pp_last_half,
+			   xgf_per_min_pp_last_half,
+			   ga_per_min_pk_last_half,
+			   xga_per_min_pk_last_half,
+			   "date",
+			   b2b
+)
+
+SELECT
+	latest.team_id,
+	latest.team,
+	latest."ff%_5v5_last_half",
+	latest."gf%_5v5_last_half",
+	latest."xgf%_5v5_last_half",
+	latest."sh%_5v5_last_half",
+	latest.gf_per_min_pp_last_half,
+	latest.xgf_per_min_pp_last_half,
+	latest.ga_per_min_pk_last_half,
+	latest.xga_per_min_pk_last_half,
+	latest."date",
+	latest.b2b
+
+FROM teams
+CROSS JOIN LATERAL (
+	SELECT *
+	FROM team_stats
+	WHERE team_stats.team_id = teams.team_id
+	ORDER BY team_stats.date DESC
+	LIMIT 1
+) latest
+ON CONFLICT (team_id) DO UPDATE SET
+	team = EXCLUDED.team,
+	"ff%_5v5_last_half" = EXCLUDED."ff%_5v5_last_half",
+	"gf%_5v5_last_half" = EXCLUDED."gf%_5v5_last_half",
+	"xgf%_5v5_last_half" = EXCLUDED."xgf%_5v5_last_half",
+	"sh%_5v5_last_half" = EXCLUDED."sh%_5v5_last_half",
+	gf_per_min_pp_last_half = EXCLUDED.gf_per_min_pp_last_half,
+	xgf_per_min_pp_last_half = EXCLUDED.xgf_per_min_pp_last_half,
+	ga_per_min_pk_last_half = EXCLUDED.ga_per_min_pk_last_half,
+	xga_per_min_pk_last_half = EXCLUDED.xga_per_min_pk_last_half,
+	"date" = EXCLUDED."date",
+	b2b = EXCLUDED.b2b;
+"""
+
+# leaderboards of model_selection.py
+model_selection_table = """
+CREATE TABLE IF NOT EXISTS model_selection(
+	"run_id" VARCHAR,
+	"run_at" TIMESTAMP WITHOUT TIME ZONE,
+	"learner" VARCHAR,
+	"params" VARCHAR,
+	"folds" INTEGER,
+	"n_rows" INTEGER,
+	"log_loss" FLOAT,
+	"log_loss_std" FLOAT,
+	"brier" FLOAT,
+	"accuracy" FLOAT,
+	"fit_seconds" FLOAT,
+	"score_seconds" FLOAT,
+	"rank" INTEGER
+);
+"""
+
+# aggregates of build_scoreboard.py. One row per (season, dimension,
+# dim_key): dimension season has the single key 'all', team is keyed by
+# abbreviation and bucket by the first digit of the home win probability.
+scoreboard_tables = """
+-- the prediction scored for a game is the one published last
+ALTER TABLE predictions
+	ADD COLUMN IF NOT EXISTS published_at timestamp DEFAULT now();
+
+CREATE TABLE IF NOT EXISTS scoreboard(
+	season char(8),
+	dimension varchar,
+	dim_key varchar,
+	games integer,
+	hits integer,
+	home_wins integer,
+	prob_sum double precision,
+	log_loss_sum double precision,
+	brier_sum double precision,
+	updated_at timestamp,
+	PRIMARY KEY (season, dimension, dim_key)
+);
+
+CREATE TABLE IF NOT EXISTS scoreboard_games(
+	game_id varchar,
+	"date" date,
+	scored_at timestamp,
+	PRIMARY KEY (game_id)
+);
+
+CREATE INDEX IF NOT EXISTS ix_scoreboard_games_date
+	ON scoreboard_games ("date");
+"""
+
+# last date each scraped source is complete through, see watermarks.py
+source_watermarks_table = """
+CREATE TABLE IF NOT EXISTS source_watermarks(
+	source varchar,
+	last_date date,
+	updated_at timestamp,
+	PRIMARY KEY (source)
+);
+"""
+
+# build of each features row, see build_features.py
+feature_build_ids = """
+ALTER TABLE features ADD COLUMN IF NOT EXISTS build_id integer;
+CREATE INDEX IF NOT EXISTS ix_features_build_id ON features (build_id);
+"""
+
+# team 33
+team_uta = """
+INSERT INTO teams(team_id, abbr, name)
+VALUES (33, 'UTA', 'Utah Mammoth')
+ON CONFLICT (team_id) DO UPDATE SET
+	abbr = EXCLUDED.abbr,
+	name = EXCLUDED.name;
+"""
+
+# migration 9 gave every existing prediction the same published_at, so
+# duplicates of a game and date, left by saves made before predictions were
+# replaced, could not be told apart by the scoreboard. The last inserted row
+# of each game and date is kept and the pair is made unique.
+prediction_keys = """
+DELETE FROM predictions p
+USING predictions newer
+WHERE newer.game_id = p.game_id
+AND newer."date" = p."date"
+AND newer.ctid > p.ctid;
+
+DROP INDEX IF EXISTS ix_predictions_date_game_id;
+
+CREATE UNIQUE INDEX ix_predictions_date_game_id
+	ON predictions ("date", game_id);
+"""
+
+# (version, name, query), append only, a released migration is never edited
+MIGRATIONS = [
+    (1, 'teams', teams_table),
+    (2, 'team_ids', team_ids),
+    (3, 'season_partitions', season_partitions),
+    (4, 'derived_tables', derived_tables),
+    (5, 'indexes', indexes),
+    (6, 'keyed_views', keyed_views),
+    (7, 'team_stats_latest', team_stats_latest),
+    (8, 'model_selection', model_selection_table),
+    (9, 'scoreboard', scoreboard_tables),
+    (10, 'source_watermarks', source_watermarks_table),
+    (11, 'feature_build_ids', feature_build_ids),
+    (12, 'team_uta', team_uta),
+    (13, 'prediction_keys', prediction_keys),
+]
+
+
+def applied_versions(uri):
+    df = read_query(uri=uri,
+                    query='SELECT version FROM schema_migrations',
+                    date_fields=None)
+
+    return set(df['version'])
+
+
+def migrate(uri, migrations=MIGRATIONS):
+    """Applies the migrations the database has not had yet, in order
+
+    Parameters
+    ----------
+    uri - database uri
+    migrations - list of (version, name, query)
+
+    Returns
+    -------
+    list of the versions applied"""
+    with transaction(uri):
+        execute_query(uri=uri, query=create_migrations_table + lock)
+        applied = applied_versions(uri)
+
+        new_versions = []
+        for version, name, query in migrations:
+            if version in applied:
+                continue
+            print(f'Applying migration {version} {name}...')
+            execute_query(uri=uri, query=query)
+            execute_query(uri=uri,
+                          query=f'INSERT INTO schema_migrations(version, name) '
+                                f"VALUES ({version}, '{name}')")
+            new_versions.append(version)
+
+    return new_versions
+
+
+def ensure_partitions(uri, first_date, last_date):
+    """Creates the missing season partitions of the partitioned tables
+    between two dates. Rows of a season must not be loaded before its
+    partition exists, postgres will not add a partition over rows already in
+    the default partition.
+
+    Parameters
+    ----------
+    uri - database uri
+    first_date - first date to cover, date or 'YYYY-MM-DD' str
+    last_date - last date to cover, date or 'YYYY-MM-DD' str
+    """
+    query = ''.join(f"SELECT create_season_partitions('{table}', "
+                    f"'{first_date}'::date, '{last_date}'::date);\n"
+                    for table in PARTITIONED_TABLES)
+
+    execute_query(uri=uri, query=query)
+
+
+if __name__ == '__main__':
+    versions = migrate(get_db_uri())
+    print(f'Applied migrations {versions}' if versions
+          else 'Schema up to date')
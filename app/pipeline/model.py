@@ -1,16 +1,76 @@
+import os
 import pandas as pd
 from database_functions import (get_db_uri, get_prediction_dtype,
-                                read_query, save_to_database)
+                                read_query, save_to_database, execute_query,
+                                transaction)
 import select_features
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import OneHotEncoder, StandardScaler
 from sklearn.compose import ColumnTransformer
-from sklearn.linear_model import LogisticRegression
+from sklearn.ensemble import HistGradientBoostingClassifier
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.neural_network import MLPClassifier
+from model_registry import ModelRegistry, fingerprint
+from instrumentation import PipelineRun
 import select_todays_games
 import select_most_recent_stats
 
 SQLALCHEMY_DATABASE_URI = get_db_uri()
 PREDICTION_DTYPE = get_prediction_dtype()
+# touched after each published batch, the flask app watches it to know when
+# its cached pages are out of date
+PREDICTIONS_STAMP = os.environ.get('PREDICTIONS_STAMP',
+                                   os.path.join(os.path.dirname(
+                                       os.path.abspath(__file__)),
+                                       '..', 'predictions.stamp')
+                                   )
+
+NUMERIC_FEATURES = ['home_ff_last_half',
+                    'home_gf_last_half',
+                    'home_xgf_last_half',
+                    'home_sh_last_half',
+                    'home_gf_min_pp',
+                    'home_xgf_min_pp',
+                    'home_ga_min_pk',
+                    'home_xga_min_pk',
+                    'away_ff_last_half',
+                    'away_gf_last_half',
+                    'away_xgf_last_half',
+                    'away_sh_last_half',
+                    'away_gf_min_pp',
+                    'away_xgf_min_pp',
+                    'away_ga_min_pk',
+                    'away_xga_min_pk',
+                    ]
+
+CATEGORICAL_FEATURES = ['home_b2b',
+                        'away_b2b'
+                        ]
+
+ALL_FEATURES = NUMERIC_FEATURES + CATEGORICAL_FEATURES
+
+# learner is one of [logreg, sgd, hgb, mlp], see model_selection.MODEL_GRID
+# for the parameters of each. sgd supports partial_fit, so a model fit with
+# it is updated in place when only a few new games arrived.
+MODEL_PARAMS = {'learner': 'logreg',
+                'penalty': 'l2',
+                'C': 0.01,
+                'solver': 'liblinear',
+                # sgd regularisation, ~1/(C * training rows)
+                'alpha': 0.025
+                }
+
+# most new rows folded into an sgd model before a full refit, and most
+# consecutive incremental updates between full refits
+INCREMENTAL_MAX_NEW_ROWS = 200
+INCREMENTAL_MAX_UPDATES = 30
+
+# a game has one prediction per date, saving a new one replaces it
+delete_predictions = """
+DELETE FROM predictions
+WHERE "date" = ANY(:dates)
+AND game_id = ANY(:game_ids)
+"""
 
 
 def build_prediction_df(todays_games, recent_stats):
@@ -20,13 +80,13 @@ def build_prediction_df(todays_games, recent_stats):
                           'away_score',
                           'status',
                           'home_team_won',
-                          'home_team_key_y',
+                          'home_team_id_y',
                           'home_date',
-                          'away_team_key_y',
+                          'away_team_id_y',
                           'away_date'])
 
-    mapper = {'home_team_key_x': 'home_team_key',
-              'away_team_key_x': 'away_team_key',
+    mapper = {'home_team_id_x': 'home_team_id',
+              'away_team_id_x': 'away_team_id',
               'home_ff%_5v5_last_half': 'home_ff_last_half',
               'home_gf%_5v5_last_half': 'home_gf_last_half',
               'home_xgf%_5v5_last_half': 'home_xgf_last_half',
@@ -50,66 +110,169 @@ def build_prediction_df(todays_games, recent_stats):
     return df
 
 
-if __name__ == '__main__':
-    features = read_query(uri=SQLALCHEMY_DATABASE_URI,
-                          query=select_features.query,
-                          date_fields={'evaluated': '%Y-%m-%d'}
-                          )
-
-    numeric_features = ['home_ff_last_half',
-                        'home_gf_last_half',
-                        'home_xgf_last_half',
-                        'home_sh_last_half',
-                        'home_gf_min_pp',
-                        'home_xgf_min_pp',
-                        'home_ga_min_pk',
-                        'home_xga_min_pk',
-                        'away_ff_last_half',
-                        'away_gf_last_half',
-                        'away_xgf_last_half',
-                        'away_sh_last_half',
-                        'away_gf_min_pp',
-                        'away_xgf_min_pp',
-                        'away_ga_min_pk',
-                        'away_xga_min_pk',
-                        ]
+def publish_predictions_stamp():
+    with open(PREDICTIONS_STAMP, 'a'):
+        os.utime(PREDICTIONS_STAMP)
 
-    categorical_features = ['home_b2b',
-                            'away_b2b'
-                            ]
-
-    all_features = numeric_features + categorical_features
-    X = features.loc[:, all_features]
-    y = features.loc[:, 'home_team_won']
 
+def build_pipeline(params=MODEL_PARAMS):
     numeric_transformer = Pipeline(steps=[('scaler', StandardScaler())])
     categorical_transformer = Pipeline(steps=[('ohe', OneHotEncoder())])
     preprocessor = ColumnTransformer(transformers=[
-                        ('num', numeric_transformer, numeric_features),
-                        ('cat', categorical_transformer, categorical_features)
+                        ('num', numeric_transformer, NUMERIC_FEATURES),
+                        ('cat', categorical_transformer, CATEGORICAL_FEATURES)
                         ])
 
-    logreg = LogisticRegression(penalty='l2', C=0.01, solver='liblinear')
-    logreg_pipeline = Pipeline(steps=[
-                    ('preprocessor', preprocessor),
-                    ('logisticregression', logreg)
-                    ])
+    if params['learner'] == 'sgd':
+        classifier = SGDClassifier(loss='log', penalty=params['penalty'],
+                                   alpha=params['alpha'], random_state=0)
+    elif params['learner'] == 'hgb':
+        classifier = HistGradientBoostingClassifier(
+            learning_rate=params['learning_rate'],
+            max_depth=params['max_depth'],
+            max_iter=params['max_iter'],
+            random_state=0)
+    elif params['learner'] == 'mlp':
+        classifier = MLPClassifier(
+            hidden_layer_sizes=tuple(params['hidden_layer_sizes']),
+            alpha=params['alpha'],
+            early_stopping=True,
+            max_iter=500,
+            random_state=0)
+    else:
+        classifier = LogisticRegression(penalty=params['penalty'],
+                                        C=params['C'],
+                                        solver=params['solver'])
+
+    return Pipeline(steps=[('preprocessor', preprocessor),
+                           ('classifier', classifier)
+                           ])
 
-    logreg_pipeline.fit(X, y)
 
-    todays_games = read_query(uri=SQLALCHEMY_DATABASE_URI,
+def update_pipeline(pipeline, features):
+    """Folds new training rows into a fitted pipeline whose classifier
+    supports partial_fit, updating the scaler's running mean and variance
+    with the same rows
+
+    Parameters
+    ----------
+    pipeline - fitted Pipeline from build_pipeline
+    features - DataFrame of new rows from the features table
+    """
+    preprocessor = pipeline.named_steps['preprocessor']
+    scaler = preprocessor.named_transformers_['num'].named_steps['scaler']
+    scaler.partial_fit(features.loc[:, NUMERIC_FEATURES])
+
+    X = preprocessor.transform(features.loc[:, ALL_FEATURES])
+    pipeline.named_steps['classifier'].partial_fit(
+        X, features.loc[:, 'home_team_won'])
+
+    return pipeline
+
+
+def get_model(uri, registry, params=MODEL_PARAMS):
+    """Returns a pipeline fit on the current features table. The last
+    artifact is loaded when the training data and parameters are unchanged,
+    updated incrementally when only a few rows were added and the learner
+    supports it, and otherwise the pipeline is refit from scratch.
+
+    Parameters
+    ----------
+    uri - database uri
+    registry - ModelRegistry storing the fitted pipelines
+    params - model hyper-parameters, see MODEL_PARAMS
+    """
+    summary = read_query(uri=uri,
+                         query=select_features.summary_query,
+                         date_fields=None
+                         ).iloc[0].to_dict()
+    summary['n_rows'] = int(summary['n_rows'])
+    summary['last_build_id'] = (None if pd.isna(summary['last_build_id'])
+                                else int(summary['last_build_id']))
+    model_fingerprint = fingerprint(summary, params)
+
+    found = registry.load(model_fingerprint)
+    if found is not None:
+        print(f'Loaded model {found[1]["version"]}, training data unchanged')
+        return found[0]
+
+    latest = registry.latest()
+    if (latest is not None
+            and params['learner'] == 'sgd'
+            and latest[1]['params'] == params
+            and latest[1]['updates'] < INCREMENTAL_MAX_UPDATES
+            # artifacts saved before builds were numbered are refit
+            and latest[1].get('last_build_id') is not None
+            and (summary['n_rows'] - latest[1]['n_rows']
+                 <= INCREMENTAL_MAX_NEW_ROWS)):
+        new_rows = read_query(uri=uri,
+                              query=select_features.new_rows_query,
+                              date_fields={'evaluated': '%Y-%m-%d'},
+                              params={'last_build_id':
+                                      latest[1]['last_build_id']}
+                              )
+        pipeline = update_pipeline(latest[0], new_rows)
+        updates = latest[1]['updates'] + 1
+        print(f'Updated model {latest[1]["version"]} with '
+              f'{len(new_rows)} new rows')
+    else:
+        features = read_query(uri=uri,
+                              query=select_features.query,
+                              date_fields={'evaluated': '%Y-%m-%d'}
+                              )
+        pipeline = build_pipeline(params)
+        pipeline.fit(features.loc[:, ALL_FEATURES],
+                     features.loc[:, 'home_team_won'])
+        updates = 0
+        print(f'Fit model on {len(features)} rows')
+
+    registry.save(pipeline, model_fingerprint,
+                  metadata=dict(summary, params=params, updates=updates))
+
+    return pipeline
+
+
+def predict_todays_games(uri, model_pipeline):
+    """Predicts the games in the todays_games table
+
+    Parameters
+    ----------
+    uri - database uri
+    model_pipeline - fitted pipeline, see get_model
+
+    Returns
+    -------
+    DataFrame of rows for the predictions table"""
+    todays_games = read_query(uri=uri,
                               query=select_todays_games.query,
                               date_fields={'date': '%Y-%m-%d'}
                               )
-    recent_stats = read_query(uri=SQLALCHEMY_DATABASE_URI,
+
+    return predict_games(uri, model_pipeline, todays_games)
+
+
+def predict_games(uri, model_pipeline, todays_games):
+    """Predicts games with each team's latest team_stats
+
+    Parameters
+    ----------
+    uri - database uri
+    model_pipeline - fitted pipeline, see get_model
+    todays_games - DataFrame of rows of the todays_games table
+
+    Returns
+    -------
+    DataFrame of rows for the predictions table"""
+    todays_games = todays_games.reset_index(drop=True)
+    recent_stats = read_query(uri=uri,
                               query=select_most_recent_stats.query,
                               date_fields={'date': '%Y-%m-%d'}
                               )
 
     X_pred = build_prediction_df(todays_games, recent_stats)
-    X_pred = X_pred.loc[:, all_features]
-    y_pred = logreg_pipeline.predict(X_pred)
-    y_prob = logreg_pipeline.predict_proba(X_pred)
+    X_pred = X_pred.loc[:, ALL_FEATURES]
+    y_pred = model_pipeline.predict(X_pred)
+    y_prob = model_pipeline.predict_proba(X_pred)
 
     prediction_df = pd.concat([todays_games,
                                pd.DataFrame(y_pred, columns=['home_win']),
@@ -122,15 +285,56 @@ if __name__ == '__main__':
                                                 'away_score',
                                                 'status',
                                                 'home_team_won',
-                                                'home_team_key',
-                                                'away_team_key'])
+                                                'home_team_id',
+                                                'away_team_id'])
 
     prediction_df['home_prob'] = prediction_df['home_prob'].map('{:,.3f}'.format)
     prediction_df['away_prob'] = prediction_df['away_prob'].map('{:,.3f}'.format)
 
-    save_to_database(uri=SQLALCHEMY_DATABASE_URI,
-                     df=prediction_df,
-                     table_name='predictions',
-                     if_exists='append',
-                     dtype=PREDICTION_DTYPE
-                     )
+    return prediction_df
+
+
+def remove_predictions(uri, game_ids, dates):
+    """Deletes the predictions of game_ids made for any of dates"""
+    execute_query(uri=uri,
+                  query=delete_predictions,
+                  params={'game_ids': [str(g) for g in game_ids],
+                          'dates': sorted(set(pd.to_datetime(
+                              pd.Series(dates, dtype=object)).dt.date))}
+                  )
+
+
+def save_predictions(uri, prediction_df):
+    """Saves predictions, replacing earlier ones of the same games, and
+    touches the stamp so the flask app drops its cached pages"""
+    with transaction(uri):
+        remove_predictions(uri, prediction_df['game_id'],
+                           prediction_df['date'])
+        save_to_database(uri=uri,
+                         df=prediction_df,
+                         table_name='predictions',
+                         if_exists='append',
+                         dtype=PREDICTION_DTYPE
+                         )
+
+    # after the commit, so the flask app never renders the old rows again
+    publish_predictions_stamp()
+
+
+if __name__ == '__main__':
+    run = PipelineRun('model')
+
+    try:
+        with run.stage('fit'):
+            model_pipeline = get_model(SQLALCHEMY_DATABASE_URI,
+                                       ModelRegistry())
+
+        with run.stage('predict') as stage:
+            prediction_df = predict_todays_games(SQLALCHEMY_DATABASE_URI,
+                                                 model_pipeline)
+            stage.rows_out = len(prediction_df)
+
+        with run.stage('publish', rows_in=len(prediction_df)):
+            save_predictions(SQLALCHEMY_DATABASE_URI, prediction_df)
+    finally:
+        run.finish(SQLALCHEMY_DATABASE_URI)
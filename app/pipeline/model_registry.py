@@ -0,0 +1,131 @@
+"""Model registry
+
+Stores fitted model pipelines on disk together with a fingerprint of the
+training data and hyper-parameters they were fit with, so that a run whose
+inputs have not changed can load the last artifact instead of refitting.
+
+Artifacts are joblib files in MODEL_DIR (overridable with the
+NHL_BETS_MODEL_DIR environment variable), listed newest last in index.json.
+"""
+
+from datetime import datetime
+import hashlib
+import json
+import os
+import joblib
+
+MODEL_DIR = os.environ.get('NHL_BETS_MODEL_DIR',
+                           os.path.join(os.path.dirname(
+                               os.path.abspath(__file__)), 'models')
+                           )
+# number of artifacts kept on disk
+MAX_ARTIFACTS = 10
+
+
+def fingerprint(data_summary, params):
+    """Fingerprints a training run
+
+    Parameters
+    ----------
+    data_summary - dict summarising the training data, ex. row count and
+                   first/last game_id
+    params - dict of model hyper-parameters
+
+    Returns
+    -------
+    sha256 hex digest str"""
+    payload = json.dumps({'data': data_summary, 'params': params},
+                         sort_keys=True, default=str)
+
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ModelRegistry:
+    """Versioned store of fitted pipelines
+
+    Parameters
+    ----------
+    model_dir - directory holding the artifacts and index.json
+    max_artifacts - number of most recent artifacts to keep
+    """
+
+    def __init__(self, model_dir=MODEL_DIR, max_artifacts=MAX_ARTIFACTS):
+        self.model_dir = model_dir
+        self.max_artifacts = max_artifacts
+        os.makedirs(model_dir, exist_ok=True)
+
+    @property
+    def _index_path(self):
+        return os.path.join(self.model_dir, 'index.json')
+
+    def _read_index(self):
+        try:
+            with open(self._index_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def _write_index(self, index):
+        tmp_path = self._index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f, indent=2, default=str)
+        os.replace(tmp_path, self._index_path)
+
+    def _load(self, entry):
+        path = os.path.join(self.model_dir, entry['file'])
+        try:
+            return joblib.load(path), entry
+        except OSError:
+            return None
+
+    def save(self, pipeline, fingerprint, metadata=None):
+        """Saves a fitted pipeline as a new version
+
+        Parameters
+        ----------
+        pipeline - fitted sklearn Pipeline
+        fingerprint - fingerprint() of the training data and parameters
+        metadata - dict of extra details to keep with the artifact
+
+        Returns
+        -------
+        the artifact's index entry"""
+        version = (datetime.now().strftime('%Y%m%dT%H%M%S%f')
+                   + '-' + fingerprint[:8])
+        entry = dict(metadata or {},
+                     version=version,
+                     fingerprint=fingerprint,
+                     file=version + '.joblib',
+                     saved_at=datetime.now().isoformat()
+                     )
+        joblib.dump(pipeline, os.path.join(self.model_dir, entry['file']))
+
+        index = self._read_index() + [entry]
+        kept = {e['file'] for e in index[-self.max_artifacts:]}
+        for old in index[:-self.max_artifacts]:
+            if old['file'] in kept:
+                continue
+            try:
+                os.remove(os.path.join(self.model_dir, old['file']))
+            except OSError:
+                pass
+        self._write_index(index[-self.max_artifacts:])
+
+        return entry
+
+    def load(self, fingerprint):
+        """Returns (pipeline, entry) of the newest artifact with fingerprint,
+        or None if there is none"""
+        for entry in reversed(self._read_index()):
+            if entry['fingerprint'] == fingerprint:
+                return self._load(entry)
+
+        return None
+
+    def latest(self):
+        """Returns (pipeline, entry) of the newest artifact, or None"""
+        index = self._read_index()
+        if not index:
+            return None
+
+        return self._load(index[-1])
@@ -0,0 +1,313 @@
+"""Model selection
+
+Evaluates a grid of model families and hyper-parameters on the training rows
+of the features table with time ordered cross-validation, and records the
+scores and timings of every candidate in the model_selection table.
+
+Like the backtest, folds train on the features table and are scored on the
+same games with each team's stats from its previous game, see
+backtest.point_in_time_features. The features table's stats include the game
+itself, scoring on them would reward the learners that exploit the leak.
+
+The features are preprocessed once into date sorted design matrices, cached
+as .npy files under DESIGN_CACHE_DIR (overridable with the
+NHL_BETS_DESIGN_CACHE_DIR environment variable) keyed by a fingerprint of the
+training rows, so reruns on unchanged data skip the database. Every
+(candidate, fold) pair is fit on a process pool whose workers memory map the
+cached arrays rather than receiving copies.
+
+The folds expand forward in time. The game dates are split into folds + 1
+blocks, and fold k trains on every game before block k and is scored on it,
+so no fit sees a game played after the ones it is scored on.
+
+Usage
+-----
+python model_selection.py --folds 5 --learners logreg hgb
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import product
+import json
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from sklearn.metrics import accuracy_score, brier_score_loss, log_loss
+from threadpoolctl import threadpool_limits
+from backtest import (build_design_matrix, load_shared,
+                      point_in_time_features, save_shared)
+from database_functions import (get_db_uri,
+                                get_model_selection_dtype,
+                                read_query,
+                                save_to_database
+                                )
+from instrumentation import PipelineRun
+from model import ALL_FEATURES, build_pipeline
+from model_registry import fingerprint
+import select_features
+
+SQLALCHEMY_DATABASE_URI = get_db_uri()
+DESIGN_CACHE_DIR = os.environ.get('NHL_BETS_DESIGN_CACHE_DIR',
+                                  os.path.join(os.path.dirname(
+                                      os.path.abspath(__file__)),
+                                      '.design_cache')
+                                  )
+CV_FOLDS = 5
+
+# hyper-parameter values per learner of model.build_pipeline, every
+# combination is a candidate. hgb stands in for XGBoost and mlp for the
+# neural network, both without a new dependency.
+MODEL_GRID = {'logreg': {'penalty': ['l1', 'l2'],
+                         'C': [0.001, 0.01, 0.1, 1.0],
+                         'solver': ['liblinear']},
+              'sgd': {'penalty': ['l2'],
+                      'alpha': [0.001, 0.01, 0.025, 0.1]},
+              'hgb': {'learning_rate': [0.03, 0.1],
+                      'max_depth': [2, 3],
+                      'max_iter': [100, 300]},
+              'mlp': {'hidden_layer_sizes': [[8], [16], [16, 8]],
+                      'alpha': [0.001, 0.1]}
+              }
+
+# team stats to score the training rows with, from a season earlier so the
+# first games have their teams' previous ones
+select_team_stats = """
+SELECT *
+FROM team_stats
+WHERE "date" > now() - '4 years'::interval
+"""
+
+# memory mapped arrays of the worker process, set by _init_worker
+_shared = {}
+
+
+def candidates(grid=MODEL_GRID, learners=None):
+    """Expands a grid into a list of params dicts for build_pipeline
+
+    Parameters
+    ----------
+    grid - dict of learner to dict of parameter name to values
+    learners - learners to include, all if None
+    """
+    params_list = []
+    for learner, space in grid.items():
+        if learners is not None and learner not in learners:
+            continue
+        names = sorted(space)
+        for values in product(*(space[name] for name in names)):
+            params_list.append(dict(zip(names, values), learner=learner))
+
+    return params_list
+
+
+def time_folds(dates, n_folds=CV_FOLDS):
+    """Expanding window folds over date sorted rows. Rows of one date are
+    never split between training and scoring.
+
+    Parameters
+    ----------
+    dates - sorted datetime64 array of the rows' game dates
+    n_folds - number of folds
+
+    Returns
+    -------
+    list of (train_end, test_end), fold k trains on rows [0, train_end) and
+    is scored on rows [train_end, test_end)"""
+    blocks = np.array_split(np.unique(dates), n_folds + 1)
+
+    return [(int(np.searchsorted(dates, block[0], side='left')),
+             int(np.searchsorted(dates, block[-1], side='right')))
+            for block in blocks[1:] if len(block)]
+
+
+def cached_design_matrix(uri, cache_dir=DESIGN_CACHE_DIR):
+    """Returns the directory of the cached design matrices of the current
+    training rows, building them from the features and team_stats tables on
+    a cache miss. X holds the training rows and X_scored the same rows with
+    point in time team stats. Matrices of older training rows are removed.
+
+    Parameters
+    ----------
+    uri - database uri
+    cache_dir - directory holding one directory per fingerprint
+    """
+    summary = read_query(uri=uri,
+                         query=select_features.summary_query,
+                         date_fields=None
+                         ).iloc[0].to_dict()
+    summary['n_rows'] = int(summary['n_rows'])
+    key = fingerprint(summary, {'features': ALL_FEATURES,
+                                'scored': 'point_in_time'})
+    directory = os.path.join(cache_dir, key)
+    if os.path.isdir(directory):
+        print(f'Using cached design matrix {key[:12]}')
+        return directory
+
+    features = read_query(uri=uri,
+                          query=select_features.query,
+                          date_fields={'date': '%Y-%m-%d'}
+                          )
+    features = features.dropna(subset=ALL_FEATURES + ['date'])
+    team_stats = read_query(uri=uri,
+                            query=select_team_stats,
+                            date_fields={'date': '%Y-%m-%d'}
+                            )
+
+    # rows are in the same order in both matrices
+    arrays = build_design_matrix(features)
+    arrays['X_scored'] = build_design_matrix(
+        point_in_time_features(features, team_stats))['X']
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=cache_dir)
+    save_shared(arrays, tmp_dir)
+    os.replace(tmp_dir, directory)
+    print(f'Cached design matrix {key[:12]} of {len(features)} rows')
+
+    for entry in os.scandir(cache_dir):
+        if entry.is_dir() and entry.path != directory:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+    return directory
+
+
+def _init_worker(directory):
+    global _shared
+    _shared = load_shared(directory, names=('X', 'y', 'X_scored'))
+    # one thread per process, the pool already uses every core
+    threadpool_limits(1)
+
+
+def evaluate_fold(params, fold, train_end, test_end):
+    """Fits a candidate on a fold's training rows and scores it on the
+    fold's test rows with point in time stats, using the arrays shared with
+    the worker. Test games of teams without an earlier game are skipped.
+
+    Returns
+    -------
+    dict of scores and timings"""
+    X, y, X_scored = _shared['X'], _shared['y'], _shared['X_scored']
+    scored = np.arange(train_end, test_end)[
+        ~np.isnan(X_scored[train_end:test_end]).any(axis=1)]
+
+    start = time.perf_counter()
+    pipeline = build_pipeline(params)
+    pipeline.fit(pd.DataFrame(X[:train_end], columns=ALL_FEATURES),
+                 y[:train_end])
+    fit_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    prob = pipeline.predict_proba(
+        pd.DataFrame(X_scored[scored], columns=ALL_FEATURES))[:, 1]
+    score_seconds = time.perf_counter() - start
+
+    y_test = y[scored]
+    return {'learner': params['learner'],
+            'params': json.dumps(params, sort_keys=True),
+            'fold': fold,
+            'train_rows': train_end,
+            'test_rows': len(scored),
+            'log_loss': log_loss(y_test, prob, labels=[0, 1]),
+            'brier': brier_score_loss(y_test, prob),
+            'accuracy': accuracy_score(y_test, prob > 0.5),
+            'fit_seconds': fit_seconds,
+            'score_seconds': score_seconds
+            }
+
+
+def run_selection(directory, params_list, n_folds=CV_FOLDS,
+                  max_workers=None):
+    """Cross-validates every candidate on the design matrix in directory
+
+    Parameters
+    ----------
+    directory - design matrix directory, see cached_design_matrix
+    params_list - candidates, see candidates
+    n_folds - number of time ordered folds
+    max_workers - size of the process pool, defaults to the cpu count
+
+    Returns
+    -------
+    DataFrame with one row per (candidate, fold), see evaluate_fold"""
+    max_workers = max_workers or os.cpu_count()
+    dates = load_shared(directory, names=('dates',))['dates']
+    folds = time_folds(dates, n_folds)
+
+    jobs = [(params, fold, train_end, test_end)
+            for params in params_list
+            for fold, (train_end, test_end) in enumerate(folds)]
+
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             initializer=_init_worker,
+                             initargs=(directory,)) as pool:
+        results = list(pool.map(evaluate_fold, *zip(*jobs)))
+
+    return pd.DataFrame(results)
+
+
+def leaderboard(results):
+    """Mean scores and total timings per candidate, best log loss first
+
+    Parameters
+    ----------
+    results - DataFrame returned by run_selection
+    """
+    board = (results.groupby(['learner', 'params'])
+             .agg(folds=('fold', 'size'),
+                  n_rows=('test_rows', 'sum'),
+                  log_loss=('log_loss', 'mean'),
+                  log_loss_std=('log_loss', 'std'),
+                  brier=('brier', 'mean'),
+                  accuracy=('accuracy', 'mean'),
+                  fit_seconds=('fit_seconds', 'sum'),
+                  score_seconds=('score_seconds', 'sum'))
+             .reset_index()
+             .sort_values('log_loss', ignore_index=True))
+    board['rank'] = np.arange(1, len(board) + 1)
+
+    return board
+
+
+def save_leaderboard(uri, board, run_id):
+    """Appends a leaderboard to the model_selection table"""
+    df = board.assign(run_id=run_id, run_at=datetime.now())
+    save_to_database(uri=uri,
+                     df=df.loc[:, list(get_model_selection_dtype())],
+                     table_name='model_selection',
+                     if_exists='append',
+                     dtype=get_model_selection_dtype()
+                     )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--folds', type=int, default=CV_FOLDS)
+    parser.add_argument('--max-workers', type=int, default=None)
+    parser.add_argument('--learners', nargs='*', choices=list(MODEL_GRID),
+                        default=None)
+    args = parser.parse_args()
+
+    run = PipelineRun('model_selection')
+    try:
+        with run.stage('design_matrix'):
+            directory = cached_design_matrix(SQLALCHEMY_DATABASE_URI)
+
+        params_list = candidates(learners=args.learners)
+        with run.stage('cross_validate', rows_in=len(params_list)) as stage:
+            results = run_selection(directory, params_list,
+                                    n_folds=args.folds,
+                                    max_workers=args.max_workers)
+            stage.rows_out = len(results)
+
+        board = leaderboard(results)
+        with run.stage('record', rows_in=len(board)):
+            save_leaderboard(SQLALCHEMY_DATABASE_URI, board, run.run_id)
+    finally:
+        run.finish(SQLALCHEMY_DATABASE_URI)
+
+    print(board.drop(columns=['n_rows']).to_string(index=False))
+    print(f'Best: {board.loc[0, "params"]}')
@@ -0,0 +1,240 @@
+"""Raw data store
+
+Columnar copy of the scraped sources as Parquet files, partitioned by source
+and season:
+
+    RAW_DIR/<source>/season=<season>/part-<part>.parquet
+
+Rows are sorted by date before writing so the row group statistics let date
+filters skip most of a file. A catalog.json next to the partitions lists
+every file with its row count and date range, and read() uses it to open
+only the files that can match before pushing the remaining filters down to
+the Parquet reader.
+
+RAW_DIR can be overridden with the NHL_BETS_RAW_DIR environment variable.
+
+Usage
+-----
+write_partition('nst', '20212022', df, part='2022-01-15')
+write_days('nst', df)
+read('nst', columns=['team', 'date', 'xgf_5v5'],
+     start_date='2022-01-01', teams=['TOR'])
+"""
+
+from datetime import date, datetime
+from functools import reduce
+import json
+import operator
+import os
+import tempfile
+import threading
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as fs
+import pyarrow.parquet as pq
+from scraping_functions import get_season_string
+
+RAW_DIR = os.environ.get('NHL_BETS_RAW_DIR',
+                         os.path.join(os.path.dirname(
+                             os.path.abspath(__file__)), 'raw')
+                         )
+ROW_GROUP_SIZE = 10000
+
+# columns holding team abbreviations, for the teams filter of read
+TEAM_COLUMNS = {'nst': ['team'],
+                'nhl': ['home_team', 'away_team'],
+                'elo': ['home_team_abbr', 'away_team_abbr']
+                }
+
+_catalog_lock = threading.Lock()
+
+
+def _catalog_path(raw_dir):
+    return os.path.join(raw_dir, 'catalog.json')
+
+
+def read_catalog(raw_dir=RAW_DIR):
+    """Returns the catalog as a dict of file path (relative to raw_dir) to
+    entry"""
+    try:
+        with open(_catalog_path(raw_dir)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_catalog(catalog, raw_dir):
+    fd, tmp_path = tempfile.mkstemp(dir=raw_dir)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(catalog, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, _catalog_path(raw_dir))
+
+
+def catalog_frame(raw_dir=RAW_DIR):
+    """Returns the catalog as a DataFrame, one row per file"""
+    catalog = read_catalog(raw_dir)
+
+    return pd.DataFrame([dict(entry, path=path)
+                         for path, entry in sorted(catalog.items())])
+
+
+def _to_date(value):
+    if value is None or isinstance(value, date) and not isinstance(
+            value, datetime):
+        return value
+
+    return pd.Timestamp(value).date()
+
+
+def write_partition(source, season, df, part='all', replace_season=False,
+                    raw_dir=RAW_DIR):
+    """Writes a DataFrame as a Parquet file of a source's season partition.
+    Writing the same part again replaces it, so reruns do not duplicate rows.
+
+    Parameters
+    ----------
+    source - source name, ex. nst, nhl or elo
+    season - 8 char season string, ex. '20212022'
+    df - DataFrame with a date column
+    part - name of the file within the partition, ex. the scraped date
+    replace_season - remove the season's other parts first, for backfills
+    raw_dir - root directory of the store
+
+    Returns
+    -------
+    the file's catalog entry"""
+    partition_dir = os.path.join(raw_dir, source, f'season={season}')
+    os.makedirs(partition_dir, exist_ok=True)
+    relative_path = os.path.join(source, f'season={season}',
+                                 f'part-{part}.parquet')
+
+    df = df.copy()
+    df['date'] = pd.to_datetime(df['date']).dt.date
+    df = df.sort_values('date', kind='mergesort')
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    fd, tmp_path = tempfile.mkstemp(dir=partition_dir, suffix='.tmp')
+    os.close(fd)
+    pq.write_table(table, tmp_path, row_group_size=ROW_GROUP_SIZE,
+                   compression='snappy')
+
+    entry = {'source': source,
+             'season': season,
+             'part': part,
+             'rows': len(df),
+             'columns': list(df.columns),
+             'min_date': str(df['date'].min()) if len(df) else None,
+             'max_date': str(df['date'].max()) if len(df) else None,
+             'bytes': os.path.getsize(tmp_path),
+             'written_at': datetime.now().isoformat()
+             }
+
+    with _catalog_lock:
+        catalog = read_catalog(raw_dir)
+        if replace_season:
+            for path, old in list(catalog.items()):
+                if old['source'] == source and old['season'] == season:
+                    del catalog[path]
+            for name in os.listdir(partition_dir):
+                if name.endswith('.parquet'):
+                    os.remove(os.path.join(partition_dir, name))
+        os.replace(tmp_path, os.path.join(raw_dir, relative_path))
+        catalog[relative_path] = entry
+        _write_catalog(catalog, raw_dir)
+
+    return entry
+
+
+def write_source(source, df, part='all', replace_season=False,
+                 raw_dir=RAW_DIR):
+    """Splits a DataFrame by season and writes each season's partition"""
+    if df.empty:
+        return []
+
+    seasons = pd.to_datetime(df['date']).map(get_season_string)
+
+    return [write_partition(source, season, season_df, part=part,
+                            replace_season=replace_season, raw_dir=raw_dir)
+            for season, season_df in df.groupby(seasons)]
+
+
+def write_days(source, df, raw_dir=RAW_DIR):
+    """Writes one part per date, named after the date, so a date fetched
+    again, ex. by a range refetched behind a watermark, replaces its earlier
+    rows
+
+    Returns
+    -------
+    list of the files' catalog entries"""
+    if df.empty:
+        return []
+
+    dates = pd.to_datetime(df['date']).dt.date
+
+    return [write_partition(source, get_season_string(day), day_df,
+                            part=day.isoformat(), raw_dir=raw_dir)
+            for day, day_df in df.groupby(dates)]
+
+
+def _overlaps(entry, seasons, start_date, end_date):
+    if seasons is not None and entry['season'] not in seasons:
+        return False
+    if entry['rows'] == 0:
+        return False
+    if start_date is not None and entry['max_date'] < str(start_date):
+        return False
+    if end_date is not None and entry['min_date'] > str(end_date):
+        return False
+
+    return True
+
+
+def read(source, columns=None, start_date=None, end_date=None, teams=None,
+         seasons=None, memory_map=True, raw_dir=RAW_DIR):
+    """Reads a source from the store
+
+    Parameters
+    ----------
+    source - source name, ex. nst, nhl or elo
+    columns - columns to read, all if None
+    start_date - first date to include, optional
+    end_date - last date to include, optional
+    teams - team abbreviations, keeps rows where any of the source's
+            TEAM_COLUMNS is one of them, optional
+    seasons - season strings to read, optional
+    memory_map - memory map the files rather than reading them into buffers
+    raw_dir - root directory of the store
+
+    Returns
+    -------
+    DataFrame, with date as datetime64"""
+    start_date = _to_date(start_date)
+    end_date = _to_date(end_date)
+
+    paths = [os.path.abspath(os.path.join(raw_dir, path))
+             for path, entry in sorted(read_catalog(raw_dir).items())
+             if entry['source'] == source
+             and _overlaps(entry, seasons, start_date, end_date)]
+    if not paths:
+        return pd.DataFrame(columns=columns)
+
+    # pushed down to the row group statistics of the files
+    conditions = []
+    if start_date is not None:
+        conditions.append(ds.field('date') >= start_date)
+    if end_date is not None:
+        conditions.append(ds.field('date') <= end_date)
+    if teams is not None:
+        conditions.append(reduce(operator.or_,
+                                 [ds.field(column).isin(list(teams))
+                                  for column in TEAM_COLUMNS[source]]))
+    expression = reduce(operator.and_, conditions) if conditions else None
+
+    # the season directories are only for layout, the catalog already
+    # pruned them and nst carries its own season column
+    dataset = ds.dataset(paths, format='parquet',
+                         filesystem=fs.LocalFileSystem(use_mmap=memory_map))
+    table = dataset.to_table(columns=columns, filter=expression)
+
+    return table.to_pandas(date_as_object=False)
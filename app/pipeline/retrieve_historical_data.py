@@ -7,25 +7,35 @@ season up until the current date. Data is acquired from NaturalStatTrick
 rankings (scraped .csv drop). The retrieved data is then saved to a
 postgres database.
 
-The script will create the following tables on the nhl_bets database:
-- nst_team_stats
-- team_elo
-- game_results
+The schema is created by migrations.py, the script loads the following
+tables on the nhl_bets database:
+- nst
+- nhl
+- elo
 """
 
 from datetime import date, timedelta
+import json
+import os
 import ssl
 from scraping_functions import (get_season_string,
-                                nst_pipeline,
-                                nhl_pipeline,
+                                nst_pipeline_seasons,
+                                month_chunks,
+                                nhl_pipeline_chunks,
                                 elo_pipeline,
                                 )
 from database_functions import (get_db_uri,
                                 get_nst_dtype,
                                 get_nhl_dtype,
                                 get_elo_dtype,
-                                save_to_database
+                                save_to_database,
+                                execute_query,
+                                transaction
                                 )
+from task_runner import CHECKPOINT_DIR
+import migrations
+import watermarks
+import raw_store
 
 TODAY = date.today()
 ssl._create_default_https_context = ssl._create_unverified_context
@@ -37,36 +47,87 @@ NHL_DTYPE = get_nhl_dtype()
 ELO_DTYPE = get_elo_dtype()
 
 
+def load_nhl_schedule(start_date, end_date):
+    """Backfills the nhl table month by month. Chunks are fetched
+    concurrently and each one is saved in its own transaction as soon as it
+    arrives. Saved chunks are checkpointed, so an interrupted backfill of the
+    same range resumes with the missing months.
+
+    Parameters
+    ----------
+    start_date - first date, 'YYYY-MM-DD' str
+    end_date - last date, 'YYYY-MM-DD' str
+    """
+    run_dir = os.path.join(CHECKPOINT_DIR, f'historical-{start_date}-{end_date}')
+    checkpoint_path = os.path.join(run_dir, 'nhl_chunks.json')
+    os.makedirs(run_dir, exist_ok=True)
+    try:
+        with open(checkpoint_path) as f:
+            saved = {tuple(chunk) for chunk in json.load(f)}
+    except (OSError, ValueError):
+        saved = set()
+
+    if not saved:
+        # fresh backfill, empty the table like a single full load would.
+        # Truncating keeps the season partitions a DROP would lose.
+        execute_query(uri=SQLALCHEMY_DATABASE_URI,
+                      query='TRUNCATE nhl')
+
+    chunks = [c for c in month_chunks(start_date, end_date) if c not in saved]
+    for chunk, nhl_data in nhl_pipeline_chunks(chunks):
+        with transaction(SQLALCHEMY_DATABASE_URI):
+            save_to_database(uri=SQLALCHEMY_DATABASE_URI,
+                             df=nhl_data,
+                             table_name='nhl',
+                             if_exists='append',
+                             dtype=NHL_DTYPE,
+                             bulk=True)
+        raw_store.write_source('nhl', nhl_data, part='_'.join(chunk))
+        saved.add(chunk)
+        with open(checkpoint_path, 'w') as f:
+            json.dump(sorted(saved), f)
+
+
 if __name__ == '__main__':
+    migrations.migrate(SQLALCHEMY_DATABASE_URI)
+
     seasons = []
     for i in range(4):
         season = get_season_string(TODAY - timedelta(weeks=i*52))
         seasons.append(season)
         seasons.sort()
-    for season in seasons:
+    start_date = seasons[0][:4] + '-07-01'
+    yesterday = TODAY - timedelta(days=1)
+    end_date = yesterday.strftime('%Y-%m-%d')
+    migrations.ensure_partitions(SQLALCHEMY_DATABASE_URI,
+                                 first_date=start_date,
+                                 last_date=end_date)
 
-        nst_data = nst_pipeline(from_season=season,
-                                to_season=season
-                                )
+    # compact frames keep the four season backfill's peak memory down
+    nst_seasons = nst_pipeline_seasons(seasons, compact=True)
+    for season in seasons:
+        nst_data = nst_seasons[season]
+        raw_store.write_partition('nst', season, nst_data,
+                                  replace_season=True)
         save_to_database(uri=SQLALCHEMY_DATABASE_URI,
                          df=nst_data,
                          table_name='nst',
                          if_exists='append',
-                         dtype=NST_DTYPE)
+                         dtype=NST_DTYPE,
+                         bulk=True)
 
-    start_date = seasons[0][:4] + '-07-01'
-    yesterday = TODAY - timedelta(days=1)
-    end_date = yesterday.strftime('%Y-%m-%d')
-    nhl_data = nhl_pipeline(start_date=start_date, end_date=end_date)
-    save_to_database(uri=SQLALCHEMY_DATABASE_URI,
-                     df=nhl_data,
-                     table_name='nhl',
-                     if_exists='replace',
-                     dtype=NHL_DTYPE)
+    load_nhl_schedule(start_date=start_date, end_date=end_date)
 
     elo_data = elo_pipeline(start_date=start_date, end_date=end_date)
-    save_to_database(uri=SQLALCHEMY_DATABASE_URI,
-                     df=elo_data,
-                     table_name='elo',
-                     if_exists='replace',
-                     dtype=ELO_DTYPE)
+    raw_store.write_source('elo', elo_data, replace_season=True)
+    with transaction(SQLALCHEMY_DATABASE_URI):
+        execute_query(uri=SQLALCHEMY_DATABASE_URI, query='TRUNCATE elo')
+        save_to_database(uri=SQLALCHEMY_DATABASE_URI,
+                         df=elo_data,
+                         table_name='elo',
+                         if_exists='append',
+                         dtype=ELO_DTYPE,
+                         bulk=True)
+
+    # daily_pull continues from the end of the backfill
+    watermarks.seed(SQLALCHEMY_DATABASE_URI, yesterday)
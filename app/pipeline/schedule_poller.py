@@ -0,0 +1,202 @@
+"""Schedule poller
+
+Keeps today's predictions current between daily runs. Each poll fetches
+today's schedule, diffs it against the todays_games table and only touches
+the games that changed:
+
+- new games, and games whose date or teams changed, are upserted into
+  todays_games and re-predicted with the latest fitted model and
+  team_stats_latest, replacing their earlier prediction
+- start time, venue and status changes only update the todays_games row
+- games that left today's schedule or were postponed lose their todays_games
+  row and today's prediction
+
+Predictions are replaced rather than appended, a game keeps one prediction
+per date.
+
+A poll without changes costs one schedule request and one small query, the
+model is never refit.
+
+The poll interval can be overridden with the NHL_BETS_POLL_INTERVAL
+environment variable.
+
+Usage
+-----
+python schedule_poller.py           # poll until the end of the day
+python schedule_poller.py --once    # a single poll, ex. from cron
+"""
+
+import argparse
+from datetime import date, datetime, timedelta
+import os
+import ssl
+import time
+import pandas as pd
+from database_functions import (get_db_uri,
+                                get_nhl_dtype,
+                                get_prediction_dtype,
+                                execute_query,
+                                read_query,
+                                save_to_database,
+                                transaction
+                                )
+from model import (predict_games, publish_predictions_stamp,
+                   remove_predictions)
+from model_registry import ModelRegistry
+from scraping_functions import nhl_pipeline
+import select_todays_games
+
+ssl._create_default_https_context = ssl._create_unverified_context
+
+SQLALCHEMY_DATABASE_URI = get_db_uri()
+NHL_DTYPE = get_nhl_dtype()
+PREDICTION_DTYPE = get_prediction_dtype()
+# seconds between two polls
+POLL_INTERVAL = int(os.environ.get('NHL_BETS_POLL_INTERVAL', 600))
+
+# todays_games columns compared between polls, and the ones a prediction
+# depends on
+SCHEDULE_COLUMNS = ['date', 'venue', 'home_team', 'away_team', 'start_time',
+                    'status']
+PREDICTION_COLUMNS = ['date', 'home_team', 'away_team']
+REMOVED_STATUSES = ['Postponed', 'Cancelled']
+
+delete_games = """
+DELETE FROM todays_games
+WHERE game_id = ANY(:game_ids)
+"""
+
+
+def comparable(df):
+    """Indexes schedule rows by game_id with SCHEDULE_COLUMNS as strings, so
+    rows read back from the database compare equal to freshly scraped ones"""
+    df = df.assign(game_id=df['game_id'].astype(str)).set_index('game_id')
+    df = df.loc[:, SCHEDULE_COLUMNS].copy()
+    df['date'] = pd.to_datetime(df['date']).dt.strftime('%Y-%m-%d')
+    df['start_time'] = pd.to_datetime(df['start_time'], utc=True).astype(str)
+
+    return df.fillna('').astype(str)
+
+
+def diff_schedule(stored, fetched):
+    """Compares the stored todays_games rows with a fetched schedule
+
+    Parameters
+    ----------
+    stored - DataFrame of the todays_games table
+    fetched - DataFrame from nhl_pipeline
+
+    Returns
+    -------
+    dict of game_id lists: upsert (new or changed rows), predict (rows
+    needing a new prediction) and remove (rows to delete)"""
+    stored = comparable(stored)
+    fetched = comparable(fetched)
+
+    # postponed games are only removed once, while they still have a row
+    removed = fetched['status'].isin(REMOVED_STATUSES)
+    remove = (set(stored.index) - set(fetched.index)) | (
+        set(fetched.index[removed]) & set(stored.index))
+    fetched = fetched[~removed]
+
+    new = set(fetched.index) - set(stored.index)
+    common = fetched.index.intersection(stored.index)
+    changed = (fetched.loc[common] != stored.loc[common]).any(axis=1)
+    teams_changed = (fetched.loc[common, PREDICTION_COLUMNS]
+                     != stored.loc[common, PREDICTION_COLUMNS]).any(axis=1)
+
+    return {'upsert': sorted(new | set(common[changed])),
+            'predict': sorted(new | set(common[teams_changed])),
+            'remove': sorted(remove)}
+
+
+def poll(uri, day=None, registry=None):
+    """Fetches the day's schedule and applies its changes, see the module
+    docstring
+
+    Parameters
+    ----------
+    uri - database uri
+    day - date of the games, today if None
+    registry - ModelRegistry holding the fitted model
+
+    Returns
+    -------
+    dict of changed game_ids, see diff_schedule"""
+    day = day or date.today()
+    fetched = nhl_pipeline(start_date=day.isoformat(), end_date=day.isoformat())
+    fetched['game_id'] = fetched['game_id'].astype(str)
+    stored = read_query(uri=uri,
+                        query=select_todays_games.query,
+                        date_fields={'date': '%Y-%m-%d'}
+                        )
+
+    changes = diff_schedule(stored, fetched)
+    if not any(changes.values()):
+        print('No schedule changes')
+        return changes
+    print(f'Schedule changes: {changes}')
+
+    predict = fetched[fetched['game_id'].isin(changes['predict'])]
+    model_pipeline = None
+    if len(predict) > 0:
+        latest = (registry or ModelRegistry()).latest()
+        if latest is None:
+            print('No fitted model yet, leaving predictions to the daily run')
+        else:
+            model_pipeline = latest[0]
+
+    with transaction(uri):
+        execute_query(uri=uri,
+                      query=delete_games,
+                      params={'game_ids': changes['upsert']
+                              + changes['remove']})
+        save_to_database(uri=uri,
+                         df=fetched[fetched['game_id'].isin(
+                             changes['upsert'])],
+                         table_name='todays_games',
+                         if_exists='append',
+                         dtype=NHL_DTYPE)
+
+        # predictions of games whose teams changed are wrong, remove them
+        # even when there is no model to replace them yet
+        remove_predictions(uri, changes['predict'] + changes['remove'],
+                           [day])
+        if model_pipeline is not None:
+            save_to_database(uri=uri,
+                             df=predict_games(uri, model_pipeline, predict),
+                             table_name='predictions',
+                             if_exists='append',
+                             dtype=PREDICTION_DTYPE)
+
+    # after the commit, so the flask app never renders the old rows again
+    publish_predictions_stamp()
+
+    return changes
+
+
+def run(uri, interval=POLL_INTERVAL):
+    """Polls every interval seconds until the end of the day. A failed poll
+    is reported and retried on the next one."""
+    day = date.today()
+    end = datetime.combine(day + timedelta(days=1), datetime.min.time())
+    while True:
+        try:
+            poll(uri, day)
+        except Exception as e:
+            print(f'Poll failed: {e!r}')
+        if datetime.now() + timedelta(seconds=interval) >= end:
+            break
+        time.sleep(interval)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--once', action='store_true')
+    parser.add_argument('--interval', type=int, default=POLL_INTERVAL)
+    args = parser.parse_args()
+
+    if args.once:
+        poll(SQLALCHEMY_DATABASE_URI)
+    else:
+        run(SQLALCHEMY_DATABASE_URI, args.interval)
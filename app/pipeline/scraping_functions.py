@@ -2,13 +2,49 @@
 
 """
 
-from datetime import date
+from concurrent.futures import (FIRST_COMPLETED, ThreadPoolExecutor,
+                                ProcessPoolExecutor, as_completed, wait)
+from datetime import date, timedelta
+from functools import partial
+import io
+import multiprocessing
+from operator import itemgetter
+import threading
+import time
 import numpy as np
 import pandas as pd
+import requests
 import hockey_scraper
+from lxml import etree
+from sqlalchemy.types import Float, Integer, String
+from database_functions import get_nst_dtype
+import http_cache
+from teams import add_team_ids
 
 
 TODAY = date.today()
+NST_SITS = ['5v5', 'pp', 'pk']
+# concurrent page downloads, and seconds between request starts to stay polite
+NST_MAX_WORKERS = 4
+NST_MIN_INTERVAL = 2.0
+NST_TIMEOUT = 60
+# parse workers are started by a fork server, forking the scraping process
+# itself would copy locks held by its other threads, ex. the nhl and elo
+# scrapes daily_pull runs alongside
+NST_PARSE_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods()
+    else 'spawn')
+# raw 5v5 columns used by build_team_stats_table, for parsing in compact mode
+NST_TEAM_STATS_COLUMNS = ['Game', 'Team', 'TOI', 'FF', 'FA', 'SF', 'GF', 'GA',
+                          'xGF', 'xGA']
+# the pp and pk pages only contribute these columns to the merge
+NST_SIT_COLUMNS = {'pp': ['Game', 'Team', 'TOI', 'xGF', 'GF'],
+                   'pk': ['Game', 'Team', 'TOI', 'xGA', 'GA']}
+NST_DTYPE = get_nst_dtype()
+# games table columns parsed as text, every other one is numeric
+NST_TEXT_COLUMNS = ['Game', 'Team']
+# concurrent month sized schedule requests during backfills
+NHL_MAX_WORKERS = 4
 
 
 def get_season_string(date):
@@ -36,7 +72,220 @@ def get_season_string(date):
     return season_string
 
 
-def nst_scrape_games(from_season, to_season, sit='5v5'):
+def nst_games_url(from_season, to_season, sit='5v5'):
+    """Builds the naturalstattrick.com (nst) games page url
+
+    Parameters
+    ----------
+    from_season - year to start an 8 char str of an NHL season (ex. '20202021')
+    to_season - year to end an 8 char str of an NHL season (ex.20212022)
+    sit - on ice situation, one of [5v5, pp, pk]
+
+    Returns
+    -------
+    url string for the NaturalStatTrick games table"""
+
+    return f'https://www.naturalstattrick.com/games.php?fromseason={from_season}&thruseason={to_season}&stype=2&sit={sit}&loc=B&team=All&rate=n' # noqa
+
+
+class RateLimiter:
+    """Spaces out requests shared between threads so that at most one request
+    starts every min_interval seconds"""
+
+    def __init__(self, min_interval=NST_MIN_INTERVAL):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_time = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            wait_time = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.min_interval
+
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+def nst_session(max_workers=NST_MAX_WORKERS):
+    """Creates a requests session with a keep-alive connection pool sized for
+    max_workers concurrent fetches"""
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                            pool_maxsize=max_workers,
+                                            max_retries=3
+                                            )
+    session.mount('https://', adapter)
+    session.headers.update({'User-Agent': 'nhl_bets'})
+
+    return session
+
+
+def nst_fetch(url, session=None, limiter=None, cache=None):
+    """Downloads the html for a nst page, going through the on-disk response
+    cache so unchanged pages are not downloaded again
+
+    Parameters
+    ----------
+    url - page url
+    session - requests session to reuse connections, a new one if None
+    limiter - RateLimiter shared by concurrent fetches, optional
+    cache - http_cache.ResponseCache, the default cache if None
+
+    Returns
+    -------
+    http_cache.Page with the page html and its content digest"""
+
+    if session is None:
+        session = nst_session()
+    if cache is None:
+        cache = http_cache.default_cache()
+
+    def fetch(headers):
+        # only rate limit requests that actually go to the network
+        if limiter is not None:
+            limiter.wait()
+        return session.get(url, headers=headers, timeout=NST_TIMEOUT)
+
+    return cache.get(url, fetch)
+
+
+def nst_downcast(df):
+    """Shrinks a nst DataFrame in place of the float64 and object columns
+    pandas parses, using the column types of get_nst_dtype: integer counts
+    become the smallest int type that fits (float32 if they hold NaNs),
+    rates float32 and names, keys and seasons categoricals. Works on both
+    the raw nst and the formatted database column names.
+
+    Parameters
+    ----------
+    df - nst DataFrame
+    """
+    for column in df.columns:
+        sql_type = NST_DTYPE.get(NST_COLUMN_MAPPER.get(column, column))
+        if sql_type is None:
+            continue
+        values = df[column]
+        if isinstance(sql_type, Integer):
+            if values.isna().any():
+                df[column] = values.astype(np.float32)
+            else:
+                df[column] = pd.to_numeric(values, downcast='integer')
+        elif isinstance(sql_type, Float):
+            df[column] = values.astype(np.float32)
+        elif isinstance(sql_type, String):
+            df[column] = values.astype('category')
+
+    return df
+
+
+def nst_iter_rows(html):
+    """Streams the cell texts of each row of the first table of a page. Rows
+    are discarded once read, so the page is never held as a full tree.
+
+    Parameters
+    ----------
+    html - page html as str or bytes
+
+    Returns
+    -------
+    generator of lists of cell text, the header row first"""
+    if isinstance(html, str):
+        html = html.encode('utf-8')
+
+    for _, element in etree.iterparse(io.BytesIO(html), events=('end',),
+                                      tag=('tr', 'table'), html=True,
+                                      encoding='utf-8'):
+        if element.tag == 'table':
+            return
+        # most cells hold bare text, only join the text of those with markup
+        yield [(cell.text or '').strip() if len(cell) == 0
+               else ''.join(cell.itertext()).strip()
+               for cell in element if cell.tag in ('th', 'td')]
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+
+def nst_parse_values(values):
+    """Converts a games table column of cell texts to a numeric array, with
+    '-' as NaN. Integer columns without missing values stay int64 like
+    pd.read_html parses them, columns that are not numeric stay object."""
+    values = pd.Series(values, dtype=object)
+    missing = values == '-'
+    if missing.any():
+        values = values.mask(missing)
+
+    try:
+        return pd.to_numeric(values).to_numpy()
+    except ValueError:
+        pass
+    try:
+        # thousands separators, ex. attendance
+        return pd.to_numeric(values.str.replace(',', '',
+                                                regex=False)).to_numpy()
+    except ValueError:
+        return values.to_numpy()
+
+
+def nst_parse_games(html, columns=None, compact=False):
+    """Parses the games table from a nst games page. The table is streamed
+    row by row and only the kept columns are converted, each with one
+    vectorized conversion.
+
+    Parameters
+    ----------
+    html - page html as str
+    columns - raw nst columns to keep, ex. NST_TEAM_STATS_COLUMNS, all if
+              None. Game and Team are always kept.
+    compact - downcast the columns with nst_downcast
+
+    Returns
+    -------
+    pandas DataFrame containing team stats for each game played"""
+    rows = nst_iter_rows(html)
+    header = next(rows, None)
+    if header is None:
+        raise ValueError('No tables found')
+
+    # the unnamed first column is the row number, the other unnamed one
+    # holds links
+    names = {i: name for i, name in enumerate(header) if name}
+    if columns is None:
+        names[0] = 'index'
+        keep = sorted(names)
+    else:
+        wanted = ['Game', 'Team'] + [c for c in columns
+                                     if c not in ('Game', 'Team')]
+        positions = {name: i for i, name in names.items()}
+        keep = [positions[c] for c in wanted if c in positions]
+
+    get_cells = itemgetter(*keep)
+    cells = [get_cells(row) for row in rows if len(row) == len(header)]
+    if len(keep) == 1:
+        cells = [(cell,) for cell in cells]
+    columns_cells = list(zip(*cells)) or [()] * len(keep)
+
+    df = pd.DataFrame({names[i]: (np.array(values, dtype=object)
+                                  if names[i] in NST_TEXT_COLUMNS
+                                  else nst_parse_values(values))
+                       for i, values in zip(keep, columns_cells)})
+
+    # format date column, every game on a date shares its season
+    df['date'] = pd.to_datetime(df['Game'].str[:10], format='%Y-%m-%d')
+    dates = df['date'].drop_duplicates()
+    df['season'] = df['date'].map(dict(zip(dates,
+                                           dates.map(get_season_string))))
+
+    if compact:
+        df = nst_downcast(df)
+
+    return df
+
+
+def nst_scrape_games(from_season, to_season, sit='5v5', columns=None,
+                     compact=False):
     """Scrapes naturalstattrick.com (nst) games page to retrieve team stats for
     each game played
 
@@ -45,29 +294,93 @@ def nst_scrape_games(from_season, to_season, sit='5v5'):
     from_season - year to start an 8 char str of an NHL season (ex. '20202021')
     to_season - year to end an 8 char str of an NHL season (ex.20212022)
     sit - on ice situation, one of [5v5, pp, pk]
-    rate - return counts or rates per 60min of play, (y/n)
+    columns - see nst_parse_games, the pp and pk pages always use
+              NST_SIT_COLUMNS
+    compact - see nst_parse_games
 
     Returns
     -------
     pandas DataFrame containing team stats for each game played"""
-    # url for NaturalStatTrick games table
-    url = f'https://www.naturalstattrick.com/games.php?fromseason={from_season}&thruseason={to_season}&stype=2&sit={sit}&loc=B&team=All&rate=n' # noqa
+    url = nst_games_url(from_season, to_season, sit)
+    page = nst_fetch(url)
+    columns = NST_SIT_COLUMNS.get(sit, columns)
 
-    # scrape html table from webpage
-    df = pd.read_html(url, header=0, index_col=0, na_values=["-"])[0]
+    return http_cache.default_cache().parsed(
+        page, partial(nst_parse_games, columns=columns, compact=compact),
+        key=nst_parse_key(columns, compact))
 
-    # reset index
-    df.reset_index(inplace=True)
 
-    # drop links column
-    df = df.drop(columns='Unnamed: 2')
+def nst_parse_key(columns, compact):
+    # parsed page cache key for the parse options
+    return (f'{__name__}.{nst_parse_games.__qualname__}'
+            f'|columns={columns}|compact={compact}')
 
-    # format date column
-    df['date'] = df['Game'].apply(lambda x: pd.to_datetime(x[:10],
-                                                           format='%Y-%m-%d'))
-    df['season'] = df['date'].apply(lambda x: get_season_string(x))
 
-    return df
+def nst_scrape_pages(season_ranges, sits=NST_SITS,
+                     max_workers=NST_MAX_WORKERS,
+                     min_interval=NST_MIN_INTERVAL, cache=None, columns=None,
+                     compact=False):
+    """Concurrently scrapes the nst games page for every (season range,
+    situation) pair. Pages are downloaded by a bounded thread pool sharing one
+    keep-alive session and a politeness rate limit, and each page is handed
+    to a process pool for parsing as soon as it arrives. Pages whose body is
+    unchanged since the last run are served from the response cache and are
+    not parsed again.
+
+    Parameters
+    ----------
+    season_ranges - list of (from_season, to_season) tuples
+    sits - on ice situations to scrape for each range
+    max_workers - number of concurrent downloads and parse workers
+    min_interval - minimum seconds between the start of two requests
+    cache - http_cache.ResponseCache, the default cache if None
+    columns - see nst_parse_games, the pp and pk pages always use
+              NST_SIT_COLUMNS
+    compact - see nst_parse_games
+
+    Returns
+    -------
+    dict mapping (from_season, to_season, sit) to the parsed DataFrame"""
+    if cache is None:
+        cache = http_cache.default_cache()
+
+    session = nst_session(max_workers)
+    limiter = RateLimiter(min_interval)
+    pages = {(from_season, to_season, sit): nst_games_url(from_season,
+                                                          to_season, sit)
+             for from_season, to_season in season_ranges
+             for sit in sits}
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as fetch_pool, \
+         ProcessPoolExecutor(max_workers=max_workers,
+                             mp_context=NST_PARSE_CONTEXT) as parse_pool:
+        fetches = {fetch_pool.submit(nst_fetch, url, session, limiter,
+                                     cache): page
+                   for page, url in pages.items()}
+
+        parses = {}
+        for fetch in as_completed(fetches):
+            page = fetches[fetch]
+            response = fetch.result()
+            sit_columns = NST_SIT_COLUMNS.get(page[2], columns)
+            parse_key = nst_parse_key(sit_columns, compact)
+            parsed = cache.get_parsed(response.digest, parse_key)
+            if parsed is not None:
+                results[page] = parsed
+            else:
+                parse = parse_pool.submit(nst_parse_games, response.text,
+                                          sit_columns, compact)
+                parses[parse] = (page, response.digest, parse_key)
+
+        for parse in as_completed(parses):
+            page, digest, parse_key = parses[parse]
+            results[page] = parse.result()
+            cache.set_parsed(digest, parse_key, results[page])
+
+    session.close()
+
+    return results
 
 
 def nst_add_game_number(df):
@@ -85,58 +398,60 @@ def nst_add_game_number(df):
     return df
 
 
-def nst_replace_names(df):
-    # dictionary to convert team names to NHL official char abbrev
-    nst_teamname_conversion = {
-                                'Anaheim Ducks': 'ANA',
-                                'Arizona Coyotes': 'ARI',
-                                'Boston Bruins': 'BOS',
-                                'Buffalo Sabres': 'BUF',
-                                'Calgary Flames': 'CGY',
-                                'Carolina Hurricanes': 'CAR',
-                                'Chicago Blackhawks': 'CHI',
-                                'Colorado Avalanche': 'COL',
-                                'Columbus Blue Jackets': 'CBJ',
-                                'Dallas Stars': 'DAL',
-                                'Detroit Red Wings': 'DET',
-                                'Edmonton Oilers': 'EDM',
-                                'Florida Panthers': 'FLA',
-                                'Los Angeles Kings': 'L.A',
-                                'Minnesota Wild': 'MIN',
-                                'Montreal Canadiens': 'MTL',
-                                'Nashville Predators': 'NSH',
-                                'New Jersey Devils': 'N.J',
-                                'New York Islanders': 'NYI',
-                                'New York Rangers': 'NYR',
-                                'Ottawa Senators': 'OTT',
-                                'Philadelphia Flyers': 'PHI',
-                                'Pittsburgh Penguins': 'PIT',
-                                'San Jose Sharks': 'S.J',
-                                'Seattle Kraken': 'SEA',
-                                'St Louis Blues': 'STL',
-                                'Tampa Bay Lightning': 'T.B',
-                                'Toronto Maple Leafs': 'TOR',
-                                'Vancouver Canucks': 'VAN',
-                                'Vegas Golden Knights': 'VGK',
-                                'Washington Capitals': 'WSH',
-                                'Winnipeg Jets': 'WPG'
-    }
+# dictionary to convert team names to NHL official char abbrev
+NST_TEAMNAME_CONVERSION = {
+    'Anaheim Ducks': 'ANA',
+    'Arizona Coyotes': 'ARI',
+    'Boston Bruins': 'BOS',
+    'Buffalo Sabres': 'BUF',
+    'Calgary Flames': 'CGY',
+    'Carolina Hurricanes': 'CAR',
+    'Chicago Blackhawks': 'CHI',
+    'Colorado Avalanche': 'COL',
+    'Columbus Blue Jackets': 'CBJ',
+    'Dallas Stars': 'DAL',
+    'Detroit Red Wings': 'DET',
+    'Edmonton Oilers': 'EDM',
+    'Florida Panthers': 'FLA',
+    'Los Angeles Kings': 'L.A',
+    'Minnesota Wild': 'MIN',
+    'Montreal Canadiens': 'MTL',
+    'Nashville Predators': 'NSH',
+    'New Jersey Devils': 'N.J',
+    'New York Islanders': 'NYI',
+    'New York Rangers': 'NYR',
+    'Ottawa Senators': 'OTT',
+    'Philadelphia Flyers': 'PHI',
+    'Pittsburgh Penguins': 'PIT',
+    'San Jose Sharks': 'S.J',
+    'Seattle Kraken': 'SEA',
+    'St Louis Blues': 'STL',
+    'Tampa Bay Lightning': 'T.B',
+    'Toronto Maple Leafs': 'TOR',
+    'Vancouver Canucks': 'VAN',
+    'Vegas Golden Knights': 'VGK',
+    'Washington Capitals': 'WSH',
+    'Winnipeg Jets': 'WPG',
+    'Utah Hockey Club': 'UTA',
+    'Utah Mammoth': 'UTA'
+}
 
+
+def nst_replace_names(df):
     # convert team name to abbreviations
-    df = df.replace({'Team': nst_teamname_conversion})
+    df = df.replace({'Team': NST_TEAMNAME_CONVERSION})
 
     return df
 
 
 def nst_add_key(df):
-    # create key for merging data
-    df['team_key'] = df['Team'].astype(str) + '_' + df['date'].astype(str)
+    # (team_id, date) is the key for merging data
+    df = add_team_ids(df, {'Team': 'team_id'})
 
     return df
 
 
-def nst_single_sit(from_season, to_season, sit='5v5'):
-    df = nst_scrape_games(from_season, to_season)
+def nst_process_sit(df, sit='5v5'):
     df = nst_replace_names(df)
     df = nst_add_key(df)
 
@@ -146,38 +461,54 @@ def nst_single_sit(from_season, to_season, sit='5v5'):
     return df
 
 
-def nst_get_merge_sits(from_season, to_season):
-    sits = ['5v5', 'pp', 'pk']
-    sit_dfs = []
+def nst_single_sit(from_season, to_season, sit='5v5', columns=None,
+                   compact=False):
+    df = nst_scrape_games(from_season, to_season, sit=sit, columns=columns,
+                          compact=compact)
+    df = nst_process_sit(df, sit=sit)
+
+    return df
+
+
+def nst_merge_sits(sit_dfs):
+    """Merges the pp and pk columns onto the 5v5 games
 
-    for sit in sits:
-        df = nst_single_sit(from_season, to_season, sit=sit)
-        sit_dfs.append(df)
+    Parameters
+    ----------
+    sit_dfs - list of processed DataFrames, one per situation in NST_SITS order
 
+    Returns
+    -------
+    pandas DataFrame with one row per team per game"""
     df = sit_dfs[0]
-    df = df.merge(sit_dfs[1][['team_key', 'TOI', 'xGF', 'GF']],
-                  on='team_key',
+    df = df.merge(sit_dfs[1][['team_id', 'date', 'TOI', 'xGF', 'GF']],
+                  on=['team_id', 'date'],
                   how='left',
-                  suffixes=('', '_'+sits[1])
+                  suffixes=('', '_'+NST_SITS[1])
                   )
 
-    df = df.merge(sit_dfs[2][['team_key', 'TOI', 'xGA', 'GA']],
-                  on='team_key',
+    df = df.merge(sit_dfs[2][['team_id', 'date', 'TOI', 'xGA', 'GA']],
+                  on=['team_id', 'date'],
                   how='left',
-                  suffixes=('', '_'+sits[2])
+                  suffixes=('', '_'+NST_SITS[2])
                   )
     return df
 
 
+def nst_get_merge_sits(from_season, to_season, columns=None, compact=False):
+    pages = nst_scrape_pages([(from_season, to_season)], columns=columns,
+                             compact=compact)
+    sit_dfs = [nst_process_sit(pages[(from_season, to_season, sit)], sit=sit)
+               for sit in NST_SITS]
+
+    return nst_merge_sits(sit_dfs)
+
+
 def nst_clean_special_teams(df):
 
     # account for games with no special teams TOI
-    df['TOI_pp'] = np.where(df['TOI_pp'].isna(), 0, df['TOI_pp'])
-    df['TOI_pk'] = np.where(df['TOI_pk'].isna(), 0, df['TOI_pk'])
-    df['xGF_pp'] = np.where(df['xGF_pp'].isna(), 0, df['xGF_pp'])
-    df['GF_pp'] = np.where(df['GF_pp'].isna(), 0, df['GF_pp'])
-    df['xGA_pk'] = np.where(df['xGA_pk'].isna(), 0, df['xGA_pk'])
-    df['GA_pk'] = np.where(df['GA_pk'].isna(), 0, df['GA_pk'])
+    special_teams = ['TOI_pp', 'TOI_pk', 'xGF_pp', 'GF_pp', 'xGA_pk', 'GA_pk']
+    df[special_teams] = df[special_teams].fillna(0)
 
     return df
 
@@ -191,92 +522,147 @@ def nst_add_b2b(df):
     return df
 
 
+# nst column names to database column names
+NST_COLUMN_MAPPER = {
+    'Game': 'game',
+    'Team': 'team',
+    'TOI': 'toi_5v5',
+    'CF': 'cf_5v5',
+    'CA': 'ca_5v5',
+    'CF%': 'cf%_5v5',
+    'FF': 'ff_5v5',
+    'FA': 'fa_5v5',
+    'FF%': 'ff%_5v5',
+    'SF': 'sf_5v5',
+    'SA': 'sa_5v5',
+    'SF%': 'sf%_5v5',
+    'GF': 'gf_5v5',
+    'GA': 'ga_5v5',
+    'GF%': 'gf%_5v5',
+    'xGF': 'xgf_5v5',
+    'xGA': 'xga_5v5',
+    'xGF%': 'xgf%_5v5',
+    'SCF': 'scf_5v5',
+    'SCA': 'sca_5v5',
+    'SCF%': 'scf%_5v5',
+    'HDCF': 'hdcf_5v5',
+    'HDCA': 'hdca_5v5',
+    'HDCF%': 'hdcf%_5v5',
+    'HDSF': 'hdsf_5v5',
+    'HDSA': 'hdsa_5v5',
+    'HDSF%': 'hdsf%_5v5',
+    'HDGF': 'hdgf_5v5',
+    'HDGA': 'hdga_5v5',
+    'HDGF%': 'hdgf%_5v5',
+    'HDSH%': 'hdsh%_5v5',
+    'HDSV%': 'hdsv%_5v5',
+    'MDCF': 'mdcf_5v5',
+    'MDCA': 'mdca_5v5',
+    'MDCF%': 'mdcf%_5v5',
+    'MDSF': 'mdsf_5v5',
+    'MDSA': 'mdsa_5v5',
+    'MDSF%': 'mdsf%_5v5',
+    'MDGF': 'mdgf_5v5',
+    'MDGA': 'mdga_5v5',
+    'MDGF%': 'mdgf%_5v5',
+    'MDSH%': 'mdsh%_5v5',
+    'MDSV%': 'mdsv%_5v5',
+    'LDCF': 'ldcf_5v5',
+    'LDCA': 'ldca_5v5',
+    'LDCF%': 'ldcf%_5v5',
+    'LDSF': 'ldsf_5v5',
+    'LDSA': 'ldsa_5v5',
+    'LDSF%': 'ldsf%_5v5',
+    'LDGF': 'ldgf_5v5',
+    'LDGA': 'ldga_5v5',
+    'LDGF%': 'ldgf%_5v5',
+    'LDSH%': 'ldsh%_5v5',
+    'LDSV%': 'ldsv%_5v5',
+    'SH%': 'sh%_5v5',
+    'SV%': 'sv%_5v5',
+    'PDO': 'pdo_5v5',
+    'Attendance': 'attendance',
+    'TOI_pp': 'toi_pp',
+    'xGF_pp': 'xgf_pp',
+    'GF_pp': 'gf_pp',
+    'TOI_pk': 'toi_pk',
+    'xGA_pk': 'xga_pk',
+    'GA_pk': 'ga_pk'
+}
+
+
 def nst_format(df):
-    mapper = {'Game': 'game',
-              'Team': 'team',
-              'TOI': 'toi_5v5',
-              'CF': 'cf_5v5',
-              'CA': 'ca_5v5',
-              'CF%': 'cf%_5v5',
-              'FF': 'ff_5v5',
-              'FA': 'fa_5v5',
-              'FF%': 'ff%_5v5',
-              'SF': 'sf_5v5',
-              'SA': 'sa_5v5',
-              'SF%': 'sf%_5v5',
-              'GF': 'gf_5v5',
-              'GA': 'ga_5v5',
-              'GF%': 'gf%_5v5',
-              'xGF': 'xgf_5v5',
-              'xGA': 'xga_5v5',
-              'xGF%': 'xgf%_5v5',
-              'SCF': 'scf_5v5',
-              'SCA': 'sca_5v5',
-              'SCF%': 'scf%_5v5',
-              'HDCF': 'hdcf_5v5',
-              'HDCA': 'hdca_5v5',
-              'HDCF%': 'hdcf%_5v5',
-              'HDSF': 'hdsf_5v5',
-              'HDSA': 'hdsa_5v5',
-              'HDSF%': 'hdsf%_5v5',
-              'HDGF': 'hdgf_5v5',
-              'HDGA': 'hdga_5v5',
-              'HDGF%': 'hdgf%_5v5',
-              'HDSH%': 'hdsh%_5v5',
-              'HDSV%': 'hdsv%_5v5',
-              'MDCF': 'mdcf_5v5',
-              'MDCA': 'mdca_5v5',
-              'MDCF%': 'mdcf%_5v5',
-              'MDSF': 'mdsf_5v5',
-              'MDSA': 'mdsa_5v5',
-              'MDSF%': 'mdsf%_5v5',
-              'MDGF': 'mdgf_5v5',
-              'MDGA': 'mdga_5v5',
-              'MDGF%': 'mdgf%_5v5',
-              'MDSH%': 'mdsh%_5v5',
-              'MDSV%': 'mdsv%_5v5',
-              'LDCF': 'ldcf_5v5',
-              'LDCA': 'ldca_5v5',
-              'LDCF%': 'ldcf%_5v5',
-              'LDSF': 'ldsf_5v5',
-              'LDSA': 'ldsa_5v5',
-              'LDSF%': 'ldsf%_5v5',
-              'LDGF': 'ldgf_5v5',
-              'LDGA': 'ldga_5v5',
-              'LDGF%': 'ldgf%_5v5',
-              'LDSH%': 'ldsh%_5v5',
-              'LDSV%': 'ldsv%_5v5',
-              'SH%': 'sh%_5v5',
-              'SV%': 'sv%_5v5',
-              'PDO': 'pdo_5v5',
-              'Attendance': 'attendance',
-              'TOI_pp': 'toi_pp',
-              'xGF_pp': 'xgf_pp',
-              'GF_pp': 'gf_pp',
-              'TOI_pk': 'toi_pk',
-              'xGA_pk': 'xga_pk',
-              'GA_pk': 'ga_pk'
-              }
-
-    df = df.rename(mapper=mapper, axis='columns')
+    df = df.rename(mapper=NST_COLUMN_MAPPER, axis='columns')
 
     return df
 
 
-def nst_pipeline(from_season, to_season):
-    df = nst_get_merge_sits(from_season, to_season)
+def nst_transform(df, compact=False):
     df = nst_clean_special_teams(df)
     df = nst_add_b2b(df)
     df = nst_format(df)
 
+    if compact:
+        # the merged special teams columns and the keys added after parsing
+        df = nst_downcast(df)
+
+    return df
+
+
+def nst_pipeline(from_season, to_season, columns=None, compact=False):
+    df = nst_get_merge_sits(from_season, to_season, columns=columns,
+                            compact=compact)
+    df = nst_transform(df, compact=compact)
+
     return df
 
 
+def nst_pipeline_seasons(seasons, max_workers=NST_MAX_WORKERS,
+                         min_interval=NST_MIN_INTERVAL, columns=None,
+                         compact=False):
+    """Runs the nst pipeline for several seasons, fetching and parsing all
+    (season, situation) pages concurrently before the per season merge
+
+    Parameters
+    ----------
+    seasons - list of 8 char season strings (ex. ['20202021', '20212022'])
+    max_workers - number of concurrent downloads and parse workers
+    min_interval - minimum seconds between the start of two requests
+    columns - raw 5v5 columns to keep, see nst_parse_games
+    compact - downcast the frames, see nst_downcast
+
+    Returns
+    -------
+    dict mapping each season string to its nst DataFrame"""
+    pages = nst_scrape_pages([(season, season) for season in seasons],
+                             max_workers=max_workers,
+                             min_interval=min_interval,
+                             columns=columns,
+                             compact=compact
+                             )
+
+    season_dfs = {}
+    for season in seasons:
+        sit_dfs = [nst_process_sit(pages[(season, season, sit)], sit=sit)
+                   for sit in NST_SITS]
+        df = nst_merge_sits(sit_dfs)
+        season_dfs[season] = nst_transform(df, compact=compact)
+
+    return season_dfs
+
+
 def nst_filter_date(df, date):
     df = df[(df['date'] == date)]
     return df
 
 
+def nst_filter_dates(df, start_date, end_date):
+    # filter to an inclusive date range
+    dates = df['date'].dt.date
+    df = df[(dates >= start_date) & (dates <= end_date)]
+    return df
+
+
 def nhl_scrape_games(start_date, end_date):
     # scrape game data between two dates, get in dataframe format
     df = hockey_scraper.scrape_schedule(start_date, end_date,
@@ -287,14 +673,12 @@ def nhl_scrape_games(start_date, end_date):
 
 
 def nhl_filter_games(df):
-    # map game_id to str, use to filter out pre/post season games
+    # map game_id to str, use to keep only regular season games
     df['game_id'] = df['game_id'].map(str)
 
     # middle two numbers of the game_id string are
-    # 01 - preseason, 02 - regular season, 03 - playoffs
-    mask = ((df['game_id'].str[4:6] != '01') &
-            (df['game_id'].str[4:6] != '03')
-            )
+    # 01 - preseason, 02 - regular season, 03 - playoffs, 04 - All-Star
+    mask = df['game_id'].str[4:6] == '02'
     df = df[mask]
 
     return df
@@ -308,20 +692,14 @@ def nhl_add_home_win(df):
 
 
 def nhl_add_key(df):
-    # create keys for home and away team for merging data
-    df['home_team_key'] = (df['home_team'].astype(str) + '_'
-                           + df['date'].astype(str)
-                           )
-
-    df['away_team_key'] = (df['away_team'].astype(str) + '_'
-                           + df['date'].astype(str)
-                           )
+    # (team_id, date) keys for home and away team for merging data
+    df = add_team_ids(df, {'home_team': 'home_team_id',
+                           'away_team': 'away_team_id'})
 
     return df
 
 
-def nhl_pipeline(start_date, end_date):
-    df = nhl_scrape_games(start_date, end_date)
+def nhl_transform(df):
     df = nhl_filter_games(df)
     df = nhl_add_home_win(df)
     df = nhl_add_key(df)
@@ -329,20 +707,105 @@ def nhl_pipeline(start_date, end_date):
     return df
 
 
+def nhl_pipeline(start_date, end_date):
+    df = nhl_scrape_games(start_date, end_date)
+    df = nhl_transform(df)
+
+    return df
+
+
+def month_chunks(start_date, end_date):
+    """Splits a date range into calendar month sized ranges
+
+    Parameters
+    ----------
+    start_date - first date, 'YYYY-MM-DD' str
+    end_date - last date, 'YYYY-MM-DD' str
+
+    Returns
+    -------
+    list of (start_date, end_date) str tuples covering the range"""
+    start = date.fromisoformat(start_date)
+    end = date.fromisoformat(end_date)
+
+    chunks = []
+    while start <= end:
+        next_month = (start.replace(day=1) + timedelta(days=32)).replace(day=1)
+        chunk_end = min(next_month - timedelta(days=1), end)
+        chunks.append((start.isoformat(), chunk_end.isoformat()))
+        start = next_month
+
+    return chunks
+
+
+def nhl_pipeline_chunks(chunks, max_workers=NHL_MAX_WORKERS):
+    """Scrapes and transforms the NHL schedule one chunk at a time,
+    yielding each chunk as soon as it is ready. At most max_workers chunks
+    are in flight, so memory use stays flat however long the range is.
+
+    Parameters
+    ----------
+    chunks - list of (start_date, end_date) tuples, ex. from month_chunks
+    max_workers - number of concurrent schedule requests
+
+    Yields
+    ------
+    ((start_date, end_date), DataFrame) in completion order, chunks without
+    games are skipped"""
+    def scrape_chunk(chunk):
+        df = nhl_scrape_games(*chunk)
+        if df is None or df.empty:
+            return None
+        return nhl_transform(df)
+
+    chunks = iter(chunks)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        running = {}
+        for chunk in chunks:
+            running[pool.submit(scrape_chunk, chunk)] = chunk
+            if len(running) == max_workers:
+                break
+
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                chunk = running.pop(future)
+                df = future.result()
+                # keep the window full
+                for next_chunk in chunks:
+                    running[pool.submit(scrape_chunk, next_chunk)] = next_chunk
+                    break
+                if df is not None:
+                    yield chunk, df
+
+
+def elo_parse_csv(text):
+    return pd.read_csv(io.StringIO(text))
+
+
 def elo_scrape():
     url = 'https://projects.fivethirtyeight.com/nhl-api/nhl_elo_latest.csv'
     # link to historical ELO ratings
     hist_url = 'https://projects.fivethirtyeight.com/nhl-api/nhl_elo.csv'
-    df = pd.read_csv(url)
-    df2 = pd.read_csv(hist_url)
-    df = pd.concat(objs=[df, df2])
+    cache = http_cache.default_cache()
+    session = requests.Session()
+    dfs = []
+    for csv_url in [url, hist_url]:
+        page = cache.get(csv_url,
+                         lambda headers: session.get(csv_url, headers=headers,
+                                                     timeout=NST_TIMEOUT)
+                         )
+        dfs.append(cache.parsed(page, elo_parse_csv))
+    session.close()
+    df = pd.concat(objs=dfs)
 
     return df
 
 
 def elo_filter(df, start_date, end_date):
-    # filter to target date range
-    df = df[((df['date'] > start_date) & (df['date'] < end_date))]
+    # filter to target date range, inclusive so a single day range keeps
+    # that day's games
+    df = df[((df['date'] >= start_date) & (df['date'] <= end_date))]
     # filter out playoff games
     df = df[(df['playoff'] != '1')]
 
@@ -368,13 +831,9 @@ def elo_replace_abbr(df):
 
 
 def elo_add_key(df):
-    # add team key
-    df['home_team_key'] = (df['home_team_abbr'].astype(str) + '_'
-                           + df['date'].astype(str)
-                           )
-    df['away_team_key'] = (df['away_team_abbr'].astype(str) + '_'
-                           + df['date'].astype(str)
-                           )
+    # add (team_id, date) keys
+    df = add_team_ids(df, {'home_team_abbr': 'home_team_id',
+                           'away_team_abbr': 'away_team_id'})
 
     return df
 
@@ -1,5 +1,25 @@
 query = """
 SELECT *
 FROM features
-WHERE evaluated = CURRENT_DATE
+WHERE "date" > now() - '3 years'::interval
+"""
+
+# summary of the training rows used to fingerprint a model fit
+summary_query = """
+SELECT
+	COUNT(*) AS n_rows,
+	MIN(game_id) AS first_game_id,
+	MAX(game_id) AS last_game_id,
+	MAX(build_id) AS last_build_id
+FROM features
+WHERE "date" > now() - '3 years'::interval
+"""
+
+# training rows built since a previous fit, including late games and rows
+# rebuilt after a rewind whatever their game_id
+new_rows_query = """
+SELECT *
+FROM features
+WHERE "date" > now() - '3 years'::interval
+AND build_id > :last_build_id
 """
@@ -1,10 +1,5 @@
+# most recent team_stats row of each team, maintained by the team_stats build
 query = """
-SELECT ts.*
-FROM team_stats ts
-INNER JOIN 
-	(SELECT team, MAX(date) AS last_played
-	FROM team_stats
-	GROUP BY team) most_recent
-ON ts.team = most_recent.team 
-AND ts.date = most_recent.last_played
+SELECT *
+FROM team_stats_latest
 """
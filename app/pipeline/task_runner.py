@@ -0,0 +1,216 @@
+"""Task runner
+
+Runs a small DAG of pipeline steps. A task starts as soon as every task it
+depends on has finished, so independent steps such as the source scrapes run
+concurrently on a thread pool. Failures listed in a task's retry_on are
+retried with exponential backoff. The result of each finished task is
+checkpointed to disk, so rerunning the same run resumes after the last
+completed step instead of starting over.
+
+Checkpoints are kept under CHECKPOINT_DIR (overridable with the
+NHL_BETS_CHECKPOINT_DIR environment variable), one directory per run key.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import time
+import pandas as pd
+
+CHECKPOINT_DIR = os.environ.get('NHL_BETS_CHECKPOINT_DIR',
+                                os.path.join(os.path.dirname(
+                                    os.path.abspath(__file__)), '.checkpoints')
+                                )
+# run directories kept by prune_checkpoints
+CHECKPOINT_KEEP = 7
+TASK_MAX_WORKERS = 4
+TASK_RETRIES = 3
+# seconds before the first retry, doubled on each further attempt
+TASK_BACKOFF = 30
+
+
+class TaskFailed(Exception):
+    """Raised by TaskRunner.run when a task fails after its retries"""
+
+    def __init__(self, task_name, error):
+        super().__init__(f'task {task_name} failed: {error!r}')
+        self.task_name = task_name
+        self.error = error
+
+
+class Task:
+    """A step of the DAG
+
+    Parameters
+    ----------
+    name - unique task name
+    func - callable receiving the results of deps as keyword arguments
+    deps - names of the tasks that must finish first
+    retries - number of retries after the first attempt
+    backoff - seconds before the first retry, doubled on each further one
+    retry_on - exception types treated as transient
+    checkpoint - save the result so a rerun skips the task
+    """
+
+    def __init__(self, name, func, deps=(), retries=TASK_RETRIES,
+                 backoff=TASK_BACKOFF, retry_on=(OSError,), checkpoint=True):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.retries = retries
+        self.backoff = backoff
+        self.retry_on = tuple(retry_on)
+        self.checkpoint = checkpoint
+
+
+def topological_order(tasks):
+    """Returns the task names ordered so each comes after its deps, raising
+    ValueError for unknown deps and cycles"""
+    by_name = {task.name: task for task in tasks}
+    if len(by_name) != len(tasks):
+        raise ValueError('task names must be unique')
+
+    order = []
+    state = {}
+
+    def visit(name, path):
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise ValueError('dependency cycle: ' + ' -> '.join(path + [name]))
+        if name not in by_name:
+            raise ValueError(f'{path[-1]} depends on unknown task {name}')
+        state[name] = 'visiting'
+        for dep in by_name[name].deps:
+            visit(dep, path + [name])
+        state[name] = 'done'
+        order.append(name)
+
+    for task in tasks:
+        visit(task.name, [])
+
+    return order
+
+
+class TaskRunner:
+    """Runs tasks in dependency order, concurrently where possible
+
+    Parameters
+    ----------
+    tasks - list of Task
+    run_key - identifies the run for checkpointing, ex. the date, None to
+              disable checkpoints
+    max_workers - most tasks running at once
+    checkpoint_dir - directory holding a directory of checkpoints per run_key
+    pipeline_run - instrumentation.PipelineRun timing each task, optional
+    """
+
+    def __init__(self, tasks, run_key=None, max_workers=TASK_MAX_WORKERS,
+                 checkpoint_dir=CHECKPOINT_DIR, pipeline_run=None):
+        topological_order(tasks)
+        self.tasks = {task.name: task for task in tasks}
+        self.max_workers = max_workers
+        self.pipeline_run = pipeline_run
+        self.run_dir = None
+        if run_key is not None:
+            self.run_dir = os.path.join(checkpoint_dir, str(run_key))
+            os.makedirs(self.run_dir, exist_ok=True)
+
+    def _checkpoint_path(self, name):
+        return os.path.join(self.run_dir, name + '.pkl')
+
+    def _load_checkpoint(self, task):
+        if self.run_dir is None or not task.checkpoint:
+            return False, None
+        try:
+            with open(self._checkpoint_path(task.name), 'rb') as f:
+                return True, pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return False, None
+
+    def _save_checkpoint(self, task, result):
+        if self.run_dir is None or not task.checkpoint:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.run_dir)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._checkpoint_path(task.name))
+
+    def _call(self, task, kwargs):
+        for attempt in range(task.retries + 1):
+            try:
+                return task.func(**kwargs)
+            except task.retry_on as e:
+                if attempt == task.retries:
+                    raise
+                # jitter so concurrent retries against one source spread out
+                delay = task.backoff * 2 ** attempt * random.uniform(0.8, 1.2)
+                print(f'{task.name} failed ({e!r}), retry {attempt + 1} of '
+                      f'{task.retries} in {delay:.0f}s')
+                time.sleep(delay)
+
+    def _execute(self, task, kwargs):
+        if self.pipeline_run is None:
+            result = self._call(task, kwargs)
+        else:
+            with self.pipeline_run.stage(task.name) as stage:
+                result = self._call(task, kwargs)
+                if isinstance(result, pd.DataFrame):
+                    stage.rows_out = len(result)
+        self._save_checkpoint(task, result)
+
+        return result
+
+    def run(self):
+        """Runs every task not already checkpointed for this run
+
+        Returns
+        -------
+        dict of task name to result"""
+        results = {}
+        for task in self.tasks.values():
+            found, result = self._load_checkpoint(task)
+            if found:
+                print(f'{task.name} already completed, skipping')
+                results[task.name] = result
+
+        pending = {name for name in self.tasks if name not in results}
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                ready = [name for name in pending
+                         if all(dep in results
+                                for dep in self.tasks[name].deps)]
+                for name in ready:
+                    task = self.tasks[name]
+                    kwargs = {dep: results[dep] for dep in task.deps}
+                    running[pool.submit(self._execute, task, kwargs)] = name
+                    pending.discard(name)
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        # let running tasks finish, start no new ones
+                        wait(running)
+                        raise TaskFailed(name, e) from e
+
+        return results
+
+
+def prune_checkpoints(checkpoint_dir=CHECKPOINT_DIR, keep=CHECKPOINT_KEEP):
+    """Removes all but the keep most recent run directories"""
+    try:
+        runs = sorted(os.scandir(checkpoint_dir),
+                      key=lambda entry: entry.stat().st_mtime)
+    except OSError:
+        return
+
+    runs = [entry for entry in runs if entry.is_dir()]
+    for entry in runs[:-keep] if keep else runs:
+        shutil.rmtree(entry.path, ignore_errors=True)
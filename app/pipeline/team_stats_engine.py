@@ -0,0 +1,185 @@
+"""Team stats engine
+
+In-process equivalent of build_team_stats_table. Computes the rolling half
+season team_stats columns from an nst_pipeline DataFrame without a database,
+so feature experiments and point-in-time replays can run on a laptop.
+
+Rolling sums use cumulative sum differences within each team, which is O(n)
+over all rows regardless of the window length.
+
+Running this script computes team_stats from the nst table and compares it
+with the team_stats table built by the SQL.
+"""
+
+import numpy as np
+import pandas as pd
+
+# half season, the SQL window is 40 PRECEDING AND CURRENT ROW
+WINDOW = 41
+
+SUM_COLUMNS = ['toi_5v5',
+               'ff_5v5',
+               'fa_5v5',
+               'gf_5v5',
+               'ga_5v5',
+               'xgf_5v5',
+               'xga_5v5',
+               'sf_5v5',
+               'toi_pp',
+               'xgf_pp',
+               'gf_pp',
+               'toi_pk',
+               'xga_pk',
+               'ga_pk'
+               ]
+
+STAT_COLUMNS = ['ff%_5v5_last_half',
+                'gf%_5v5_last_half',
+                'xgf%_5v5_last_half',
+                'sh%_5v5_last_half',
+                'gf_per_min_pp_last_half',
+                'xgf_per_min_pp_last_half',
+                'ga_per_min_pk_last_half',
+                'xga_per_min_pk_last_half'
+                ]
+
+
+def rolling_group_sums(values, group_starts, window=WINDOW):
+    """Sums each row with the window-1 rows before it in the same group
+
+    Parameters
+    ----------
+    values - 2d float array, rows sorted by group then date
+    group_starts - int array giving each row's group's first row index
+    window - number of rows in the window, including the current row
+
+    Returns
+    -------
+    2d float array of window sums. Like SQL SUM, NaNs are skipped and a
+    window with no values sums to NaN"""
+    n_rows = values.shape[0]
+    missing = np.isnan(values)
+    padding = np.zeros((1, values.shape[1]))
+
+    sums = np.vstack([padding, np.cumsum(np.where(missing, 0, values), axis=0)])
+    counts = np.vstack([padding, np.cumsum(~missing, axis=0)])
+
+    rows = np.arange(n_rows)
+    window_starts = np.maximum(rows - window + 1, group_starts)
+
+    window_sums = sums[rows + 1] - sums[window_starts]
+    window_counts = counts[rows + 1] - counts[window_starts]
+    window_sums[window_counts == 0] = np.nan
+
+    return window_sums
+
+
+def compute_team_stats(nst, window=WINDOW):
+    """Computes the team_stats table from nst data
+
+    Parameters
+    ----------
+    nst - DataFrame as returned by nst_pipeline or read from the nst table
+    window - number of games in the rolling window
+
+    Returns
+    -------
+    DataFrame with the columns of the team_stats table, one row per team
+    per game"""
+    df = nst.sort_values(['team', 'date'], kind='mergesort')
+    df = df.reset_index(drop=True)
+
+    teams = df['team'].to_numpy()
+    # rows are sorted by team, so each team's rows are contiguous
+    is_start = np.ones(len(df), dtype=bool)
+    is_start[1:] = teams[1:] != teams[:-1]
+    group_starts = np.maximum.accumulate(np.where(is_start,
+                                                  np.arange(len(df)), 0))
+
+    values = df[SUM_COLUMNS].to_numpy(dtype=np.float64)
+    sums = rolling_group_sums(values, group_starts, window)
+    s = dict(zip(SUM_COLUMNS, sums.T))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stats = {
+            'ff%_5v5_last_half':
+                s['ff_5v5'] * 100 / (s['ff_5v5'] + s['fa_5v5']),
+            'gf%_5v5_last_half':
+                s['gf_5v5'] * 100 / (s['gf_5v5'] + s['ga_5v5']),
+            'xgf%_5v5_last_half':
+                s['xgf_5v5'] * 100 / (s['xgf_5v5'] + s['xga_5v5']),
+            'sh%_5v5_last_half': s['gf_5v5'] * 100 / s['sf_5v5'],
+            'gf_per_min_pp_last_half': s['gf_pp'] / s['toi_pp'],
+            'xgf_per_min_pp_last_half': s['xgf_pp'] / s['toi_pp'],
+            'ga_per_min_pk_last_half': s['ga_pk'] / s['toi_pk'],
+            'xga_per_min_pk_last_half': s['xga_pk'] / s['toi_pk']
+        }
+
+    team_stats = pd.DataFrame({'team_id': df['team_id'].to_numpy(),
+                               'team': teams})
+    for column in STAT_COLUMNS:
+        team_stats[column] = stats[column]
+    team_stats['date'] = df['date'].to_numpy()
+    team_stats['b2b'] = df['b2b'].astype(bool).to_numpy()
+
+    return team_stats
+
+
+def latest_team_stats(team_stats, as_of=None):
+    """Returns each team's most recent stats, optionally as of a date
+
+    Parameters
+    ----------
+    team_stats - DataFrame from compute_team_stats
+    as_of - only use games played on or before this date
+    """
+    if as_of is not None:
+        team_stats = team_stats[team_stats['date'] <= pd.Timestamp(as_of)]
+
+    return (team_stats.sort_values('date', kind='mergesort')
+            .groupby('team', sort=True)
+            .tail(1)
+            .reset_index(drop=True))
+
+
+def compare_team_stats(expected, actual, rtol=1e-9, atol=1e-12):
+    """Compares two team_stats frames on (team_id, date)
+
+    Returns
+    -------
+    DataFrame of the keys and columns that differ, empty when they match"""
+    keys = ['team_id', 'date']
+    merged = expected.merge(actual, on=keys, how='outer',
+                            suffixes=('_expected', '_actual'),
+                            indicator=True)
+    mismatches = [merged.loc[merged['_merge'] != 'both',
+                             keys].assign(column='_merge')]
+
+    both = merged[merged['_merge'] == 'both']
+    for column in STAT_COLUMNS:
+        a = both[column + '_expected'].to_numpy(dtype=np.float64)
+        b = both[column + '_actual'].to_numpy(dtype=np.float64)
+        differs = ~np.isclose(a, b, rtol=rtol, atol=atol, equal_nan=True)
+        mismatches.append(both.loc[differs, keys]
+                          .assign(column=column))
+
+    return pd.concat(mismatches, ignore_index=True)
+
+
+if __name__ == '__main__':
+    from database_functions import get_db_uri, read_query
+
+    SQLALCHEMY_DATABASE_URI = get_db_uri()
+    nst = read_query(uri=SQLALCHEMY_DATABASE_URI,
+                     query='SELECT * FROM nst',
+                     date_fields={'date': '%Y-%m-%d'}
+                     )
+    sql_stats = read_query(uri=SQLALCHEMY_DATABASE_URI,
+                           query='SELECT * FROM team_stats',
+                           date_fields={'date': '%Y-%m-%d'}
+                           )
+
+    mismatches = compare_team_stats(sql_stats, compute_team_stats(nst))
+    print(f'{len(sql_stats)} rows compared, {len(mismatches)} mismatches')
+    if len(mismatches) > 0:
+        print(mismatches.head(20))
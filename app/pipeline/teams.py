@@ -0,0 +1,74 @@
+"""Team dimension
+
+Canonical small integer ids for the NHL's official team abbreviations. Every
+source is keyed on (team_id, date) once its team names have been converted to
+these abbreviations. Ids are never reused or renumbered, new teams are added
+at the end and loaded into the teams table by a new migration inserting them.
+Rows of teams that are not in TEAMS, ex. All-Star teams, are dropped.
+"""
+
+# (team_id, abbreviation, name)
+TEAMS = [(1, 'ANA', 'Anaheim Ducks'),
+         (2, 'ARI', 'Arizona Coyotes'),
+         (3, 'BOS', 'Boston Bruins'),
+         (4, 'BUF', 'Buffalo Sabres'),
+         (5, 'CGY', 'Calgary Flames'),
+         (6, 'CAR', 'Carolina Hurricanes'),
+         (7, 'CHI', 'Chicago Blackhawks'),
+         (8, 'COL', 'Colorado Avalanche'),
+         (9, 'CBJ', 'Columbus Blue Jackets'),
+         (10, 'DAL', 'Dallas Stars'),
+         (11, 'DET', 'Detroit Red Wings'),
+         (12, 'EDM', 'Edmonton Oilers'),
+         (13, 'FLA', 'Florida Panthers'),
+         (14, 'L.A', 'Los Angeles Kings'),
+         (15, 'MIN', 'Minnesota Wild'),
+         (16, 'MTL', 'Montreal Canadiens'),
+         (17, 'NSH', 'Nashville Predators'),
+         (18, 'N.J', 'New Jersey Devils'),
+         (19, 'NYI', 'New York Islanders'),
+         (20, 'NYR', 'New York Rangers'),
+         (21, 'OTT', 'Ottawa Senators'),
+         (22, 'PHI', 'Philadelphia Flyers'),
+         (23, 'PIT', 'Pittsburgh Penguins'),
+         (24, 'S.J', 'San Jose Sharks'),
+         (25, 'SEA', 'Seattle Kraken'),
+         (26, 'STL', 'St. Louis Blues'),
+         (27, 'T.B', 'Tampa Bay Lightning'),
+         (28, 'TOR', 'Toronto Maple Leafs'),
+         (29, 'VAN', 'Vancouver Canucks'),
+         (30, 'VGK', 'Vegas Golden Knights'),
+         (31, 'WSH', 'Washington Capitals'),
+         (32, 'WPG', 'Winnipeg Jets'),
+         (33, 'UTA', 'Utah Mammoth')
+         ]
+
+TEAM_IDS = {abbr: team_id for team_id, abbr, _ in TEAMS}
+
+
+def add_team_ids(df, columns):
+    """Adds int16 team id columns for team abbreviation columns
+
+    Parameters
+    ----------
+    df - DataFrame
+    columns - dict of abbreviation column to the team id column to add,
+              ex. {'home_team': 'home_team_id'}
+
+    Returns
+    -------
+    df with the id columns added, without the rows of unknown
+    abbreviations"""
+    for abbr_column, id_column in columns.items():
+        # map through str so categorical columns map to plain ids
+        ids = df[abbr_column].astype(str).map(TEAM_IDS)
+        unknown = ids.isna()
+        if unknown.any():
+            print(f'Dropping {unknown.sum()} rows with unknown team '
+                  f'abbreviations in {abbr_column}: '
+                  f'{sorted(map(str, df.loc[unknown, abbr_column].unique()))}')
+            df = df[~unknown].copy()
+            ids = ids[~unknown]
+        df[id_column] = ids.astype('int16')
+
+    return df
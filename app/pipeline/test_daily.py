@@ -3,6 +3,7 @@ from scraping_functions import nhl_pipeline
 from database_functions import get_db_uri, get_nhl_dtype, save_to_database, execute_query
 import build_team_stats_table
 import build_features
+import migrations
 
 TODAY = date.today()
 SQLALCHEMY_DATABASE_URI = get_db_uri()
@@ -11,6 +12,7 @@ NHL_DTYPE = get_nhl_dtype()
 
 if __name__ == '__main__':
 
+    migrations.migrate(SQLALCHEMY_DATABASE_URI)
     target_date = TODAY.strftime('%Y-%m-%d')
     todays_games = nhl_pipeline(start_date=target_date, end_date=target_date)
     save_to_database(uri=SQLALCHEMY_DATABASE_URI,
@@ -21,6 +23,6 @@ if __name__ == '__main__':
                      )
 
     execute_query(uri=SQLALCHEMY_DATABASE_URI,
-                  query=build_team_stats_table.query
+                  query=build_team_stats_table.incremental_query
                   )
     execute_query(uri=SQLALCHEMY_DATABASE_URI, query=build_features.query)
@@ -0,0 +1,5 @@
+import os
+
+# the pipeline modules read the database uri at import, the tests never
+# connect to it
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+from backtest import TEAM_STATS_FEATURES, point_in_time_features
+from model import ALL_FEATURES
+
+
+def team_stats_row(team_id, date, value):
+    return dict({column: value for column in TEAM_STATS_FEATURES},
+                team_id=team_id, date=pd.Timestamp(date), b2b=value > 1)
+
+
+def test_point_in_time_features_use_the_previous_game():
+    team_stats = pd.DataFrame([team_stats_row(1, '2022-01-01', 1.0),
+                               team_stats_row(1, '2022-01-03', 2.0),
+                               team_stats_row(2, '2022-01-02', 5.0),
+                               team_stats_row(2, '2022-01-03', 6.0)])
+    # the features table's stats are those of the game date itself
+    features = pd.DataFrame({'game_id': ['2', '1'],
+                             'date': pd.to_datetime(['2022-01-03',
+                                                     '2022-01-01']),
+                             'home_team_id': [1, 1],
+                             'away_team_id': [2, 2],
+                             'home_team_won': [True, False]})
+    for column in ALL_FEATURES:
+        features[column] = 9.0
+
+    df = point_in_time_features(features, team_stats)
+
+    assert list(df['game_id']) == ['1', '2']
+    assert df.loc[0, ALL_FEATURES].isna().all()
+    assert (df.loc[1, [c for c in ALL_FEATURES if c.startswith('home_')]]
+            .tolist() == [1.0] * 8 + [False])
+    assert (df.loc[1, [c for c in ALL_FEATURES if c.startswith('away_')]]
+            .tolist() == [5.0] * 8 + [True])
+    assert np.isnan(df[ALL_FEATURES].to_numpy(dtype=np.float64)[0]).all()
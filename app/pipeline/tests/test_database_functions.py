@@ -0,0 +1,56 @@
+import csv
+import io
+import numpy as np
+import pandas as pd
+from pandas.io.sql import SQLDatabase, SQLTable
+from sqlalchemy import create_engine
+from sqlalchemy.types import Float, Integer
+from database_functions import psql_insert_copy
+
+
+class CopyCursor:
+    """Cursor keeping the csv sent with COPY"""
+
+    def __init__(self, copied):
+        self.copied = copied
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def copy_expert(self, sql, file):
+        self.copied.extend(csv.reader(io.StringIO(file.read())))
+
+
+class CopyConnection:
+    def __init__(self):
+        self.copied = []
+        self.connection = self
+
+    def cursor(self):
+        return CopyCursor(self.copied)
+
+
+def copy_rows(df, dtype):
+    """Runs psql_insert_copy on the rows of df the way to_sql does, returns
+    the csv rows it sent"""
+    table = SQLTable('nst', SQLDatabase(create_engine('sqlite://')),
+                     frame=df, index=False, dtype=dtype)
+    keys, data = table.insert_data()
+    conn = CopyConnection()
+    psql_insert_copy(table, conn, keys, zip(*data))
+
+    return conn.copied
+
+
+def test_psql_insert_copy_count_column_with_nans():
+    # an Integer count with NaNs is float32 after nst_downcast
+    df = pd.DataFrame({'attendance': np.array([17000, np.nan],
+                                              dtype=np.float32),
+                       'xgf': np.array([52.13, 1.5], dtype=np.float32)})
+
+    rows = copy_rows(df, {'attendance': Integer(), 'xgf': Float()})
+
+    assert rows == [['17000', '52.13'], ['', '1.5']]
@@ -0,0 +1,46 @@
+import threading
+from instrumentation import PipelineRun, count_download
+
+
+def test_concurrent_stages_leave_shared_counters_empty():
+    run = PipelineRun('test')
+    both_open = threading.Barrier(2)
+
+    def scrape(name, num_bytes):
+        with run.stage(name):
+            count_download(num_bytes)
+            both_open.wait()
+
+    threads = [threading.Thread(target=scrape, args=(name, num_bytes))
+               for name, num_bytes in [('scrape_nst', 100),
+                                       ('scrape_nhl', 10)]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for stage in run.stages:
+        assert stage.status == 'ok'
+        assert stage.wall_seconds is not None
+        assert stage.cpu_seconds is None
+        assert stage.bytes_downloaded is None
+
+    df = run.to_frame()
+    assert df['bytes_downloaded'].isna().all()
+    assert 'stage_bytes_downloaded{' not in run.to_prometheus()
+
+
+def test_nested_and_sequential_stages_keep_counters():
+    run = PipelineRun('test')
+    with run.stage('load') as load:
+        with run.stage('load_nhl'):
+            count_download(10)
+        count_download(5)
+    with run.stage('build') as build:
+        pass
+
+    stages = {stage.name: stage for stage in run.stages}
+    assert stages['load_nhl'].bytes_downloaded == 10
+    assert load.bytes_downloaded == 15
+    assert build.bytes_downloaded == 0
+    assert all(stage.cpu_seconds is not None for stage in run.stages)
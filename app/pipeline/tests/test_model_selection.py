@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from backtest import save_shared
+from model import ALL_FEATURES, CATEGORICAL_FEATURES
+from model_selection import leaderboard, run_selection, time_folds
+
+LOGREG = {'learner': 'logreg', 'penalty': 'l2', 'C': 1.0,
+          'solver': 'liblinear'}
+
+
+def test_time_folds_expand_without_splitting_dates():
+    dates = np.repeat(np.arange('2022-01-01', '2022-01-13',
+                                dtype='datetime64[D]'), 3)
+    dates[5] = dates[4]
+
+    folds = time_folds(dates, n_folds=3)
+
+    assert len(folds) == 3
+    assert folds[-1][1] == len(dates)
+    for (train_end, test_end), (next_train_end, _) in zip(folds, folds[1:]):
+        assert test_end == next_train_end
+    for train_end, test_end in folds:
+        assert train_end < test_end
+        assert dates[train_end - 1] < dates[train_end]
+
+
+@pytest.fixture
+def design_matrix(tmp_path):
+    """Design matrix whose training rows leak the result through their first
+    column, like the features table's stats, while the point in time rows
+    hold no information about it"""
+    rng = np.random.default_rng(0)
+    n_rows = 600
+    categorical = [ALL_FEATURES.index(c) for c in CATEGORICAL_FEATURES]
+    y = rng.integers(0, 2, n_rows).astype(np.int8)
+
+    X = rng.normal(size=(n_rows, len(ALL_FEATURES)))
+    X[:, categorical] = rng.integers(0, 2, (n_rows, len(categorical)))
+    X_scored = X.copy()
+    X[:, 0] = y + rng.normal(scale=0.1, size=n_rows)
+    # a team's first game has no earlier stats
+    X_scored[[200, 201], :] = np.nan
+
+    save_shared({'X': X,
+                 'y': y,
+                 'X_scored': X_scored,
+                 'dates': np.repeat(np.arange('2022-01-01', '2022-03-02',
+                                              dtype='datetime64[D]'), 10)},
+                str(tmp_path))
+
+    return str(tmp_path)
+
+
+def test_run_selection_scores_point_in_time_rows(design_matrix):
+    results = run_selection(design_matrix, [LOGREG], n_folds=2,
+                            max_workers=1)
+
+    assert results['fold'].tolist() == [0, 1]
+    assert results['train_rows'].tolist() == [200, 400]
+    assert results['test_rows'].tolist() == [198, 200]
+    # scored on the leaking rows the log loss would be near 0
+    assert (results['log_loss'] > 0.6).all()
+
+    board = leaderboard(results)
+    assert board.loc[0, 'n_rows'] == 398
+    assert board.loc[0, 'rank'] == 1
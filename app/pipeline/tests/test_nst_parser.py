@@ -0,0 +1,62 @@
+import io
+import pandas as pd
+import pytest
+from scraping_functions import get_season_string, nst_parse_games
+
+LINKS = '<td><a href="/game.php?l">Limited</a> | <a href="/game.php?f">Full</a></td>' # noqa
+
+# games table of a nst games page, the unnamed first column is the row
+# number and the other unnamed one holds links. The page's second table must
+# be ignored.
+HTML = f"""<html><body>
+<table id="teams"><thead><tr>
+<th></th><th>Game</th><th></th><th>Team</th><th>TOI</th><th>CF</th><th>FF</th>
+<th>GF</th><th>xGF</th><th>Attendance</th>
+</tr></thead><tbody>
+<tr><td>1</td><td>2021-10-12 - Penguins 6, Lightning 2</td>{LINKS}
+<td>Pittsburgh Penguins</td><td>48.35</td><td>1,234</td><td>30</td><td>3</td>
+<td>2.41</td><td>19,092</td></tr>
+<tr><td>2</td><td>2021-10-12 - Penguins 6, Lightning 2</td>{LINKS}
+<td>Tampa Bay Lightning</td><td>48.35</td><td>45</td><td>-</td><td>1</td>
+<td>-</td><td>19,092</td></tr>
+<tr><td>3</td><td>2022-01-03 - Kraken 1, Jets 4</td>{LINKS}
+<td>Winnipeg Jets</td><td>51.02</td><td>50</td><td>38</td><td>4</td>
+<td>3.10</td><td>-</td></tr>
+</tbody></table>
+<table><tr><th>Other</th></tr><tr><td>x</td></tr></table>
+</body></html>"""
+
+
+def read_html_games(html):
+    """The games table parsed the way nst_scrape_games did with pd.read_html"""
+    df = pd.read_html(io.StringIO(html), header=0, index_col=0,
+                      na_values=['-'])[0]
+    df = df.reset_index().drop(columns='Unnamed: 2')
+    df['date'] = df['Game'].apply(lambda x: pd.to_datetime(x[:10],
+                                                           format='%Y-%m-%d'))
+    df['season'] = df['date'].apply(get_season_string)
+
+    return df
+
+
+def test_nst_parse_games_matches_read_html():
+    df = nst_parse_games(HTML)
+
+    pd.testing.assert_frame_equal(df, read_html_games(HTML))
+    # '-' cells are missing, thousands separators are dropped
+    assert df['FF'].isna().tolist() == [False, True, False]
+    assert df['CF'].tolist() == [1234, 45, 50]
+    assert df['Attendance'].tolist()[:2] == [19092, 19092]
+
+
+def test_nst_parse_games_projects_columns():
+    df = nst_parse_games(HTML, columns=['TOI', 'xGF', 'Attendance', 'HDCF'])
+
+    expected = read_html_games(HTML)[['Game', 'Team', 'TOI', 'xGF',
+                                      'Attendance', 'date', 'season']]
+    pd.testing.assert_frame_equal(df, expected)
+
+
+def test_nst_parse_games_without_table():
+    with pytest.raises(ValueError):
+        nst_parse_games('<html><body><p>Down for maintenance</p></body></html>')
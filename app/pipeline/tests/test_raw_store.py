@@ -0,0 +1,64 @@
+import pandas as pd
+import raw_store
+
+
+def nst_rows(dates, teams):
+    return pd.DataFrame({'date': pd.to_datetime(dates),
+                         'team': teams,
+                         'season': '20212022',
+                         'xgf_5v5': range(len(dates))})
+
+
+def test_read_filters_dates_and_teams(tmp_path):
+    raw_store.write_partition('nst', '20212022',
+                              nst_rows(['2022-01-02', '2022-01-01',
+                                        '2022-01-02'],
+                                       ['TOR', 'MTL', 'BOS']),
+                              part='2022-01-01', raw_dir=tmp_path)
+    raw_store.write_partition('nst', '20212022',
+                              nst_rows(['2022-01-03', '2022-01-04'],
+                                       ['TOR', 'TOR']),
+                              part='2022-01-03', raw_dir=tmp_path)
+
+    df = raw_store.read('nst', columns=['team', 'date', 'xgf_5v5'],
+                        start_date='2022-01-02', end_date='2022-01-03',
+                        teams=['TOR', 'MTL'], raw_dir=tmp_path)
+
+    assert list(df.columns) == ['team', 'date', 'xgf_5v5']
+    assert df['team'].tolist() == ['TOR', 'TOR']
+    assert df['date'].tolist() == [pd.Timestamp('2022-01-02'),
+                                   pd.Timestamp('2022-01-03')]
+    assert df['xgf_5v5'].tolist() == [0, 0]
+
+
+def test_read_matches_any_team_column(tmp_path):
+    nhl = pd.DataFrame({'date': pd.to_datetime(['2022-01-01',
+                                                '2022-01-01']),
+                        'home_team': ['TOR', 'BOS'],
+                        'away_team': ['MTL', 'TOR'],
+                        'game_id': ['1', '2']})
+    raw_store.write_source('nhl', nhl, raw_dir=tmp_path)
+
+    assert raw_store.read('nhl', teams=['MTL'],
+                          raw_dir=tmp_path)['game_id'].tolist() == ['1']
+    assert raw_store.read('nhl', teams=['TOR'],
+                          raw_dir=tmp_path)['game_id'].tolist() == ['1', '2']
+    assert raw_store.read('nhl', end_date='2021-12-31',
+                          raw_dir=tmp_path).empty
+
+
+def test_write_days_replaces_refetched_dates(tmp_path):
+    raw_store.write_days('nst', nst_rows(['2024-01-10', '2024-01-10'],
+                                         ['TOR', 'MTL']), raw_dir=tmp_path)
+    # the watermark did not move, the next run fetches the date again
+    raw_store.write_days('nst', nst_rows(['2024-01-10', '2024-01-11',
+                                          '2024-01-10'],
+                                         ['TOR', 'BOS', 'MTL']),
+                         raw_dir=tmp_path)
+
+    df = raw_store.read('nst', raw_dir=tmp_path)
+
+    assert sorted(zip(df['date'].dt.strftime('%Y-%m-%d'), df['team'])) == [
+        ('2024-01-10', 'MTL'), ('2024-01-10', 'TOR'), ('2024-01-11', 'BOS')]
+    assert sorted(raw_store.catalog_frame(tmp_path)['part']) == [
+        '2024-01-10', '2024-01-11']
@@ -0,0 +1,74 @@
+import pandas as pd
+from schedule_poller import diff_schedule
+
+NO_CHANGES = {'upsert': [], 'predict': [], 'remove': []}
+
+
+def schedule(*games):
+    """todays_games rows, games are (game_id, home_team, away_team,
+    start_time, status) tuples"""
+    return pd.DataFrame([{'game_id': game_id,
+                          'date': '2024-01-10',
+                          'venue': 'Arena',
+                          'home_team': home_team,
+                          'away_team': away_team,
+                          'start_time': start_time,
+                          'status': status}
+                         for game_id, home_team, away_team, start_time, status
+                         in games])
+
+
+STORED = schedule(('2023020601', 'TOR', 'MTL', '2024-01-11T00:00:00Z', 'Scheduled'), # noqa
+                  ('2023020602', 'BOS', 'NYR', '2024-01-11T00:30:00Z', 'Scheduled')) # noqa
+
+
+def test_diff_schedule_without_changes():
+    assert diff_schedule(STORED, STORED.copy()) == NO_CHANGES
+
+
+def test_diff_schedule_new_game():
+    fetched = pd.concat([STORED, schedule(
+        ('2023020603', 'SEA', 'WPG', '2024-01-11T03:00:00Z', 'Scheduled'))])
+
+    assert diff_schedule(STORED, fetched) == {'upsert': ['2023020603'],
+                                              'predict': ['2023020603'],
+                                              'remove': []}
+
+
+def test_diff_schedule_changed_teams():
+    fetched = STORED.copy()
+    fetched.loc[1, 'away_team'] = 'NYI'
+
+    assert diff_schedule(STORED, fetched) == {'upsert': ['2023020602'],
+                                              'predict': ['2023020602'],
+                                              'remove': []}
+
+
+def test_diff_schedule_start_time_only():
+    fetched = STORED.copy()
+    fetched.loc[0, 'start_time'] = '2024-01-11T01:00:00Z'
+    fetched.loc[1, 'status'] = 'In Progress'
+
+    assert diff_schedule(STORED, fetched) == {'upsert': ['2023020601',
+                                                         '2023020602'],
+                                              'predict': [],
+                                              'remove': []}
+
+
+def test_diff_schedule_postponed_twice():
+    fetched = STORED.copy()
+    fetched.loc[0, 'status'] = 'Postponed'
+
+    changes = diff_schedule(STORED, fetched)
+    assert changes == {'upsert': [], 'predict': [], 'remove': ['2023020601']}
+
+    # the next poll sees the game still postponed but no longer stored
+    stored = STORED[STORED['game_id'] != '2023020601']
+    assert diff_schedule(stored, fetched) == NO_CHANGES
+
+
+def test_diff_schedule_game_left_schedule():
+    fetched = STORED.iloc[[1]]
+
+    assert diff_schedule(STORED, fetched) == {'upsert': [], 'predict': [],
+                                              'remove': ['2023020601']}
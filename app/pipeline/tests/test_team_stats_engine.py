@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+from team_stats_engine import (SUM_COLUMNS, STAT_COLUMNS, WINDOW,
+                               compare_team_stats, compute_team_stats,
+                               rolling_group_sums)
+
+
+@pytest.fixture
+def nst():
+    """nst rows of three teams with different game counts, shuffled, with
+    missing values"""
+    rng = np.random.default_rng(0)
+    frames = []
+    for team_id, (team, n_games) in enumerate([('TOR', 90), ('MTL', 45),
+                                               ('BOS', 3)], start=1):
+        df = pd.DataFrame(rng.uniform(0, 60, (n_games, len(SUM_COLUMNS))),
+                          columns=SUM_COLUMNS)
+        df['team'] = team
+        df['team_id'] = team_id
+        df['date'] = pd.date_range('2021-10-12', periods=n_games, freq='2D')
+        df['b2b'] = rng.integers(0, 2, n_games)
+        frames.append(df)
+    df = pd.concat(frames, ignore_index=True)
+    missing = rng.random((len(df), len(SUM_COLUMNS))) < 0.05
+    df[SUM_COLUMNS] = df[SUM_COLUMNS].mask(missing)
+    # windows without any value sum to NaN
+    df.loc[df['team'] == 'BOS', 'toi_pp'] = np.nan
+
+    return df.sample(frac=1, random_state=0).reset_index(drop=True)
+
+
+def pandas_sums(nst):
+    df = nst.sort_values(['team', 'date']).reset_index(drop=True)
+    sums = (df.groupby('team', sort=False)[SUM_COLUMNS]
+            .rolling(WINDOW, min_periods=1).sum()
+            .reset_index(level=0, drop=True)
+            .sort_index())
+
+    return df, sums
+
+
+def test_rolling_group_sums_match_pandas(nst):
+    df, expected = pandas_sums(nst)
+    starts = df.groupby('team', sort=False).cumcount().to_numpy()
+    group_starts = np.arange(len(df)) - starts
+
+    actual = rolling_group_sums(df[SUM_COLUMNS].to_numpy(dtype=np.float64),
+                                group_starts)
+
+    np.testing.assert_allclose(actual, expected.to_numpy(), rtol=1e-9)
+
+
+def test_compute_team_stats_matches_pandas(nst):
+    df, s = pandas_sums(nst)
+    expected = df.loc[:, ['team_id', 'date']].assign(**{
+        'ff%_5v5_last_half': s['ff_5v5'] * 100 / (s['ff_5v5'] + s['fa_5v5']),
+        'gf%_5v5_last_half': s['gf_5v5'] * 100 / (s['gf_5v5'] + s['ga_5v5']),
+        'xgf%_5v5_last_half':
+            s['xgf_5v5'] * 100 / (s['xgf_5v5'] + s['xga_5v5']),
+        'sh%_5v5_last_half': s['gf_5v5'] * 100 / s['sf_5v5'],
+        'gf_per_min_pp_last_half': s['gf_pp'] / s['toi_pp'],
+        'xgf_per_min_pp_last_half': s['xgf_pp'] / s['toi_pp'],
+        'ga_per_min_pk_last_half': s['ga_pk'] / s['toi_pk'],
+        'xga_per_min_pk_last_half': s['xga_pk'] / s['toi_pk']
+    })
+
+    actual = compute_team_stats(nst)
+
+    assert list(actual.columns) == (['team_id', 'team'] + STAT_COLUMNS
+                                    + ['date', 'b2b'])
+    assert len(actual) == len(nst)
+    assert compare_team_stats(expected, actual).empty
+
+
+def test_compare_team_stats_reports_differences(nst):
+    expected = compute_team_stats(nst)
+    actual = expected.copy()
+    actual.loc[0, 'sh%_5v5_last_half'] += 1
+    actual = actual.drop(index=1)
+
+    mismatches = compare_team_stats(expected, actual)
+
+    assert sorted(mismatches['column']) == ['_merge', 'sh%_5v5_last_half']
@@ -0,0 +1,23 @@
+import pandas as pd
+from scraping_functions import nhl_filter_games
+from teams import TEAM_IDS, add_team_ids
+
+
+def test_add_team_ids_drops_unknown_teams(capsys):
+    df = pd.DataFrame({'home_team': ['TOR', 'UTA', 'ATL'],
+                       'away_team': ['MTL', 'BOS', 'MET']})
+
+    df = add_team_ids(df, {'home_team': 'home_team_id',
+                           'away_team': 'away_team_id'})
+
+    assert df['home_team_id'].tolist() == [TEAM_IDS['TOR'], 33]
+    assert df['away_team_id'].tolist() == [TEAM_IDS['MTL'], TEAM_IDS['BOS']]
+    assert df['home_team_id'].dtype == 'int16'
+    assert "['ATL']" in capsys.readouterr().out
+
+
+def test_nhl_filter_games_keeps_regular_season_games():
+    df = pd.DataFrame({'game_id': [2024010001, 2024020001, 2024030001,
+                                   2024040001]})
+
+    assert nhl_filter_games(df)['game_id'].tolist() == ['2024020001']
@@ -0,0 +1,75 @@
+from datetime import date
+import pandas as pd
+import pytest
+from watermarks import complete_through, nhl_complete_through
+
+START = date(2024, 1, 10)
+END = date(2024, 1, 13)
+# no games on the 12th
+GAMES = {date(2024, 1, 10): 2, date(2024, 1, 11): 1, date(2024, 1, 13): 1}
+
+
+def nst_dates(rows):
+    """dates of nst rows, rows is a dict of date to number of rows"""
+    return [d.isoformat() for d, n in rows.items() for _ in range(n)]
+
+
+def test_complete_through_end():
+    dates = nst_dates({date(2024, 1, 10): 4, date(2024, 1, 11): 2,
+                       date(2024, 1, 13): 2})
+
+    assert complete_through(dates, GAMES, START, END, 2) == END
+
+
+@pytest.mark.parametrize('rows, expected', [
+    # the 11th is missing its game, the 13th does not count after it
+    ({date(2024, 1, 10): 4, date(2024, 1, 13): 2}, date(2024, 1, 10)),
+    # one of the two games of the first date
+    ({date(2024, 1, 10): 2, date(2024, 1, 11): 2, date(2024, 1, 13): 2},
+     date(2024, 1, 9)),
+    # the last date is not posted yet
+    ({date(2024, 1, 10): 4, date(2024, 1, 11): 2}, date(2024, 1, 12)),
+    ({}, date(2024, 1, 9)),
+])
+def test_complete_through_stops_before_incomplete_date(rows, expected):
+    assert complete_through(nst_dates(rows), GAMES, START, END, 2) == expected
+
+
+def test_complete_through_without_games():
+    assert complete_through([], {}, START, END, 1) == END
+
+
+def nhl_rows(statuses):
+    """nhl rows, statuses is a list of (date, status)"""
+    return pd.DataFrame({'date': [d.isoformat() for d, _ in statuses],
+                         'status': [s for _, s in statuses]})
+
+
+def test_nhl_complete_through_finished_games():
+    df = nhl_rows([(date(2024, 1, 10), 'Final'),
+                   (date(2024, 1, 11), 'Final/OT'),
+                   (date(2024, 1, 13), 'Postponed')])
+
+    assert nhl_complete_through(df, START, END) == END
+
+
+def test_nhl_complete_through_unfinished_game():
+    df = nhl_rows([(date(2024, 1, 10), 'Final'),
+                   (date(2024, 1, 11), 'In Progress'),
+                   (date(2024, 1, 13), 'Scheduled')])
+
+    assert nhl_complete_through(df, START, END) == date(2024, 1, 10)
+
+
+@pytest.mark.parametrize('start, end, expected', [
+    # a failed or empty fetch in season completes nothing
+    (START, END, date(2024, 1, 9)),
+    (date(2024, 4, 28), date(2024, 5, 2), date(2024, 4, 27)),
+    # off season dates are complete, up to the first regular season date
+    (date(2024, 7, 1), date(2024, 7, 31), date(2024, 7, 31)),
+    (date(2024, 9, 28), date(2024, 10, 3), date(2024, 9, 30)),
+])
+def test_nhl_complete_through_empty_fetch(start, end, expected):
+    df = nhl_rows([])
+
+    assert nhl_complete_through(df, start, end) == expected
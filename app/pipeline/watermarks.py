@@ -0,0 +1,181 @@
+"""Source watermarks
+
+The last date each scraped source was fully ingested through, kept in the
+source_watermarks table. daily_pull fetches every source from the day after
+its watermark to yesterday in one ranged request, so a missed run or a
+source that posted late is caught up by the next run instead of being lost.
+
+A fetched range replaces the rows the source already has for those dates,
+so re-runs never duplicate rows, and the watermarks are advanced in the same
+transaction as the load. A source's watermark only moves past a date once
+that date is complete: nhl when none of its games are still unfinished, nst
+and elo when they have rows for every finished regular season nhl game of the
+date. An nhl fetch without any game only completes the dates outside the
+regular season months, in season it is taken for a failed fetch and its
+dates are fetched again by the next run.
+"""
+
+from datetime import date, timedelta
+import pandas as pd
+from database_functions import execute_query, read_query
+
+SOURCES = ['nst', 'nhl', 'elo']
+# rows each source has per finished game
+ROWS_PER_GAME = {'nst': 2, 'elo': 1}
+# nhl statuses of games that will not be played on their date
+NOT_PLAYED_STATUSES = ['Postponed', 'Cancelled']
+# months with regular season games, October to April
+REGULAR_SEASON_MONTHS = [10, 11, 12, 1, 2, 3, 4]
+
+select_watermarks = """
+SELECT source, last_date
+FROM source_watermarks
+"""
+
+upsert_watermark = """
+INSERT INTO source_watermarks(source, last_date, updated_at)
+VALUES (:source, :last_date, now())
+ON CONFLICT (source) DO UPDATE SET
+	last_date = EXCLUDED.last_date,
+	updated_at = EXCLUDED.updated_at
+"""
+
+# rows of a source in a fetched range, replaced by the fetched rows
+delete_range = """
+DELETE FROM {table}
+WHERE "date" BETWEEN :start_date AND :end_date
+"""
+
+# regular season games only, nst and elo have no rows for the others, ex.
+# All-Star games
+finished_games = """
+SELECT "date", COUNT(*) AS games
+FROM nhl
+WHERE "date" BETWEEN :start_date AND :end_date
+AND status LIKE 'Final%'
+AND substr(game_id, 5, 2) = '02'
+GROUP BY "date"
+"""
+
+# derived rows built from before a late arriving date are rebuilt by the
+# next incremental builds
+rewind_derived = """
+DELETE FROM team_stats WHERE "date" >= :first_date;
+DELETE FROM features WHERE "date" >= :first_date;
+DELETE FROM feature_builds WHERE high_water_date >= :first_date;
+"""
+
+
+def read_watermarks(uri):
+    """Returns a dict of source to its watermark date, None for sources
+    without one"""
+    df = read_query(uri=uri, query=select_watermarks, date_fields=None)
+    watermarks = dict.fromkeys(SOURCES)
+    for source, last_date in zip(df['source'], df['last_date']):
+        watermarks[source] = pd.Timestamp(last_date).date()
+
+    return watermarks
+
+
+def fetch_range(watermark, day):
+    """Returns the (start, end) dates to fetch for a source on the run of
+    day, start is after end when the source is up to date
+
+    Parameters
+    ----------
+    watermark - the source's watermark date, None to fetch only yesterday
+    day - date of the run
+    """
+    end = day - timedelta(days=1)
+    if watermark is None:
+        return end, end
+
+    return watermark + timedelta(days=1), end
+
+
+def replace_range(uri, table, start, end):
+    """Deletes a table's rows from start to end, before loading a fetched
+    range"""
+    execute_query(uri=uri,
+                  query=delete_range.format(table=table),
+                  params={'start_date': start, 'end_date': end})
+
+
+def complete_through(dates, games, start, end, rows_per_game):
+    """Returns the last date from start to end through which every date has
+    at least rows_per_game rows per finished game, the day before start if
+    start is incomplete
+
+    Parameters
+    ----------
+    dates - dates of the source's rows
+    games - dict of date to number of finished games
+    start - first date of the range
+    end - last date of the range
+    rows_per_game - rows the source has per game
+    """
+    rows = pd.Series(pd.to_datetime(pd.Series(dates, dtype=object))
+                     .dt.date).value_counts()
+    for day in pd.date_range(start, end).date:
+        if rows.get(day, 0) < rows_per_game * games.get(day, 0):
+            return day - timedelta(days=1)
+
+    return end
+
+
+def nhl_complete_through(nhl_data, start, end):
+    """Returns the day before the first date with a game that is neither
+    finished nor called off, end if there is none. Without any game, the day
+    before the first regular season date of the range, end if it has none.
+
+    Parameters
+    ----------
+    nhl_data - nhl rows fetched for the range
+    start - first date of the range
+    end - last date of the range
+    """
+    if nhl_data.empty:
+        for day in pd.date_range(start, end).date:
+            if day.month in REGULAR_SEASON_MONTHS:
+                return day - timedelta(days=1)
+        return end
+    unfinished = nhl_data[~nhl_data['status'].str.startswith('Final')
+                          & ~nhl_data['status'].isin(NOT_PLAYED_STATUSES)]
+    if unfinished.empty:
+        return end
+
+    return pd.to_datetime(unfinished['date']).min().date() - timedelta(days=1)
+
+
+def finished_games_by_date(uri, start, end):
+    """Returns a dict of date to the number of finished games in the nhl
+    table"""
+    df = read_query(uri=uri,
+                    query=finished_games,
+                    date_fields=None,
+                    params={'start_date': start, 'end_date': end})
+
+    return {pd.Timestamp(d).date(): int(g)
+            for d, g in zip(df['date'], df['games'])}
+
+
+def save_watermark(uri, source, last_date):
+    execute_query(uri=uri,
+                  query=upsert_watermark,
+                  params={'source': source, 'last_date': last_date})
+
+
+def rewind(uri, first_date):
+    """Removes the team_stats, features and feature build rows from
+    first_date on, so rows loaded for dates that were already built are
+    included in the next builds"""
+    execute_query(uri=uri,
+                  query=rewind_derived,
+                  params={'first_date': first_date})
+
+
+def seed(uri, last_date=None):
+    """Sets every source's watermark, ex. to the end of a backfill"""
+    last_date = last_date or date.today() - timedelta(days=1)
+    for source in SOURCES:
+        save_watermark(uri, source, last_date)